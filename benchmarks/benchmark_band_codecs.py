@@ -0,0 +1,64 @@
+""" Report compression ratio and full-band read/write throughput of
+CompressedBand for several blosc codec, level, shuffle, and chunk size
+settings on synthetic rasters.
+
+Usage: python benchmark_band_codecs.py [size]
+"""
+import sys
+import time
+import blosc
+import numpy as np
+from karta.raster.band import CompressedBand
+from karta.raster.misc import witch_of_agnesi
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+np.random.seed(49)
+
+dem = witch_of_agnesi(n, n, a=n/6.0) * 1000.0
+rasters = [
+    ("dem (float64)", dem),
+    ("dem (int16)", dem.astype(np.int16)),
+    ("landcover (uint8)", np.digitize(dem, np.linspace(dem.min(), dem.max(), 8)).astype(np.uint8)),
+    ("model (float32)", (dem + 50*np.random.randn(n, n)).astype(np.float32)),
+]
+
+codecs = [c for c in ("blosclz", "lz4", "lz4hc", "zlib", "zstd")
+          if c in blosc.compressor_list()]
+levels = (1, 5, 9)
+shuffles = (("none", blosc.NOSHUFFLE), ("byte", blosc.SHUFFLE),
+            ("bit", blosc.BITSHUFFLE))
+chunksizes = ((256, 256), (512, 512))
+
+def timed(func):
+    t0 = time.time()
+    func()
+    return time.time() - t0
+
+for name, values in rasters:
+    mb = values.nbytes / 1024.0**2
+    print("{0}: {1}x{2}, {3:.1f} MB".format(name, n, n, mb))
+    print("{0:>8s} {1:>5s} {2:>7s} {3:>10s} {4:>8s} {5:>12s} {6:>12s}".format(
+        "codec", "level", "shuffle", "chunks", "ratio", "write MB/s", "read MB/s"))
+
+    for cname in codecs:
+        for clevel in levels:
+            for shufname, shuffle in shuffles:
+                for chunksize in chunksizes:
+                    band = CompressedBand(values.shape, values.dtype.type,
+                                          chunksize=chunksize, cname=cname,
+                                          clevel=clevel, shuffle=shuffle,
+                                          cachesize=0)
+
+                    def write():
+                        band[:,:] = values
+
+                    def read():
+                        return band[:,:]
+
+                    tw = timed(write)
+                    tr = timed(read)
+                    ratio = values.nbytes / float(max(band.nbytes, 1))
+                    print("{0:>8s} {1:>5d} {2:>7s} {3:>10s} {4:>8.1f} {5:>12.0f} {6:>12.0f}".format(
+                        cname, clevel, shufname, "{0}x{1}".format(*chunksize),
+                        ratio, mb/tw, mb/tr))
+    print("")
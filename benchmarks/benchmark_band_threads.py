@@ -0,0 +1,45 @@
+""" Time full-band reads and writes on a CompressedBand as the number of
+chunk compression threads increases.
+
+Usage: python benchmark_band_threads.py [size] [maxthreads]
+"""
+import sys
+import time
+import multiprocessing
+import numpy as np
+from karta.raster.band import CompressedBand
+from karta.raster.misc import witch_of_agnesi
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+maxthreads = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+
+np.random.seed(49)
+values = witch_of_agnesi(n, n, a=n/8.0) + 0.01*np.random.rand(n, n)
+
+def best_of(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        func()
+        dt = time.time() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+print("{0}x{1} float64 ({2:.0f} MB)".format(n, n, values.nbytes/1024.0**2))
+print("threads      set (s)     get (s)")
+
+nthreads = 1
+while nthreads <= maxthreads:
+    band = CompressedBand((n, n), np.float64, cachesize=0, nthreads=nthreads)
+
+    def setfull():
+        band[:,:] = values
+
+    def getfull():
+        return band[:,:]
+
+    tset = best_of(setfull)
+    tget = best_of(getfull)
+    print("{0:>7d} {1:>12.3f} {2:>11.3f}".format(nthreads, tset, tget))
+    nthreads *= 2
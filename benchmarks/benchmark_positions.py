@@ -0,0 +1,59 @@
+""" Time RegularGrid.get_positions for increasing numbers of points, on one
+thread and split between threads writing into shared output arrays.
+
+Usage: python benchmark_positions.py [maxpoints] [nthreads]
+
+The default largest case is 10^7 points; pass 100000000 to include 10^8
+points (about 3.2 GB of inputs and outputs).
+"""
+import sys
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import karta
+
+maxpoints = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**7
+nthreads = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+
+grid = karta.RegularGrid([500.0, -300.0, 30.0, 30.0, 2.0, -1.5],
+                         values=np.zeros((4000, 4000)))
+
+def best_of(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        func()
+        dt = time.time() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+print("     points   1 thread (s)   Mpts/s   {0} threads (s)   Mpts/s".format(nthreads))
+
+pool = ThreadPool(nthreads)
+npts = 10**6
+while npts <= maxpoints:
+    np.random.seed(49)
+    x = 500.0 + 120000.0*np.random.rand(npts)
+    y = -300.0 + 120000.0*np.random.rand(npts)
+    i = np.empty(npts)
+    j = np.empty(npts)
+
+    def serial():
+        grid.get_positions(x, y, out=(i, j))
+
+    def threaded():
+        bounds = np.linspace(0, npts, nthreads+1).astype(int)
+        def work(k):
+            a, b = bounds[k], bounds[k+1]
+            grid.get_positions(x[a:b], y[a:b], out=(i[a:b], j[a:b]))
+        pool.map(work, range(nthreads))
+
+    t1 = best_of(serial)
+    tn = best_of(threaded)
+    print("{0:>11d} {1:>14.3f} {2:>8.0f} {3:>17.3f} {4:>8.0f}".format(
+        npts, t1, npts/t1/1e6, tn, npts/tn/1e6))
+    npts *= 10
+
+pool.close()
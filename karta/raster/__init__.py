@@ -11,15 +11,17 @@ numbers.Integral.register(numpy.integer)
 from . import grid
 from . import misc
 
-from .grid import RegularGrid, WarpedGrid, merge, gridpoints, mask_poly
-from .band import SimpleBand, CompressedBand
-from .read import read_aai, read_gtiff, aairead, gtiffread
+from .grid import (RegularGrid, WarpedGrid, merge, gridpoints, mask_poly,
+                   rasterize, PointAccumulator)
+from .band import (SimpleBand, CompressedBand, MmapBand, BandWindow,
+                   InterleavedBand)
+from .read import read_aai, read_gtiff, read_chunkstore, aairead, gtiffread
 from .misc import (witch_of_agnesi, pad, normed_potential_vectors,
-                   slope, aspect, gradient, divergence, hillshade)
+                   slope, aspect, gradient, divergence, hillshade, contour)
 
 __all__ = ["grid", "misc",
            "RegularGrid", "WarpedGrid",
-           "aairead", "gtiffread", "read_aai", "read_gtiff",
-           "slope", "aspect", "gradient", "divergence", "hillshade",
+           "aairead", "gtiffread", "read_aai", "read_gtiff", "read_chunkstore",
+           "slope", "aspect", "gradient", "divergence", "hillshade", "contour",
            "normed_potential_vectors"]
 
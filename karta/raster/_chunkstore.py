@@ -0,0 +1,249 @@
+""" Native on-disk format for chunked, compressed grids.
+
+A chunk store is a directory containing a JSON header (``header.json``) and a
+subdirectory per band holding one blosc-compressed file per chunk. Chunks
+holding a single value are recorded in the header instead of written, and
+chunks that were never set are omitted. Opening a chunk store reads only the
+header; chunk files are read as they are accessed.
+"""
+
+import os
+import json
+import shutil
+import struct
+import blosc
+import numpy as np
+from .band import CompressedBand
+from .. import errors
+from ..crs import Cartesian, GeographicalCRS, ProjectedCRS
+
+FORMAT = "karta-chunkstore"
+VERSION = 1
+HEADER = "header.json"
+
+class ChunkFile(object):
+    """ Reference to a compressed chunk held in a file, read on demand. If
+    *nbytes* is given, the blosc header of the file is checked against it
+    before the chunk is returned for decompression. """
+    __slots__ = ("path", "nbytes")
+
+    def __init__(self, path, nbytes=None):
+        self.path = path
+        self.nbytes = nbytes
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if self.nbytes is not None:
+            # blosc header: version, versionlz, flags, typesize, then the
+            # uncompressed, block, and compressed sizes as little-endian uint32
+            if len(data) < 16:
+                raise errors.GridIOError("chunk file {0} is truncated"
+                                         .format(self.path))
+            nbytes, _, cbytes = struct.unpack("<III", data[4:16])
+            if nbytes != self.nbytes or cbytes != len(data):
+                raise errors.GridIOError("chunk file {0} is corrupt: header "
+                                         "gives {1} bytes compressed to {2}, "
+                                         "expected {3} bytes compressed to {4}"
+                                         .format(self.path, nbytes, cbytes,
+                                                 self.nbytes, len(data)))
+        return data
+
+def crs_to_dict(crs):
+    """ Return a JSON-serializable description of *crs* """
+    return {"proj4": crs.get_proj4(),
+            "name": crs.name,
+            "geographical": isinstance(crs, GeographicalCRS)}
+
+def crs_from_dict(d):
+    """ Rebuild a CRS from the output of `crs_to_dict` """
+    if d["proj4"] == "":
+        return Cartesian
+    elif d["geographical"]:
+        tokens = [t for t in d["proj4"].split() if not t.startswith("+proj=")]
+        spheroid = " ".join(t for t in tokens if not t.startswith("+datum="))
+        datum = " ".join(t for t in tokens if t.startswith("+datum="))
+        return GeographicalCRS(spheroid, d["name"], datum=datum)
+    else:
+        return ProjectedCRS(d["proj4"], name=d["name"])
+
+def _pyscalar(value):
+    """ Convert numpy scalars to Python scalars for JSON """
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def _backed_by(band, path):
+    path = os.path.abspath(path)
+    for data in getattr(band, "_data", ()):
+        if isinstance(data, ChunkFile) and \
+                os.path.abspath(data.path).startswith(path + os.sep):
+            return True
+    return False
+
+def _write_compressed(banddir, band):
+    """ Write the chunks of a CompressedBand as they are stored. """
+    band.flush()
+    files = []
+    uniform = []
+    written = {}
+    for index, status in enumerate(band.chunkstatus):
+        if status == band.CHUNKUNIFORM:
+            uniform.append([index, _pyscalar(band._data[index])])
+        elif status == band.CHUNKSET:
+            data = band._data[index]
+            key = data.path if isinstance(data, ChunkFile) else id(data)
+            name = written.get(key, None)
+            if name is None:
+                if isinstance(data, ChunkFile):
+                    data = data.read()
+                name = str(index)
+                with open(os.path.join(banddir, name), "wb") as f:
+                    f.write(data)
+                written[key] = name
+            files.append([index, name])
+
+    return {"size": list(band.size),
+            "dtype": np.dtype(band.dtype).str,
+            "chunksize": list(band._chunksize),
+            "cname": band.cname,
+            "clevel": band.clevel,
+            "shuffle": band.shuffle,
+            "fillvalue": _pyscalar(band._fillvalue),
+            "files": files,
+            "uniform": uniform}
+
+def _write_generic(banddir, band, chunksize, cname, clevel, shuffle, fillvalue):
+    """ Read any band type window by window and write it as chunks. """
+    ny, nx = band.size
+    dtype = np.dtype(band.dtype)
+    files = []
+    uniform = []
+    chunk = np.empty(chunksize, dtype=dtype)
+    nchunkcols = int(np.ceil(float(nx)/chunksize[1]))
+
+    for y0 in range(0, ny, chunksize[0]):
+        y1 = min(y0+chunksize[0], ny)
+        for x0 in range(0, nx, chunksize[1]):
+            x1 = min(x0+chunksize[1], nx)
+            index = (y0//chunksize[0])*nchunkcols + x0//chunksize[1]
+            block = np.asarray(band[y0:y1, x0:x1]).reshape(y1-y0, x1-x0)
+
+            first = block.flat[0]
+            if (first != first and np.isnan(block).all()) or (block == first).all():
+                uniform.append([index, _pyscalar(first)])
+                continue
+
+            chunk.fill(fillvalue)
+            chunk[:y1-y0, :x1-x0] = block
+            compressed = blosc.compress_ptr(chunk.__array_interface__["data"][0],
+                                            chunk.size, dtype.itemsize,
+                                            clevel=clevel, shuffle=shuffle,
+                                            cname=cname)
+            name = str(index)
+            with open(os.path.join(banddir, name), "wb") as f:
+                f.write(compressed)
+            files.append([index, name])
+
+    return {"size": [ny, nx],
+            "dtype": dtype.str,
+            "chunksize": list(chunksize),
+            "cname": cname,
+            "clevel": clevel,
+            "shuffle": shuffle,
+            "fillvalue": _pyscalar(fillvalue),
+            "files": files,
+            "uniform": uniform}
+
+def write(path, grid, chunksize=(256, 256), cname="blosclz", clevel=9,
+          shuffle=blosc.SHUFFLE):
+    """ Write *grid* to a chunk store directory at *path*.
+
+    CompressedBand bands are written using their existing chunk layout and
+    compression settings without being recompressed. Other band types are
+    chunked with *chunksize* and compressed using *cname*, *clevel*, and
+    *shuffle*.
+    """
+    if os.path.exists(path) and not os.path.isdir(path):
+        raise errors.GridIOError("{0} exists and is not a directory".format(path))
+    if any(_backed_by(band, path) for band in grid.bands):
+        raise errors.GridIOError("cannot overwrite the chunk store backing "
+                                 "this grid")
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    hdrpath = os.path.join(path, HEADER)
+    if os.path.isfile(hdrpath):
+        os.remove(hdrpath)
+
+    # remove bands left over from a previous store with more bands
+    for name in os.listdir(path):
+        if name.startswith("band") and name[4:].isdigit() and \
+                int(name[4:]) >= len(grid.bands):
+            shutil.rmtree(os.path.join(path, name))
+
+    bandhdrs = []
+    for i, band in enumerate(grid.bands):
+        banddir = os.path.join(path, "band{0}".format(i))
+        if os.path.isdir(banddir):
+            shutil.rmtree(banddir)
+        os.mkdir(banddir)
+
+        if isinstance(band, CompressedBand):
+            bandhdrs.append(_write_compressed(banddir, band))
+        else:
+            fillvalue = 0 if np.isnan(grid.nodata) and \
+                    not np.issubdtype(band.dtype, np.floating) else grid.nodata
+            bandhdrs.append(_write_generic(banddir, band, chunksize, cname,
+                                           clevel, shuffle, fillvalue))
+
+    # The header is written last, so an interrupted write is not readable
+    header = {"format": FORMAT,
+              "version": VERSION,
+              "transform": list(grid.transform),
+              "crs": crs_to_dict(grid.crs),
+              "nodata": _pyscalar(grid.nodata),
+              "bands": bandhdrs}
+    with open(hdrpath, "w") as f:
+        json.dump(header, f)
+    return
+
+def read(path, cachesize=None, nthreads=None):
+    """ Open a chunk store directory. No chunk data is read until it is
+    accessed.
+
+    Returns a list of CompressedBand instances and a header dictionary.
+    """
+    hdrpath = os.path.join(path, HEADER)
+    if not os.path.isfile(hdrpath):
+        raise errors.GridIOError("{0} is not a chunk store".format(path))
+    with open(hdrpath, "r") as f:
+        hdr = json.load(f)
+    if hdr.get("format", None) != FORMAT:
+        raise errors.GridIOError("{0} is not a chunk store".format(path))
+    if hdr["version"] > VERSION:
+        raise errors.GridIOError("chunk store version {0} not supported"
+                                 .format(hdr["version"]))
+
+    bands = []
+    for i, bhdr in enumerate(hdr["bands"]):
+        banddir = os.path.join(path, "band{0}".format(i))
+        dtype = np.dtype(bhdr["dtype"]).type
+        nbytes = int(np.prod(bhdr["chunksize"]))*np.dtype(dtype).itemsize
+        band = CompressedBand(tuple(bhdr["size"]), dtype,
+                              chunksize=tuple(bhdr["chunksize"]),
+                              initval=bhdr["fillvalue"],
+                              cachesize=cachesize, nthreads=nthreads,
+                              cname=bhdr["cname"], clevel=bhdr["clevel"],
+                              shuffle=bhdr["shuffle"])
+        files = {}
+        for index, name in bhdr["files"]:
+            if name not in files:
+                files[name] = ChunkFile(os.path.join(banddir, name), nbytes)
+            band._data[index] = files[name]
+            band.chunkstatus[index] = band.CHUNKSET
+        for index, value in bhdr["uniform"]:
+            band._data[index] = dtype(value)
+            band.chunkstatus[index] = band.CHUNKUNIFORM
+        bands.append(band)
+    return bands, hdr
@@ -3,7 +3,7 @@
 import struct
 import sys
 import numpy as np
-from .band import SimpleBand, CompressedBand
+from .band import SimpleBand, CompressedBand, InterleavedBand
 from .. import errors
 
 try:
@@ -185,7 +185,7 @@ def gdal_type(dtype):
     else:
         raise TypeError("GDAL equivalent to type {0} unknown".format(dtype))
 
-def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand):
+def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand, bandkwargs=None):
     """ Read a GeoTiff file and return a numpy array and a dictionary of header
     information.
 
@@ -198,7 +198,9 @@ def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand):
     ibands : int or list of ints
         band number (1...)
     bandclass : karta.raster.band class
-        if *in_memory* is `False`, use this class for band storage
+        if *in_memory* is `True`, use this class for band storage
+    bandkwargs : dict, optional
+        additional keyword arguments for creating bands of *bandclass*
 
     Returns an band object and a dictionary of metadata
     """
@@ -244,10 +246,24 @@ def read(fnm, in_memory, ibands=ALL, bandclass=CompressedBand):
 
         if in_memory:
             dtype = numpy_dtype(rasterbands[0].DataType)
-            bands = [bandclass((ny, nx), dtype) for _ in ibands]
-            for i, rb in enumerate(rasterbands):
-                _arr = rb.ReadAsArray(buf_obj=np.empty([ny, nx], dtype=dtype))
-                bands[i][:,:] = _arr.squeeze()[::-1]
+            if bandkwargs is None:
+                bandkwargs = {}
+            if issubclass(bandclass, InterleavedBand):
+                # Read strips of all bands, so that each chunk is written once
+                store = bandclass((ny, nx), dtype, nbands=len(rasterbands),
+                                  **bandkwargs)
+                nrows = store._chunksize[0]
+                for r0 in range(0, ny, nrows):
+                    r1 = min(r0+nrows, ny)
+                    strip = np.dstack([rb.ReadAsArray(0, r0, nx, r1-r0)
+                                       for rb in rasterbands])
+                    store[ny-r1:ny-r0,:] = strip[::-1]
+                bands = store.components()
+            else:
+                bands = [bandclass((ny, nx), dtype, **bandkwargs) for _ in ibands]
+                for i, rb in enumerate(rasterbands):
+                    _arr = rb.ReadAsArray(buf_obj=np.empty([ny, nx], dtype=dtype))
+                    bands[i][:,:] = _arr.squeeze()[::-1]
         else:
             bands = [GdalFileBand(rb, dataset) for rb in rasterbands]
 
@@ -0,0 +1,178 @@
+""" Block aggregation and reduced-resolution overviews of raster bands """
+
+import numpy as np
+from .band import _isdata
+
+METHODS = ("mean", "nearest", "mode", "min", "max")
+
+# Methods for aggregating cells into coarser grids with `resample`
+AGGREGATES = ("mean", "sum", "min", "max", "mode", "count")
+
+def _windows(values, fy, fx, nodata):
+    """ Return an (my, mx, fy*fx) array of the *fy* by *fx* windows of
+    *values*, padding partial windows at the bottom and right with *nodata*.
+    """
+    ny, nx = values.shape
+    my = -(-ny // fy)
+    mx = -(-nx // fx)
+    if (my*fy, mx*fx) != (ny, nx):
+        padded = np.empty((my*fy, mx*fx), dtype=values.dtype)
+        padded.fill(nodata)
+        padded[:ny,:nx] = values
+        values = padded
+    return values.reshape(my, fy, mx, fx).swapaxes(1, 2).reshape(my, mx, fy*fx)
+
+def _mode(windows, valid):
+    """ Return the most common valid value in each window, preferring the
+    smallest value in a tie. """
+    order = np.argsort(windows, axis=-1, kind="mergesort")
+    s = np.take_along_axis(windows, order, axis=-1)
+    v = np.take_along_axis(valid, order, axis=-1)
+
+    # length of the run of equal values ending at each position
+    n = s.shape[-1]
+    pos = np.broadcast_to(np.arange(n), s.shape)
+    newrun = np.ones(s.shape, dtype=np.bool_)
+    newrun[...,1:] = s[...,1:] != s[...,:-1]
+    runstart = np.maximum.accumulate(np.where(newrun, pos, 0), axis=-1)
+    runlength = np.where(v, pos - runstart + 1, 0)
+
+    imax = runlength.argmax(axis=-1)
+    return np.take_along_axis(s, imax[...,np.newaxis], axis=-1)[...,0]
+
+def aggregate(values, fy, fx, method, nodata):
+    """ Reduce a 2D array by aggregating *fy* by *fx* windows of cells, ignoring
+    cells equal to *nodata*.
+
+    Parameters
+    ----------
+    values : ndarray
+    fy, fx : int
+        window dimensions. Partial windows at the bottom and right edges are
+        aggregated from the cells they contain.
+    method : str
+        "mean", "nearest" (the first cell of each window), "mode", "min",
+        "max", "sum", or "count" (the number of valid cells)
+    nodata : number
+        value of missing cells, and of output cells with no valid input
+
+    Returns
+    -------
+    ndarray with the dtype of *values*, except that sums are float64 and
+    counts are int32. Integer means are rounded.
+    """
+    if method == "nearest":
+        return values[::fy,::fx].copy()
+    elif method not in METHODS + ("sum", "count"):
+        raise ValueError("aggregation method must be one of "
+                         "{0}".format(METHODS + ("sum", "count")))
+
+    windows = _windows(values, fy, fx, nodata)
+    valid = _isdata(windows, nodata)
+    count = valid.sum(axis=-1)
+
+    if method == "count":
+        return count.astype(np.int32)
+    elif method in ("mean", "sum"):
+        total = np.where(valid, windows, 0).sum(axis=-1, dtype=np.float64)
+        if method == "sum":
+            return np.where(count == 0, nodata, total)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = total / count
+        if not np.issubdtype(values.dtype, np.floating):
+            out = np.round(out)
+    elif method == "mode":
+        out = _mode(windows, valid)
+    else:
+        masked = np.ma.masked_array(windows, mask=~valid)
+        if method == "min":
+            out = masked.min(axis=-1).filled(0)
+        else:
+            out = masked.max(axis=-1).filled(0)
+
+    out = np.where(count == 0, nodata, out)
+    return out.astype(values.dtype)
+
+def aggregate_indexed(values, rows, cols, shape, method, nodata):
+    """ Reduce a 2D array into an array of *shape*, aggregating the cells that
+    the index arrays *rows* and *cols* assign to each output row and column,
+    and ignoring cells equal to *nodata*. This handles windows of varying
+    size, as when aggregating by a non-integer factor.
+
+    Parameters
+    ----------
+    values : ndarray
+    rows, cols : ndarray of int
+        output row of each row of *values*, and output column of each column
+    shape : tuple of int
+        output dimensions
+    method : str
+        "mean", "sum", "min", "max", "mode", or "count"
+    nodata : number
+
+    Returns
+    -------
+    ndarray with the same dtypes as `aggregate`
+    """
+    if method not in AGGREGATES:
+        raise ValueError("aggregation method must be one of {0}".format(AGGREGATES))
+    n = shape[0]*shape[1]
+    keys = (rows[:,np.newaxis]*shape[1] + cols[np.newaxis,:]).ravel()
+    v = values.ravel()
+    valid = _isdata(v, nodata)
+    keys = keys[valid]
+    v = v[valid]
+    count = np.bincount(keys, minlength=n)
+
+    if method == "count":
+        return count.astype(np.int32).reshape(shape)
+    elif method in ("mean", "sum"):
+        out = np.bincount(keys, weights=v, minlength=n)
+        if method == "mean":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out = out / count
+            if not np.issubdtype(values.dtype, np.floating):
+                out = np.round(out).astype(values.dtype)
+    else:
+        out = np.zeros(n, dtype=values.dtype)
+        if method == "mode":
+            order = np.lexsort((v, keys))
+        else:
+            order = np.argsort(keys, kind="mergesort")
+        k = keys[order]
+        s = v[order]
+        if len(k) != 0:
+            newkey = np.r_[True, k[1:] != k[:-1]]
+            if method == "min":
+                starts = np.flatnonzero(newkey)
+                out[k[starts]] = np.minimum.reduceat(s, starts)
+            elif method == "max":
+                starts = np.flatnonzero(newkey)
+                out[k[starts]] = np.maximum.reduceat(s, starts)
+            else:
+                # runs of equal values within each output cell, ordered by
+                # cell, decreasing length and increasing value
+                runs = np.flatnonzero(newkey | np.r_[True, s[1:] != s[:-1]])
+                runlength = np.diff(np.r_[runs, len(k)])
+                runkey = k[runs]
+                runvalue = s[runs]
+                best = np.lexsort((runvalue, -runlength, runkey))
+                first = np.r_[True, runkey[best][1:] != runkey[best][:-1]]
+                out[runkey[best][first]] = runvalue[best][first]
+
+    out = np.where(count == 0, nodata, out).astype(out.dtype)
+    return out.reshape(shape)
+
+def build_level(src, dst, method, nodata, blocksize=(512, 512)):
+    """ Fill band *dst* by aggregating 2x2 windows of band *src*, reading
+    *src* in blocks of *blocksize* (which must have even dimensions). """
+    ny, nx = src.size
+    by, bx = blocksize
+    for y0 in range(0, ny, by):
+        y1 = min(y0+by, ny)
+        for x0 in range(0, nx, bx):
+            x1 = min(x0+bx, nx)
+            values = np.asarray(src[y0:y1, x0:x1]).reshape(y1-y0, x1-x0)
+            block = aggregate(values, 2, 2, method, nodata)
+            dst[y0//2:y0//2+block.shape[0], x0//2:x0//2+block.shape[1]] = block
+    return
@@ -9,32 +9,82 @@ Overview
 `SimpleBand` use numpy arrays for data storage
 
 `CompressedBand` uses blosc compression to reduce in-memory footprint
+
+`MmapBand` uses a memory-mapped file for data larger than memory
+
+`InterleavedBand` compresses several bands together, pixel-interleaved
+
+`ChunkCache` holds recently used decompressed chunks of a `CompressedBand`
 """
 
+import os
+import atexit
+import tempfile
+import threading
 import blosc
 import numpy as np
 from math import ceil
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+# Default byte budget for each CompressedBand's cache of decompressed chunks.
+# May be modified at runtime to change the cache size of subsequently created
+# bands. Set to zero to disable caching.
+CHUNKCACHE_DEFAULT = 32 * 1024**2
+
+# Default number of threads each CompressedBand uses to compress and decompress
+# chunks when reading or writing regions spanning several chunks. A value of
+# one processes chunks serially in the calling thread.
+CHUNKTHREADS_DEFAULT = 1
+
+_THREADPOOLS = {}
+_BUFFER_LOCK = threading.Lock()
+_SCRATCH = threading.local()
+
+# Directory in which MmapBand creates scratch files. If None, the system
+# temporary directory is used.
+MMAP_TEMPDIR = None
 
 class BandIndexer(object):
 
     def __init__(self, bands):
         self.bands = bands
 
+    def _interleaved(self):
+        """ Return the InterleavedBand holding exactly the indexed bands in
+        order, or None. """
+        store = getattr(self.bands[0], "store", None)
+        if not isinstance(store, InterleavedBand) or \
+                store.nbands != len(self.bands):
+            return None
+        for i, band in enumerate(self.bands):
+            if getattr(band, "store", None) is not store or band.index != i:
+                return None
+        return store
+
     def __getitem__(self, key):
         if len(self.bands) == 1:
             if isinstance(key, np.ndarray):
-                return self.bands[0][:,:][key]
+                return _getmasked(self.bands[0], key)
             else:
                 return self.bands[0][key]
         else:
+            store = self._interleaved()
             if isinstance(key, np.ndarray):
-                return np.dstack([b[:,:][key] for b in self.bands])
+                if store is not None and _supports_masking(store, key):
+                    return store.getmasked(key)[np.newaxis]
+                return np.dstack([_getmasked(b, key) for b in self.bands])
             else:
                 if len(key) not in (2, 3):
                     raise IndexError("indexing tuple must have length 2 or 3")
                 sr, sc = key[:2]
                 sb = slice(None, None, None) if len(key) == 2 else key[2]
-                if isinstance(sb, slice):
+                if store is not None and isinstance(sb, slice):
+                    values = store[sr,sc]
+                    if values.ndim == 1:
+                        values = values.reshape(1, 1, -1)
+                    return values[...,sb]
+                elif isinstance(sb, slice):
                     return np.dstack([b[sr,sc] for b in self.bands[sb]])
                 else:
                     return self.bands[sb][sr,sc]
@@ -42,23 +92,23 @@ class BandIndexer(object):
     def __setitem__(self, key, value):
         if len(self.bands) == 1:
             if isinstance(key, np.ndarray):
-                tmp = self.bands[0][:,:]
-                tmp[key] = value
-                self.bands[0][:,:] = tmp
+                _setmasked(self.bands[0], key, value)
             else:
                 self.bands[0][key] = value
         else:
             if isinstance(key, np.ndarray):
                 for b, v in zip(self.bands, value):
-                    tmp = b[:,:]
-                    tmp[key] = v
-                    b[:,:] = tmp
+                    _setmasked(b, key, v)
             else:
                 if len(key) not in (2, 3):
                     raise IndexError("indexing tuple must have length 2 or 3")
                 sr, sc = key[:2]
                 sb = slice(None, None, None) if len(key) == 2 else key[2]
-                if isinstance(sb, slice):
+                store = self._interleaved()
+                if store is not None and sb == slice(None, None, None) and \
+                        np.ndim(value) == 3:
+                    store[sr,sc] = value
+                elif isinstance(sb, slice):
                     if len(value.shape) == 3:
                         for i in range(len(self.bands)):
                             self.bands[i][sr,sc] = value[:,:,i]
@@ -70,12 +120,26 @@ class BandIndexer(object):
         return
 
     def __iter__(self):
+        store = self._interleaved() if len(self.bands) > 1 else None
         for i in range(self.bands[0].size[0]):
             if len(self.bands) == 1:
                 yield self.bands[0][i,:]
+            elif store is not None:
+                yield store[i,:][0].T
             else:
                 yield np.vstack([b[i,:] for b in self.bands])
 
+    def getpoints(self, rows, cols):
+        """ Return the values at the cells (*rows[k]*, *cols[k]*) of the
+        one-dimensional index arrays *rows* and *cols*, with a trailing band
+        dimension for multiple bands. """
+        if len(self.bands) == 1:
+            return _getpoints(self.bands[0], rows, cols)
+        store = self._interleaved()
+        if store is not None:
+            return store.getpoints(rows, cols)
+        return np.column_stack([_getpoints(b, rows, cols) for b in self.bands])
+
     @property
     def shape(self):
         """ Returns the dimensions of raster bands. If there is a single
@@ -87,15 +151,54 @@ class BandIndexer(object):
         elif len(self.bands) == 1:
             return self.bands[0].size
         else:
-            return (len(self.bands), self.bands[0].size[0], self.bands.size[1])
+            return (len(self.bands), self.bands[0].size[0], self.bands[0].size[1])
 
     @property
     def dtype(self):
         """ Returns bands' dtype """
         return self.bands[0].dtype
 
+def _supports_masking(band, mask):
+    return (hasattr(band, "getmasked") and mask.dtype == np.bool_ and
+            mask.shape == tuple(band.size))
+
+def _getmasked(band, mask):
+    """ Return the values of *band* where *mask* is True """
+    if _supports_masking(band, mask):
+        return band.getmasked(mask)
+    else:
+        return band[:,:][mask]
+
+def _setmasked(band, mask, value):
+    """ Set the values of *band* where *mask* is True """
+    if _supports_masking(band, mask):
+        band.setmasked(mask, value)
+    else:
+        tmp = band[:,:]
+        tmp[mask] = value
+        band[:,:] = tmp
+    return
+
+def _getpoints(band, rows, cols):
+    """ Return the values of *band* at the cells (*rows[k]*, *cols[k]*) """
+    rows = np.asarray(rows, dtype=np.intp)
+    cols = np.asarray(cols, dtype=np.intp)
+    if hasattr(band, "getpoints"):
+        return band.getpoints(rows, cols)
+    elif len(rows) == 0:
+        return np.empty(0, dtype=band.dtype)
+    r0, r1 = rows.min(), rows.max()+1
+    c0, c1 = cols.min(), cols.max()+1
+    block = np.asarray(band[r0:r1, c0:c1]).reshape(r1-r0, c1-c0)
+    return block[rows-r0, cols-c0]
+
 class SimpleBand(object):
-    """ SimpleBand wraps a numpy.ndarray for storage. """
+    """ SimpleBand wraps a numpy.ndarray for storage.
+
+    Like the other band classes, it has a `version` counter that is
+    incremented whenever values are assigned, which grids use to detect stale
+    overviews. Modifying the views returned by indexing is not counted.
+    """
 
     def __init__(self, size, dtype, initval=None):
         self.size = size
@@ -104,24 +207,294 @@ class SimpleBand(object):
         else:
             self.array = initval * np.ones(size, dtype=dtype)
         self.dtype = dtype
+        self.version = 0
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def __setitem__(self, key, value):
+        self.array[key] = value
+        self.version += 1
+        return
+
+class MmapBand(object):
+    """ MmapBand stores data in a memory-mapped file, so that bands larger than
+    the available memory can be used. Paging is left to the operating system,
+    and slices are returned as views on the file.
+
+    If *filename* is None, a scratch file is created in *tempdir* (default
+    `MMAP_TEMPDIR`, or the system temporary directory) and deleted when the
+    band is garbage collected. Otherwise, *filename* is opened with *mode*,
+    which may be "w+" (create or overwrite, the default) or "r+" (open existing
+    data with the given *size* and *dtype*).
+    """
+
+    def __init__(self, size, dtype, initval=None, filename=None, mode="w+",
+                 tempdir=None):
+        self.size = size
+        self.dtype = dtype
+
+        if filename is None:
+            if tempdir is None:
+                tempdir = MMAP_TEMPDIR
+            fd, filename = tempfile.mkstemp(suffix=".band", dir=tempdir)
+            os.close(fd)
+            self._scratch = True
+        else:
+            self._scratch = False
+        self.filename = filename
+
+        self.array = np.memmap(filename, dtype=dtype, mode=mode, shape=size)
+        if initval is not None:
+            self.array[:,:] = initval
+        self.version = 0
+        return
+
+    def __del__(self):
+        self.array = None
+        if getattr(self, "_scratch", False) and os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def __deepcopy__(self, memo):
+        band = MmapBand(self.size, self.dtype)
+        band[:,:] = self.array
+        return band
 
     def __getitem__(self, key):
         return self.array[key]
 
     def __setitem__(self, key, value):
         self.array[key] = value
+        self.version += 1
+        return
+
+    def flush(self):
+        """ Write pending changes to disk. """
+        self.array.flush()
+        return
+
+class BandWindow(object):
+    """ BandWindow is a view of the rectangle of *size* at offset *yoff*,
+    *xoff* in another band. It holds no data: values are read from and
+    written to the parent band when the window is indexed.
+    """
+
+    def __init__(self, band, yoff, xoff, size):
+        if isinstance(band, BandWindow):
+            yoff += band.yoff
+            xoff += band.xoff
+            band = band.band
+        if (yoff < 0 or xoff < 0 or yoff+size[0] > band.size[0] or
+                xoff+size[1] > band.size[1]):
+            raise IndexError("window extends outside of band")
+        self.band = band
+        self.yoff = yoff
+        self.xoff = xoff
+        self.size = tuple(size)
+        self.dtype = band.dtype
+        return
+
+    @property
+    def version(self):
+        return getattr(self.band, "version", None)
+
+    @property
+    def _chunksize(self):
+        # chunk size of the parent band, raising AttributeError if it has none
+        return self.band._chunksize
+
+    def _parentkey(self, key):
+        if isinstance(key, tuple):
+            if len(key) != 2:
+                raise IndexError("band can only be indexed along two dimensions")
+            return (_windowkey(key[0], self.yoff, self.size[0]),
+                    _windowkey(key[1], self.xoff, self.size[1]))
+        elif isinstance(key, slice):
+            return (_windowkey(key, self.yoff, self.size[0]),
+                    slice(self.xoff, self.xoff+self.size[1]))
+        elif isinstance(key, int):
+            i, j = divmod(key, self.size[1])
+            return (i+self.yoff, j+self.xoff)
+        raise IndexError("indexing with instances of '{0}' not "
+                         "supported".format(type(key)))
+
+    def __getitem__(self, key):
+        if isinstance(key, np.ndarray):
+            return self[:,:][key]
+        return self.band[self._parentkey(key)]
+
+    def getpoints(self, rows, cols):
+        return _getpoints(self.band, rows+self.yoff, cols+self.xoff)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, np.ndarray):
+            tmp = np.array(self[:,:])
+            tmp[key] = value
+            self[:,:] = tmp
+        else:
+            self.band[self._parentkey(key)] = value
+        return
+
+def _windowkey(key, offset, n):
+    """ Translate an integer or slice *key* along a window axis of length *n*
+    starting at *offset* into the parent band's coordinates. """
+    if isinstance(key, int):
+        if key < 0:
+            key += n
+        if not 0 <= key < n:
+            raise IndexError("index {0} out of range".format(key))
+        return key + offset
+    elif isinstance(key, slice):
+        start, stop, step = key.indices(n)
+        stop += offset
+        if stop < 0:
+            stop = None
+        return slice(start+offset, stop, step)
+    raise IndexError("slicing with instances of '{0}' not "
+                     "supported".format(type(key)))
+
+class ChunkCache(object):
+    """ Least-recently-used cache of decompressed chunks, bounded by the total
+    number of bytes held.
+
+    Entries may be marked *dirty*, meaning that they have been modified since
+    they were last compressed. Dirty entries are handed back to the caller when
+    they are evicted so that they can be written back to compressed storage.
+    """
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, index):
+        return index in self._entries
+
+    def get(self, index):
+        """ Return the array cached for chunk *index*, or None. """
+        entry = self._entries.pop(index, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries[index] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, index, array, dirty=False):
+        """ Insert *array* as chunk *index*. Returns a list of evicted
+        ``(index, array, dirty)`` tuples. If *array* does not fit in the cache
+        at all, it is returned as the only eviction.
+        """
+        old = self._entries.pop(index, None)
+        if old is not None:
+            self.nbytes -= old[0].nbytes
+            dirty = dirty or old[1]
+
+        if array.nbytes > self.maxbytes:
+            return [(index, array, dirty)]
+
+        self._entries[index] = [array, dirty]
+        self.nbytes += array.nbytes
+
+        evicted = []
+        while self.nbytes > self.maxbytes:
+            i, (a, d) = self._entries.popitem(last=False)
+            self.nbytes -= a.nbytes
+            evicted.append((i, a, d))
+        return evicted
+
+    def pop(self, index):
+        """ Remove chunk *index* from the cache, returning ``(array, dirty)``
+        or None. """
+        entry = self._entries.pop(index, None)
+        if entry is not None:
+            self.nbytes -= entry[0].nbytes
+        return entry
+
+    def dirty(self):
+        """ Yield ``(index, array)`` for modified entries and mark them clean.
+        """
+        for index, entry in self._entries.items():
+            if entry[1]:
+                entry[1] = False
+                yield index, entry[0]
+
+    def clear(self):
+        """ Empty the cache and reset hit/miss counters. """
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
         return
 
 class CompressedBand(object):
-    """ CompressedBand is a chunked, blosc-compressed array. """
+    """ CompressedBand is a chunked, blosc-compressed array.
+
+    Recently accessed chunks are held decompressed in a write-back cache of at
+    most *cachesize* bytes (default `CHUNKCACHE_DEFAULT`), so that repeated
+    small reads and writes do not repeatedly decompress the same chunk. Cache
+    performance can be inspected through the `cache` attribute, which has
+    `hits` and `misses` counters.
+
+    Reads and writes spanning several chunks are spread over *nthreads* worker
+    threads (default `CHUNKTHREADS_DEFAULT`). Chunks read this way bypass the
+    cache.
+
+    Chunks that have never been written read as *initval* (default zero), so
+    allocating a band is cheap regardless of its size. Chunks holding a single
+    repeated value are stored as that value rather than compressed, and
+    byte-identical compressed chunks share one buffer.
+
+    Compression is controlled by *cname* (a blosc codec: "blosclz", "lz4",
+    "lz4hc", "zlib", or "zstd", subject to how blosc was built), *clevel* (0-9)
+    and *shuffle* (`blosc.NOSHUFFLE`, `blosc.SHUFFLE` or `blosc.BITSHUFFLE`).
+
+    Once `chunkstats` has been called, a summary of each chunk is updated as
+    chunks are compressed, so that reductions over the band only read chunks
+    modified since the previous call.
+
+    The `version` counter is incremented whenever values are assigned.
+    """
     CHUNKSET = 1
     CHUNKUNSET = 0
+    CHUNKUNIFORM = 2
+
+    # Trailing dimensions of each cell
+    _cellshape = ()
 
-    def __init__(self, size, dtype, chunksize=(256, 256), initval=None):
+    def __init__(self, size, dtype, chunksize=(256, 256), initval=None,
+                 cachesize=None, nthreads=None, cname="blosclz", clevel=9,
+                 shuffle=blosc.SHUFFLE):
         assert len(size) == 2
         self.size = size
         self.dtype = dtype
-        self._chunksize = chunksize
+        self._chunksize = tuple(chunksize)
+        self._chunkdims = self._chunksize + self._cellshape
+
+        if cname not in blosc.compressor_list():
+            raise ValueError("blosc compressor '{0}' not available".format(cname))
+        if not 0 <= clevel <= 9:
+            raise ValueError("clevel must be between 0 and 9")
+        if shuffle not in (blosc.NOSHUFFLE, blosc.SHUFFLE, blosc.BITSHUFFLE):
+            raise ValueError("shuffle must be one of blosc.NOSHUFFLE, "
+                             "blosc.SHUFFLE, or blosc.BITSHUFFLE")
+        self.cname = cname
+        self.clevel = clevel
+        self.shuffle = shuffle
+
+        if cachesize is None:
+            cachesize = CHUNKCACHE_DEFAULT
+        self.cache = ChunkCache(cachesize)
+
+        if nthreads is None:
+            nthreads = CHUNKTHREADS_DEFAULT
+        self.nthreads = nthreads
 
         self.nchunkrows = int(ceil(float(size[0])/float(chunksize[0])))
         self.nchunkcols = int(ceil(float(size[1])/float(chunksize[1])))
@@ -130,17 +503,35 @@ class CompressedBand(object):
         # Data store
         self._data = [None for i in range(nchunks)]
 
+        # Compressed buffers, mapped to [buffer, reference count] so that
+        # identical chunks can share storage
+        self._buffers = {}
+
         # 0 => unset
         # 1 => set
+        # 2 => uniform (value held in data store)
         self.chunkstatus = np.zeros(nchunks, dtype=np.int8)
 
-        if initval is not None:
-            self[:,:] = initval*np.ones(size, dtype=dtype)
+        # Per-chunk (count, min, max) summaries with respect to _statsnodata,
+        # maintained once requested through chunkstats() (which sets
+        # _statsvalid). None marks chunks that must be summarized again.
+        self._stats = [None for i in range(nchunks)]
+        self._statsnodata = None
+        self._statsvalid = False
+
+        if initval is None:
+            self._fillvalue = 0
+        else:
+            self._fillvalue = initval
+        self.version = 0
         return
 
     def __getitem__(self, key):
 
-        if isinstance(key, int):
+        if isinstance(key, np.ndarray) and _supports_masking(self, key):
+            return self.getmasked(key)
+
+        elif isinstance(key, int):
             irow = key // self.size[1]
             icol = key % self.size[1]
             return self._getblock(irow, icol, (1, 1))[0]
@@ -186,16 +577,18 @@ class CompressedBand(object):
 
             if nx == ny == 1:
                 return self._getblock(yoff, xoff, (ny, nx))[0,0]
+            elif ystride == xstride == 1:
+                return self._getblock(yoff, xoff, (ny, nx))
             else:
-                return self._getblock(yoff, xoff, (ny, nx))[::ystride,::xstride]
+                return self._gather(_axisindices(k0, self.size[0]),
+                                    _axisindices(k1, self.size[1]))
 
         elif isinstance(key, slice):
             start, stop, stride = key.indices(self.size[0])
-            yoff = min(start, stop)
-            if stride < 0:
-                yoff += 1
-            ny = abs(stop-start)
-            return self._getblock(yoff, 0, (ny, self.size[1]))[::stride]
+            if stride == 1:
+                return self._getblock(start, 0, (max(stop-start, 0), self.size[1]))
+            return self._gather(np.arange(start, stop, stride),
+                                np.arange(self.size[1]))
 
         else:
             raise IndexError("indexing with instances of '{0}' not "
@@ -203,7 +596,10 @@ class CompressedBand(object):
 
     def __setitem__(self, key, value):
 
-        if isinstance(key, int):
+        if isinstance(key, np.ndarray) and _supports_masking(self, key):
+            self.setmasked(key, value)
+
+        elif isinstance(key, int):
             irow = key // self.size[1]
             icol = key % self.size[1]
             self._setblock(irow, icol, np.array(value, dtype=self.dtype))
@@ -214,83 +610,411 @@ class CompressedBand(object):
                 raise IndexError("band can only be indexed along two dimensions")
 
             k0, k1 = key
+            rows = _axisindices(k0, self.size[0])
+            cols = _axisindices(k1, self.size[1])
+            ny = len(rows)
+            nx = len(cols)
+
+            ncell = len(self._cellshape)
+            if np.ndim(value) <= ncell:
+                value = np.broadcast_to(np.asarray(value, dtype=self.dtype),
+                                        (ny, nx) + self._cellshape)
+            elif np.ndim(value) == ncell+1:
+                value = np.reshape(value, (ny, -1) + self._cellshape)
 
-            if isinstance(k0, int):
-                yoff = k0
-                ny = 1
-                sy = 1
-
-            elif isinstance(k0, slice):
-                if k0.start is None:
-                    yoff = 0
-                else:
-                    yoff = k0.start
-                if k0.stop is None:
-                    ny = self.size[0]-yoff
-                else:
-                    ny = k0.stop-yoff
-                if k0.step is None:
-                    sy = 1
-                else:
-                    sy = k0.step
+            vny, vnx = value.shape[:2]
+            if (ny != vny) or (nx != vnx):
+                raise IndexError("Cannot insert array with size ({vny}, {vnx}))"
+                        " into slice with size ({ny}, {nx})".format(
+                            vny=vny, vnx=vnx, ny=ny, nx=nx))
 
+            if ny == 0 or nx == 0:
+                pass
+            elif (ny == 1 or rows[1]-rows[0] == 1) and \
+                    (nx == 1 or cols[1]-cols[0] == 1):
+                self._setblock(rows[0], cols[0], value)
             else:
-                raise IndexError("slicing with instances of '{0}' not "
-                                 "supported".format(type(k0)))
+                self._scatter(rows, cols, value)
 
-            if isinstance(k1, int):
-                xoff = k1
-                nx = 1
-                sx = 1
+        else:
+            raise IndexError("indexing with instances of '{0}' not "
+                             "supported".format(type(key)))
 
-            elif isinstance(k1, slice):
-                if k1.start is None:
-                    xoff = 0
-                else:
-                    xoff = k1.start
-                if k1.stop is None:
-                    nx = self.size[1]-xoff
-                else:
-                    nx = k1.stop-xoff
-                if k1.step is None:
-                    sx = 1
+        self.version += 1
+        return
+
+
+    def _chunktasks(self, rows, cols):
+        """ Return a list of (chunk, r0, r1, c0, c1, chunkrows, chunkcols) for
+        each chunk containing cells at the intersections of the evenly spaced
+        index arrays *rows* and *cols*. The slices [r0:r1, c0:c1] locate the
+        cells in the output, and the slices *chunkrows* and *chunkcols* locate
+        them within the chunk.
+        """
+        cy, cx = self._chunksize
+        colruns = [(c, c0, c1, _localslice(cols[c0:c1], c*cx))
+                   for c, c0, c1 in _chunkruns(cols, cx)]
+        tasks = []
+        for r, r0, r1 in _chunkruns(rows, cy):
+            chunkrows = _localslice(rows[r0:r1], r*cy)
+            for c, c0, c1, chunkcols in colruns:
+                tasks.append((r*self.nchunkcols + c, r0, r1, c0, c1,
+                              chunkrows, chunkcols))
+        return tasks
+
+    def _gather(self, rows, cols):
+        """ Return the values at the intersections of the evenly spaced index
+        arrays *rows* and *cols*, as used for strided and reversed slices.
+        Only chunks containing a selected cell are read, and the selected cells
+        are copied directly into the output. """
+        result = np.empty((len(rows), len(cols)) + self._cellshape,
+                          dtype=self.dtype)
+        if result.size == 0:
+            return result
+        self._readtasks(self._chunktasks(rows, cols),
+                        lambda task, usecache=True:
+                            self._gatherchunk(result, task, usecache))
+        return result
+
+    def _readtasks(self, tasks, read):
+        """ Call *read(task, usecache)* for each of *tasks*, which are tuples
+        beginning with a chunk index. When the chunks are too many to cache or
+        *nthreads* is greater than one, chunks that must be decompressed are
+        read with usecache=False, optionally by worker threads. """
+        threaded = self.nthreads > 1 and len(tasks) > 1
+        chunkbytes = int(np.prod(self._chunkdims))*np.dtype(self.dtype).itemsize
+        if threaded or (len(tasks)*chunkbytes > self.cache.maxbytes):
+            streamed = []
+            for task in tasks:
+                i = task[0]
+                if (self.chunkstatus[i] != self.CHUNKSET) or (i in self.cache):
+                    read(task)
                 else:
-                    sx = k1.step
+                    streamed.append(task)
 
+            if threaded:
+                _threadpool(self.nthreads).map(
+                        lambda task: read(task, usecache=False), streamed)
             else:
-                raise IndexError("slicing with instances of '{0}' not "
-                                 "supported".format(type(k1)))
+                for task in streamed:
+                    read(task, usecache=False)
+        else:
+            for task in tasks:
+                read(task)
+        return
 
-            vny, vnx = value.shape[:2]
-            if (ceil(float(ny)/sy) != vny) or (ceil(float(nx)/sx) != vnx):
-                raise IndexError("Cannot insert array with size ({vny}, {vnx}))"
-                        " into slice with size ({ny}, {nx})".format(
-                            vny=vny, vnx=vnx, ny=ny, nx=nx))
+    def _gatherchunk(self, result, task, usecache=True):
+        i, r0, r1, c0, c1, chunkrows, chunkcols = task
+        out = result[r0:r1, c0:c1]
+        if self.chunkstatus[i] == self.CHUNKUNSET:
+            out.fill(self._fillvalue)
+        elif self.chunkstatus[i] == self.CHUNKUNIFORM:
+            out.fill(self._data[i])
+        else:
+            if usecache:
+                chunkdata = self._retrieve(i)
+            else:
+                chunkdata = self._decompress(i, out=_scratch(self._chunkdims,
+                                                             self.dtype))
+            out[:,:] = chunkdata[chunkrows, chunkcols]
+        return
 
-            if sy == sx == 1:
-                self._setblock(yoff, xoff, value)
+    def getpoints(self, rows, cols):
+        """ Return the values at the cells (*rows[k]*, *cols[k]*) of the
+        one-dimensional index arrays *rows* and *cols*. Points are grouped by
+        chunk, so that each chunk containing a point is read once and no other
+        chunks are read.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        result = np.empty(rows.shape + self._cellshape, dtype=self.dtype)
+        if len(rows) == 0:
+            return result
+        if (rows.min() < 0 or rows.max() >= self.size[0] or
+                cols.min() < 0 or cols.max() >= self.size[1]):
+            raise IndexError("point indices out of range")
+
+        cy, cx = self._chunksize
+        index = (rows//cy)*self.nchunkcols + cols//cx
+        order = np.argsort(index, kind="mergesort")
+        sortedindex = index[order]
+        starts = np.flatnonzero(np.r_[True, sortedindex[1:] != sortedindex[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        tasks = [(sortedindex[a], order[a:b]) for a, b in zip(starts, ends)]
+
+        self._readtasks(tasks, lambda task, usecache=True:
+                                   self._pointchunk(result, rows, cols, task,
+                                                    usecache))
+        return result
+
+    def _pointchunk(self, result, rows, cols, task, usecache=True):
+        i, sel = task
+        if self.chunkstatus[i] == self.CHUNKUNSET:
+            result[sel] = self._fillvalue
+        elif self.chunkstatus[i] == self.CHUNKUNIFORM:
+            result[sel] = self._data[i]
+        else:
+            if usecache:
+                chunkdata = self._retrieve(i)
+            else:
+                chunkdata = self._decompress(i, out=_scratch(self._chunkdims,
+                                                             self.dtype))
+            cy, cx = self._chunksize
+            yoff = (i // self.nchunkcols)*cy
+            xoff = (i % self.nchunkcols)*cx
+            result[sel] = chunkdata[rows[sel]-yoff, cols[sel]-xoff]
+        return
 
+    def _scatter(self, rows, cols, values):
+        """ Set the cells at the intersections of the evenly spaced index arrays
+        *rows* and *cols* to *values*. Only chunks containing a selected cell
+        are modified. """
+        for i, r0, r1, c0, c1, chunkrows, chunkcols in self._chunktasks(rows, cols):
+            if self.chunkstatus[i] != self.CHUNKUNSET:
+                chunkdata = self._retrieve(i)
             else:
-                temp = self._getblock(yoff, xoff, (ny, nx))
-                temp[::sy,::sx] = value
-                self._setblock(yoff, xoff, temp)
+                chunkdata = self._blank()
+            chunkdata[chunkrows, chunkcols] = values[r0:r1, c0:c1]
+            self._store(chunkdata, i)
+        return
 
+    def _maskstrips(self, mask):
+        """ Yield tuples of (ystart, yend, mask strip) for each row of chunks
+        containing at least one masked cell. """
+        for y0 in range(0, self.size[0], self._chunksize[0]):
+            y1 = min(y0+self._chunksize[0], self.size[0])
+            mstrip = mask[y0:y1]
+            if mstrip.any():
+                yield y0, y1, mstrip
+
+    def getmasked(self, mask):
+        """ Return a one-dimensional array of the values where the boolean
+        array *mask* is True, in row-major order. Chunks containing no masked
+        cells are not read.
+        """
+        nx = self.size[1]
+        out = []
+        for y0, y1, mstrip in self._maskstrips(mask):
+            strip = np.empty((y1-y0, nx) + self._cellshape, dtype=self.dtype)
+            for chunk in self._getchunks(y0, 0, y1-y0, nx):
+                if mstrip[:,chunk[3]:chunk[4]].any():
+                    self._readchunk(strip, y0, 0, chunk)
+            out.append(strip[mstrip])
+
+        if len(out) == 0:
+            return np.empty((0,) + self._cellshape, dtype=self.dtype)
+        return np.concatenate(out)
+
+    def setmasked(self, mask, value):
+        """ Set the cells where the boolean array *mask* is True to *value*,
+        which is either a scalar or an array with one element per masked cell
+        in row-major order. Only chunks containing masked cells are modified.
+        """
+        nx = self.size[1]
+        self.version += 1
+        if np.size(value) == 1:
+            value = np.asarray(value).ravel()[0]
+            scalar = True
         else:
-            raise IndexError("indexing with instances of '{0}' not "
-                             "supported".format(type(key)))
+            value = np.asarray(value)
+            scalar = False
+
+        offset = 0
+        for y0, y1, mstrip in self._maskstrips(mask):
+            if not scalar:
+                n = np.count_nonzero(mstrip)
+                strip = np.empty((y1-y0, nx) + self._cellshape, dtype=self.dtype)
+                strip[mstrip] = value[offset:offset+n]
+                offset += n
+
+            for i, yst, yen, xst, xen in self._getchunks(y0, 0, y1-y0, nx):
+                cmask = mstrip[:,xst:xen]
+                if not cmask.any():
+                    continue
+
+                if self.chunkstatus[i] != self.CHUNKUNSET:
+                    chunkdata = self._retrieve(i)
+                else:
+                    chunkdata = self._blank()
 
+                view = chunkdata[:yen-yst,:xen-xst]
+                if scalar:
+                    view[cmask] = value
+                else:
+                    view[cmask] = strip[:,xst:xen][cmask]
+                self._store(chunkdata, i)
+        return
+
+    def _chunkshape(self, index):
+        """ Return the dimensions of the part of chunk *index* that lies within
+        the band. """
+        i = index // self.nchunkcols
+        j = index % self.nchunkcols
+        return (min(self._chunksize[0], self.size[0]-i*self._chunksize[0]),
+                min(self._chunksize[1], self.size[1]-j*self._chunksize[1]))
+
+    def _blank(self):
+        """ Return a new chunk filled with the band's initial value. """
+        return np.full(self._chunkdims, self._fillvalue, dtype=self.dtype)
+
+    def _release(self, index):
+        """ Drop the data store's reference to the buffer of chunk *index*. """
+        data = self._data[index]
+        if isinstance(data, bytes) and self.chunkstatus[index] != self.CHUNKUNIFORM:
+            entry = self._buffers[data]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._buffers[data]
+        self._data[index] = None
         return
 
+    def _compress(self, array, index):
+        ny, nx = self._chunkshape(index)
+        valid = array[:ny,:nx]
+        first = valid.flat[0]
+        nodata = self._statsnodata
+        if (first != first and np.isnan(valid).all()) or (valid == first).all():
+            if self._statsvalid:
+                self._stats[index] = _uniformsummary(first, ny*nx, nodata)
+            with _BUFFER_LOCK:
+                self._release(index)
+                self._data[index] = first
+                self.chunkstatus[index] = self.CHUNKUNIFORM
+            return
+
+        if self._statsvalid:
+            self._stats[index] = _summary(valid, nodata)
+        array = np.ascontiguousarray(array)
+        compressed = blosc.compress_ptr(array.__array_interface__["data"][0],
+                                        array.size, array.dtype.itemsize,
+                                        clevel=self.clevel,
+                                        shuffle=self.shuffle,
+                                        cname=self.cname)
+        with _BUFFER_LOCK:
+            self._release(index)
+            entry = self._buffers.get(compressed, None)
+            if entry is None:
+                entry = [compressed, 0]
+                self._buffers[compressed] = entry
+            entry[1] += 1
+            self._data[index] = entry[0]
+            self.chunkstatus[index] = self.CHUNKSET
+        return
+
+    def _writeback(self, evicted):
+        for index, array, dirty in evicted:
+            if dirty:
+                self._compress(array, index)
+        return
 
     def _store(self, array, index):
-        self._data[index] = blosc.compress(array.tostring(),
-                                           np.dtype(self.dtype).itemsize)
         self.chunkstatus[index] = self.CHUNKSET
+        self._stats[index] = None
+        self._writeback(self.cache.put(index, array, dirty=True))
         return
 
+    def _decompress(self, index, out=None):
+        """ Decompress chunk *index* into *out*, which must be a C-contiguous
+        array of the chunk size and band dtype. If *out* is None, a new array
+        is allocated. """
+        if out is None:
+            out = np.empty(self._chunkdims, dtype=self.dtype)
+        data = self._data[index]
+        if self.chunkstatus[index] == self.CHUNKUNIFORM:
+            out.fill(data)
+        else:
+            if not isinstance(data, bytes):
+                # chunk held in a file by a chunk store
+                data = data.read()
+            blosc.decompress_ptr(data, out.__array_interface__["data"][0])
+        return out
+
     def _retrieve(self, index):
-        bytestr = blosc.decompress(self._data[index])
-        return np.fromstring(bytestr, dtype=self.dtype).reshape(self._chunksize)
+        array = self.cache.get(index)
+        if array is None:
+            array = self._decompress(index)
+            self._writeback(self.cache.put(index, array))
+        return array
+
+    @property
+    def nbytes(self):
+        """ Number of bytes of compressed data held, excluding chunks that
+        have been modified in the cache but not yet flushed. """
+        return sum(len(buf) for buf, _ in self._buffers.values())
+
+    def flush(self):
+        """ Compress any chunks that have been modified in the cache. Cached
+        chunks are retained. """
+        for index, array in self.cache.dirty():
+            self._compress(array, index)
+        return
+
+    def chunkstats(self, nodata):
+        """ Return per-chunk statistics as three arrays with shape
+        (nchunkrows, nchunkcols): the number of cells not equal to *nodata*,
+        and the minimum and maximum of those cells. The minimum and maximum
+        are undefined where the count is zero.
+
+        The first call reads every chunk. Afterwards, statistics are updated
+        as chunks are written, and only chunks modified since the previous
+        call are read. Calling with a different *nodata* starts over.
+        """
+        if not self._statsvalid or not (nodata == self._statsnodata or
+                (nodata != nodata and self._statsnodata != self._statsnodata)):
+            self._stats = [None for _ in self._stats]
+            self._statsnodata = nodata
+            self._statsvalid = True
+
+        for index, stats in enumerate(self._stats):
+            if stats is None:
+                self._stats[index] = self._summarize(index, nodata)
+
+        shape = (self.nchunkrows, self.nchunkcols)
+        count = np.array([st[0] for st in self._stats], dtype=np.int64)
+        vmin = np.zeros(len(self._stats), dtype=self.dtype)
+        vmax = np.zeros(len(self._stats), dtype=self.dtype)
+        for index, (n, lo, hi) in enumerate(self._stats):
+            if n != 0:
+                vmin[index] = lo
+                vmax[index] = hi
+        return count.reshape(shape), vmin.reshape(shape), vmax.reshape(shape)
+
+    def _summarize(self, index, nodata):
+        ny, nx = self._chunkshape(index)
+        status = self.chunkstatus[index]
+        if status == self.CHUNKUNSET:
+            return _uniformsummary(self._fillvalue, ny*nx, nodata)
+        elif status == self.CHUNKUNIFORM:
+            return _uniformsummary(self._data[index], ny*nx, nodata)
+        elif index in self.cache:
+            array = self.cache.get(index)
+        else:
+            array = self._decompress(index, out=_scratch(self._chunkdims,
+                                                         self.dtype))
+        return _summary(array[:ny,:nx], nodata)
+
+    def datamask(self, nodata):
+        """ Return a boolean array that is True where the band is not equal
+        to *nodata*. Chunks that are entirely valid or entirely nodata
+        according to `chunkstats` are not read.
+        """
+        count = self.chunkstats(nodata)[0].ravel()
+        mask = np.empty(self.size, dtype=np.bool_)
+        for i, yst, yen, xst, xen in self._getchunks(0, 0, *self.size):
+            if count[i] == 0:
+                mask[yst:yen,xst:xen] = False
+            elif count[i] == (yen-yst)*(xen-xst):
+                mask[yst:yen,xst:xen] = True
+            else:
+                values = self._getblock(yst, xst, (yen-yst, xen-xst))
+                mask[yst:yen,xst:xen] = _isdata(values, nodata)
+        return mask
+
+    def clear_cache(self):
+        """ Flush and empty the chunk cache. """
+        self.flush()
+        self.cache.clear()
+        return
 
     def _getchunks(self, yoff, xoff, ny, nx):
         """ Return a generator returning tuples identifying chunks covered by a
@@ -325,60 +1049,297 @@ class CompressedBand(object):
     def _setblock(self, yoff, xoff, array):
         """ Store block of values in *array* starting at offset *yoff*, *xoff*.
         """
-        size = array.shape
-        chunksize = self._chunksize
+        chunks = list(self._getchunks(yoff, xoff, *array.shape[:2]))
+
+        if self.nthreads > 1 and len(chunks) > 1:
+            # Cached chunks are taken out of the cache and handed to the
+            # workers, which compress directly to the data store
+            bases = []
+            for chunk in chunks:
+                entry = self.cache.pop(chunk[0])
+                bases.append(None if entry is None else entry[0])
+            _threadpool(self.nthreads).map(
+                    lambda args: self._writechunk(array, yoff, xoff, *args),
+                    zip(chunks, bases))
 
-        for i, yst, yen, xst, xen in self._getchunks(yoff, xoff, *size):
+        else:
+            for chunk in chunks:
+                i = chunk[0]
+                if i in self.cache:
+                    chunkdata = self._retrieve(i)
+                elif self._covers(yoff, xoff, array.shape, chunk):
+                    chunkdata = np.empty(self._chunkdims, dtype=self.dtype)
+                    if self._chunkshape(i) != self._chunksize:
+                        chunkdata.fill(self._fillvalue)
+                elif self.chunkstatus[i] != self.CHUNKUNSET:
+                    chunkdata = self._retrieve(i)
+                else:
+                    chunkdata = self._blank()
+                self._insert(chunkdata, array, yoff, xoff, chunk)
+                self._store(chunkdata, i)
+        return
 
-            # Get from data store
-            if self.chunkstatus[i] != self.CHUNKUNSET:
-                chunkdata = self._retrieve(i)
-            else:
-                chunkdata = np.zeros(self._chunksize, dtype=self.dtype)
+    @staticmethod
+    def _covers(yoff, xoff, size, chunk):
+        """ Return whether a region of *size* at *yoff*, *xoff* covers the
+        valid part of *chunk*. """
+        _, yst, yen, xst, xen = chunk
+        return (yoff <= yst and yoff+size[0] >= yen and
+                xoff <= xst and xoff+size[1] >= xen)
+
+    def _insert(self, chunkdata, array, yoff, xoff, chunk):
+        """ Copy the part of *array* (offset by *yoff*, *xoff*) that overlaps
+        *chunk* into *chunkdata*. """
+        _, yst, yen, xst, xen = chunk
+        size = array.shape
+        chunksize = self._chunksize
 
-            # Compute region within chunk to place data in
-            cy0 = max(0, yoff-yst)
-            cy1 = min(chunksize[0], yoff+size[0]-yst)
-            cx0 = max(0, xoff-xst)
-            cx1 = min(chunksize[1], xoff+size[1]-xst)
+        # Compute region within chunk to place data in
+        cy0 = max(0, yoff-yst)
+        cy1 = min(chunksize[0], yoff+size[0]-yst)
+        cx0 = max(0, xoff-xst)
+        cx1 = min(chunksize[1], xoff+size[1]-xst)
 
-            # Compute region to slice from data
-            dy0 = max(0, yst-yoff)
-            dy1 = min(size[0], yen-yoff)
-            dx0 = max(0, xst-xoff)
-            dx1 = min(size[1], xen-xoff)
+        # Compute region to slice from data
+        dy0 = max(0, yst-yoff)
+        dy1 = min(size[0], yen-yoff)
+        dx0 = max(0, xst-xoff)
+        dx1 = min(size[1], xen-xoff)
 
-            chunkdata[cy0:cy1, cx0:cx1] = array[dy0:dy1, dx0:dx1]
+        chunkdata[cy0:cy1, cx0:cx1] = array[dy0:dy1, dx0:dx1]
+        return
 
-            # Return to data store
-            self._store(chunkdata, i)
+    def _writechunk(self, array, yoff, xoff, chunk, chunkdata=None):
+        """ Update and compress a single chunk without touching the cache.
+        Safe to call concurrently for distinct chunks. """
+        i = chunk[0]
+        if chunkdata is None:
+            covered = self._covers(yoff, xoff, array.shape, chunk)
+            chunkdata = _scratch(self._chunkdims, self.dtype)
+            if self.chunkstatus[i] != self.CHUNKUNSET and not covered:
+                self._decompress(i, out=chunkdata)
+            else:
+                chunkdata.fill(self._fillvalue)
+        self._insert(chunkdata, array, yoff, xoff, chunk)
+        self._compress(chunkdata, i)
         return
 
     def _getblock(self, yoff, xoff, size):
         """ Retrieve values with dimensions *size*, starting at offset *yoff*,
         *xoff*.
         """
-        result = np.empty(size, self.dtype)
-        for i, yst, yen, xst, xen in self._getchunks(yoff, xoff, *size):
+        result = np.empty(tuple(size) + self._cellshape, self.dtype)
+        chunks = list(self._getchunks(yoff, xoff, *size))
+
+        threaded = self.nthreads > 1 and len(chunks) > 1
+        chunkbytes = int(np.prod(self._chunkdims))*np.dtype(self.dtype).itemsize
+        if threaded or (len(chunks)*chunkbytes > self.cache.maxbytes):
+            # Chunks that must be decompressed are streamed into the result
+            # rather than added to the cache, optionally by worker threads
+            uncached = []
+            for chunk in chunks:
+                i = chunk[0]
+                if (self.chunkstatus[i] != self.CHUNKSET) or (i in self.cache):
+                    self._readchunk(result, yoff, xoff, chunk)
+                else:
+                    uncached.append(chunk)
+
+            if threaded:
+                _threadpool(self.nthreads).map(
+                        lambda chunk: self._readchunk(result, yoff, xoff, chunk,
+                                                      usecache=False),
+                        uncached)
+            else:
+                for chunk in uncached:
+                    self._readchunk(result, yoff, xoff, chunk, usecache=False)
 
-            # Compute the bounds in the output
-            oy0 = max(0, yst-yoff)
-            oy1 = min(size[0], yen-yoff)
-            ox0 = max(0, xst-xoff)
-            ox1 = min(size[1], xen-xoff)
+        else:
+            for chunk in chunks:
+                self._readchunk(result, yoff, xoff, chunk)
+        return result
+
+    def _readchunk(self, result, yoff, xoff, chunk, usecache=True):
+        """ Copy the part of *chunk* that overlaps *result* (offset by *yoff*,
+        *xoff*) into *result*. """
+        i, yst, yen, xst, xen = chunk
+        size = result.shape
 
-            if self.chunkstatus[i] == self.CHUNKUNSET:
-                result[oy0:oy1, ox0:ox1] = np.zeros((oy1-oy0, ox1-ox0),
-                                                    dtype=self.dtype)
+        # Compute the bounds in the output
+        oy0 = max(0, yst-yoff)
+        oy1 = min(size[0], yen-yoff)
+        ox0 = max(0, xst-xoff)
+        ox1 = min(size[1], xen-xoff)
 
+        if self.chunkstatus[i] == self.CHUNKUNSET:
+            result[oy0:oy1, ox0:ox1] = self._fillvalue
+
+        elif self.chunkstatus[i] == self.CHUNKUNIFORM:
+            result[oy0:oy1, ox0:ox1] = self._data[i]
+
+        else:
+            # Compute the extents from the chunk to retain
+            cy0 = max(yoff, yst) - yst
+            cy1 = min(yoff+size[0], yen) - yst
+            cx0 = max(xoff, xst) - xst
+            cx1 = min(xoff+size[1], xen) - xst
+
+            out = result[oy0:oy1, ox0:ox1]
+            if usecache:
+                out[:,:] = self._retrieve(i)[cy0:cy1, cx0:cx1]
+            elif ((cy1-cy0, cx1-cx0) == self._chunksize) and out.flags.c_contiguous:
+                # Chunk fills a contiguous region of the output
+                self._decompress(i, out=out)
             else:
-                # Compute the extents from the chunk to retain
-                cy0 = max(yoff, yst) - yst
-                cy1 = min(yoff+size[0], yen) - yst
-                cx0 = max(xoff, xst) - xst
-                cx1 = min(xoff+size[1], xen) - xst
+                chunkdata = self._decompress(i, out=_scratch(self._chunkdims,
+                                                             self.dtype))
+                out[:,:] = chunkdata[cy0:cy1, cx0:cx1]
+        return
 
-                result[oy0:oy1, ox0:ox1] = self._retrieve(i)[cy0:cy1, cx0:cx1]
+class InterleavedBand(CompressedBand):
+    """ InterleavedBand is a CompressedBand storing *nbands* bands together.
+    Each chunk holds every band of its cells in pixel-interleaved order, so
+    that reading all bands of a region decompresses each chunk once. Indexing
+    returns arrays with a trailing band dimension.
+
+    Grids hold the single-band views returned by `components`, and read
+    multi-band regions through the InterleavedBand without stacking bands.
+    Other keyword arguments are as for CompressedBand.
+    """
+
+    def __init__(self, size, dtype, nbands=1, **kwargs):
+        self.nbands = nbands
+        self._cellshape = (nbands,)
+        CompressedBand.__init__(self, size, dtype, **kwargs)
+        self._components = [InterleavedComponent(self, i) for i in range(nbands)]
+        return
 
-        return result
+    def components(self):
+        """ Return a list of single-band views, one per band. """
+        return list(self._components)
+
+class InterleavedComponent(object):
+    """ View of band *index* of an InterleavedBand. Writing to a component
+    reads and rewrites all bands of the affected cells. """
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.size = store.size
+        self.dtype = store.dtype
+        return
+
+    @property
+    def version(self):
+        return self.store.version
+
+    def __getitem__(self, key):
+        if isinstance(key, np.ndarray):
+            return _getmasked(self, key)
+        return self.store[key][...,self.index]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, np.ndarray):
+            _setmasked(self, key, value)
+            return
+        values = np.array(self.store[key])
+        values[...,self.index] = value
+        self.store[key] = values
+        return
+
+    def getpoints(self, rows, cols):
+        return self.store.getpoints(rows, cols)[:,self.index]
+
+    def getmasked(self, mask):
+        return self.store.getmasked(mask)[:,self.index]
+
+    def setmasked(self, mask, value):
+        values = self.store.getmasked(mask)
+        values[:,self.index] = value
+        self.store.setmasked(mask, values)
+        return
 
+def _axisindices(key, n):
+    """ Return the indices selected by an integer or slice *key* along an
+    axis of length *n*. """
+    if isinstance(key, int):
+        if key < 0:
+            key += n
+        return np.array([key])
+    elif isinstance(key, slice):
+        return np.arange(*key.indices(n))
+    raise IndexError("slicing with instances of '{0}' not "
+                     "supported".format(type(key)))
+
+def _chunkruns(indices, chunksize):
+    """ Yield (chunk, start, end) for each run of entries in the monotonic
+    array *indices* that fall within the same chunk. """
+    chunks = indices // chunksize
+    breaks = np.nonzero(np.diff(chunks))[0] + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(indices)]])
+    for start, end in zip(starts, ends):
+        yield int(chunks[start]), int(start), int(end)
+
+def _localslice(indices, offset):
+    """ Return a slice selecting the evenly spaced *indices* from an axis
+    starting at *offset*. """
+    start = int(indices[0]) - offset
+    step = int(indices[1]-indices[0]) if len(indices) > 1 else 1
+    stop = start + len(indices)*step
+    if stop < 0:
+        stop = None
+    return slice(start, stop, step)
+
+def _isdata(values, nodata):
+    if nodata != nodata:
+        return ~np.isnan(values)
+    return values != nodata
+
+def _summary(values, nodata):
+    """ Return the count, minimum and maximum of the cells of *values* not
+    equal to *nodata*. """
+    isdata = _isdata(values, nodata)
+    if not isdata.all():
+        values = values[isdata]
+    if values.size == 0:
+        return (0, None, None)
+    return (values.size, values.min(), values.max())
+
+def _uniformsummary(value, n, nodata):
+    """ Return the summary of *n* cells equal to *value*. """
+    if value == nodata or (value != value and nodata != nodata):
+        return (0, None, None)
+    return (n, value, value)
+
+def _scratch(shape, dtype):
+    """ Return a reusable array of *shape* and *dtype* private to the calling
+    thread. Its contents are undefined. """
+    buffers = getattr(_SCRATCH, "buffers", None)
+    if buffers is None:
+        buffers = {}
+        _SCRATCH.buffers = buffers
+    key = (tuple(shape), np.dtype(dtype))
+    buf = buffers.get(key, None)
+    if buf is None:
+        buf = np.empty(shape, dtype=dtype)
+        buffers[key] = buf
+    return buf
+
+def _threadpool(nthreads):
+    """ Return a shared pool of *nthreads* worker threads. Creating a pool
+    instructs blosc to release the GIL while compressing and decompressing. """
+    pool = _THREADPOOLS.get(nthreads, None)
+    if pool is None:
+        if hasattr(blosc, "set_releasegil"):
+            blosc.set_releasegil(True)
+        pool = ThreadPool(nthreads)
+        _THREADPOOLS[nthreads] = pool
+    return pool
+
+@atexit.register
+def _close_threadpools():
+    """ Close the shared pools and wait for their worker threads to exit. """
+    while len(_THREADPOOLS) != 0:
+        _, pool = _THREADPOOLS.popitem()
+        pool.close()
+        pool.join()
@@ -2,6 +2,7 @@ from math import ceil, sqrt
 import numpy as np
 cimport numpy as np
 cimport cython
+from libc.math cimport floor, fabs, rint, sin, cos, M_PI
 
 DTYPE_float64 = np.float64
 ctypedef np.float64_t DTYPE_float64_t
@@ -46,20 +47,638 @@ def fillarray_double(double[:,:] array not None,
                 array[i,j] = nodata_value
     return 0
 
-cdef float interpolate1(float x, float y, float a, float b, float c, float d):
-    """ Return a value *v(x,y)* in the regular structured stencil
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def affine_positions(double[:] x not None,
+                     double[:] y not None,
+                     double[:] I not None,
+                     double[:] J not None,
+                     double i0, double ix, double iy,
+                     double j0, double jx, double jy):
+    """ affine_positions computes ``I = i0 + ix*x + iy*y`` and
+    ``J = j0 + jx*x + jy*y`` elementwise, writing into *I* and *J*. The GIL
+    is released while computing.
+    """
+    cdef Py_ssize_t k, n
+    cdef double xk, yk
+
+    n = x.shape[0]
+    if (y.shape[0] != n) or (I.shape[0] != n) or (J.shape[0] != n):
+        raise ValueError("input and output arrays must have equal length")
+
+    with nogil:
+        for k in range(n):
+            xk = x[k]
+            yk = y[k]
+            I[k] = i0 + ix*xk + iy*yk
+            J[k] = j0 + jx*xk + jy*yk
+    return
+
+# Interpolation kernels, by name, and the number of cells on either side of a
+# point that each kernel reads
+KERNEL_RADIUS = {"bilinear": 1, "bicubic": 2, "lanczos": 3}
 
-            a --- b
-            |  v  |
-            c --- d
+cdef enum:
+    BILINEAR = 1
+    BICUBIC = 2
+    LANCZOS = 3
+
+cdef double SIN_THIRDS[6]
+cdef double COS_THIRDS[6]
+SIN_THIRDS[:] = [0.0, 0.8660254037844386, 0.8660254037844386,
+                 0.0, -0.8660254037844386, -0.8660254037844386]
+COS_THIRDS[:] = [1.0, 0.5, -0.5, -1.0, -0.5, 0.5]
+
+@cython.cdivision(True)
+cdef inline void kernel_weights(int kernel, double d, double *w) nogil:
+    """ Fill *w* with the weights of the cells at offsets 1-radius...radius
+    from the cell preceding a point, where *d* is the distance from that cell
+    to the point (0 <= d < 1). """
+    cdef int m
+    cdef double t, s, sa, ca, pt
+    if kernel == BILINEAR:
+        w[0] = 1.0 - d
+        w[1] = d
+    elif kernel == BICUBIC:
+        # Keys cubic convolution with a = -0.5
+        for m in range(4):
+            t = fabs(d + 1 - m)
+            if t <= 1.0:
+                w[m] = (1.5*t - 2.5)*t*t + 1.0
+            else:
+                w[m] = ((-0.5*t + 2.5)*t - 4.0)*t + 2.0
+    else:
+        # Lanczos with a = 3. The six sines at offsets of whole cells follow
+        # from one sine of pi*t and one sine and cosine of pi*t/3
+        s = sin(M_PI*d)
+        sa = sin(M_PI*(d+2)/3.0)
+        ca = cos(M_PI*(d+2)/3.0)
+        for m in range(6):
+            t = d + 2 - m
+            if t == 0.0:
+                w[m] = 1.0
+            else:
+                pt = M_PI*t
+                w[m] = 3.0 * (s if m % 2 == 0 else -s) * \
+                        (sa*COS_THIRDS[m] - ca*SIN_THIRDS[m]) / (pt*pt)
+    return
 
-    using linear interpolation. The coordinates (x, y) must be normalized by
-    the horizontal and vertical grid spacings, respectively.
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def interpolate(double[:,:] values not None,
+                double[:] I not None,
+                double[:] J not None,
+                double[:] out not None,
+                str method,
+                double nodata):
+    """ interpolate evaluates *values* at the float row and column positions
+    *I*, *J* using the *method* kernel ("bilinear", "bicubic", or "lanczos"),
+    writing into *out*. Cells beyond the edges of *values* take the value of
+    the nearest edge cell, so *values* should include KERNEL_RADIUS[method]
+    cells around the points where available. Points with a *nodata* (or NaN)
+    cell within the kernel are set to *nodata*. The GIL is released while
+    computing.
     """
-    cdef float left, right, res
+    cdef int kernel, radius, ny, nx, i0, j0, ii, jj, m, q
+    cdef Py_ssize_t k, n
+    cdef double total, wsum, w, v
+    cdef bint missing
+    cdef double wi[6]
+    cdef double wj[6]
+
+    if method == "bilinear":
+        kernel = BILINEAR
+    elif method == "bicubic":
+        kernel = BICUBIC
+    elif method == "lanczos":
+        kernel = LANCZOS
+    else:
+        raise ValueError("unknown interpolation method '{0}'".format(method))
+    radius = KERNEL_RADIUS[method]
+
+    n = I.shape[0]
+    if (J.shape[0] != n) or (out.shape[0] != n):
+        raise ValueError("position and output arrays must have equal length")
+    ny = values.shape[0]
+    nx = values.shape[1]
+
+    with nogil:
+        for k in range(n):
+            i0 = <int> floor(I[k])
+            j0 = <int> floor(J[k])
+            kernel_weights(kernel, I[k] - i0, wi)
+            kernel_weights(kernel, J[k] - j0, wj)
+
+            total = 0.0
+            wsum = 0.0
+            missing = False
+            for m in range(2*radius):
+                if wi[m] == 0.0:
+                    continue
+                ii = min(max(i0+m+1-radius, 0), ny-1)
+                for q in range(2*radius):
+                    if wj[q] == 0.0:
+                        continue
+                    jj = min(max(j0+q+1-radius, 0), nx-1)
+                    v = values[ii,jj]
+                    if (v != v) or (v == nodata):
+                        missing = True
+                        break
+                    w = wi[m]*wj[q]
+                    total = total + w*v
+                    wsum = wsum + w
+                if missing:
+                    break
+
+            if missing:
+                out[k] = nodata
+            else:
+                out[k] = total/wsum
+    return
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def bin_points(double[:] I not None,
+               double[:] J not None,
+               double[:] Z not None,
+               int ny, int nx,
+               np.int64_t[:] count,
+               double[:] total,
+               double[:] mean,
+               double[:] m2,
+               double[:] vmin,
+               double[:] vmax,
+               np.int64_t[:] cells not None):
+    """ bin_points adds the values *Z* at the float row and column positions
+    *I*, *J* to running statistics of the cells of an *ny* by *nx* grid,
+    stored in row-major order in flat arrays: the *count*, *total*, *mean*,
+    sum of squared deviations from the mean (*m2*), minimum and maximum.
+    Any statistic may be None to skip it, but *mean*, *m2*, *vmin* and
+    *vmax* require *count*, and *m2* requires *mean*. Points are assigned to
+    the nearest cell. The cell of each point, or -1 for points outside the
+    grid or with NaN values, is written to *cells*. The GIL is released while
+    computing.
+
+    Returns the number of points binned.
+    """
+    cdef Py_ssize_t k, n, cell
+    cdef long long i, j, nbinned = 0
+    cdef double z, delta
+    cdef bint has_count = count is not None
+    cdef bint has_total = total is not None
+    cdef bint has_mean = mean is not None
+    cdef bint has_m2 = m2 is not None
+    cdef bint has_min = vmin is not None
+    cdef bint has_max = vmax is not None
+
+    n = I.shape[0]
+    if (J.shape[0] != n) or (Z.shape[0] != n) or (cells.shape[0] != n):
+        raise ValueError("position, value and cell arrays must have equal length")
+    for a in (count, total, mean, m2, vmin, vmax):
+        if a is not None and a.shape[0] != ny*nx:
+            raise ValueError("statistics arrays must have ny*nx elements")
+    if (not has_count and (has_mean or has_min or has_max)) or \
+       (has_m2 and not has_mean):
+        raise ValueError("mean, min and max require count, and m2 requires mean")
+
+    with nogil:
+        for k in range(n):
+            z = Z[k]
+            if (z != z) or (I[k] != I[k]) or (J[k] != J[k]):
+                cells[k] = -1
+                continue
+            i = <long long> floor(I[k] + 0.5)
+            j = <long long> floor(J[k] + 0.5)
+            if (i < 0) or (i >= ny) or (j < 0) or (j >= nx):
+                cells[k] = -1
+                continue
+
+            cell = i*nx + j
+            cells[k] = cell
+            nbinned += 1
+            if has_total:
+                total[cell] += z
+            if not has_count:
+                continue
+            count[cell] += 1
+            if has_mean:
+                # Welford's update of the mean and squared deviations
+                delta = z - mean[cell]
+                mean[cell] += delta / count[cell]
+                if has_m2:
+                    m2[cell] += delta * (z - mean[cell])
+            if has_min and (count[cell] == 1 or z < vmin[cell]):
+                vmin[cell] = z
+            if has_max and (count[cell] == 1 or z > vmax[cell]):
+                vmax[cell] = z
+    return nbinned
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def burn_edges(double[:] I0 not None,
+               double[:] J0 not None,
+               double[:] I1 not None,
+               double[:] J1 not None,
+               long row0, long col0,
+               np.int32_t[:,::1] winding not None):
+    """ burn_edges computes the winding number of polygon edges about the
+    cells of a window of a grid, starting at row *row0* and column *col0*,
+    and writes it to *winding*. Edges run from float corner positions (*I0*,
+    *J0*) to (*I1*, *J1*), where cell (i, j) spans rows i to i+1 and columns
+    j to j+1. Edges directed toward increasing rows count positively.
+
+    Vertices are snapped to the nearest cell corner, and each edge crosses
+    the rows between its rounded end rows. A cell is counted when the edge
+    passes to its left along the row's leading boundary. The GIL is released
+    while computing.
+    """
+    cdef Py_ssize_t k, n, ny, nx
+    cdef long i, j, istart, iend, ia, ib, lo, hi
+    cdef double slope, jstart
+    cdef int sign
+    cdef np.int32_t w
+
+    n = I0.shape[0]
+    if (J0.shape[0] != n) or (I1.shape[0] != n) or (J1.shape[0] != n):
+        raise ValueError("edge arrays must have equal length")
+    ny = winding.shape[0]
+    nx = winding.shape[1]
+
+    with nogil:
+        winding[:,:] = 0
+        for k in range(n):
+            ia = <long> rint(I0[k])
+            ib = <long> rint(I1[k])
+            if ia == ib:
+                continue
+            slope = (J1[k] - J0[k]) / (I1[k] - I0[k])
+            if ib > ia:
+                istart, iend, jstart, sign = ia, ib, rint(J0[k]), 1
+            else:
+                istart, iend, jstart, sign = ib, ia, rint(J1[k]), -1
+
+            lo = istart if istart > row0 else row0
+            hi = iend if iend < row0+ny else row0+ny
+            for i in range(lo, hi):
+                j = <long> rint((i-istart)*slope + jstart) - col0
+                if j < nx:
+                    winding[i-row0, j if j > 0 else 0] += sign
+
+        # accumulate edge crossings along each row
+        for i in range(ny):
+            w = 0
+            for j in range(nx):
+                w += winding[i, j]
+                winding[i, j] = w
+    return
+
+# Rules for combining burned values with values already in a cell
+BURN_MERGE = ("replace", "add", "max", "min")
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void burn_cell(double[:,::1] out, np.uint8_t[:,::1] filled,
+                           np.int64_t[:,::1] stamp, long i, long j, double v,
+                           np.int64_t fid, int merge) nogil:
+    if stamp[i, j] == fid:
+        return
+    stamp[i, j] = fid
+    if (filled[i, j] == 0) or (merge == 0):
+        out[i, j] = v
+        filled[i, j] = 1
+    elif merge == 1:
+        out[i, j] += v
+    elif merge == 2:
+        if v > out[i, j]:
+            out[i, j] = v
+    elif v < out[i, j]:
+        out[i, j] = v
+    return
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def burn_segments(double[:] I0 not None,
+                  double[:] J0 not None,
+                  double[:] I1 not None,
+                  double[:] J1 not None,
+                  np.int64_t[:] fid not None,
+                  double[:] values not None,
+                  long row0, long col0,
+                  double[:,::1] out not None,
+                  np.uint8_t[:,::1] filled not None,
+                  np.int64_t[:,::1] stamp not None,
+                  int merge, bint all_touched):
+    """ burn_segments burns line segments from float corner positions (*I0*,
+    *J0*) to (*I1*, *J1*) into a window of a grid starting at row *row0* and
+    column *col0*, where cell (i, j) spans rows i to i+1 and columns j to
+    j+1. A segment of zero length burns the cell containing it.
+
+    Each segment burns its value into *out* using the rule *merge*, an index
+    into BURN_MERGE, and marks cells in *filled*, which holds whether each
+    cell already has a value. A cell is burned at most once by each feature
+    id in *fid*, which is recorded in *stamp*, so segments of a feature must
+    be consecutive.
+
+    If *all_touched* is False, segments burn one cell for each row or column
+    crossed along their major axis. Otherwise they burn every cell they pass
+    through. The GIL is released while computing.
+    """
+    cdef Py_ssize_t k, n, ny, nx
+    cdef long i, j, m, m0, m1, step, iend, jend, di, dj
+    cdef double a0, b0, a1, b1, c, t, lo, hi, tmin, tmax, p, q, r
+    cdef double tnexti, tnextj, tdi, tdj
+    cdef double bounds[4]
+    cdef int e
+
+    n = I0.shape[0]
+    for a in (J0, I1, J1):
+        if a.shape[0] != n:
+            raise ValueError("segment arrays must have equal length")
+    if (fid.shape[0] != n) or (values.shape[0] != n):
+        raise ValueError("feature ids and values must match segments")
+    ny = out.shape[0]
+    nx = out.shape[1]
+    if (filled.shape[0] != ny) or (filled.shape[1] != nx) or \
+       (stamp.shape[0] != ny) or (stamp.shape[1] != nx):
+        raise ValueError("filled and stamp must match out")
+
+    with nogil:
+        for k in range(n):
+            # positions relative to the window
+            a0 = I0[k] - row0
+            b0 = J0[k] - col0
+            a1 = I1[k] - row0
+            b1 = J1[k] - col0
+
+            if not all_touched:
+                if fabs(a1-a0) >= fabs(b1-b0):
+                    # one cell per row, sampled where the segment crosses
+                    # the middle of the row
+                    m0 = <long> floor(a0)
+                    m1 = <long> floor(a1)
+                    step = 1 if m1 >= m0 else -1
+                    lo = a0 if a0 < a1 else a1
+                    hi = a1 if a0 < a1 else a0
+                    m = m0
+                    while True:
+                        if 0 <= m < ny:
+                            c = m + 0.5
+                            c = lo if c < lo else (hi if c > hi else c)
+                            t = 0.0 if a1 == a0 else (c-a0) / (a1-a0)
+                            j = <long> floor(b0 + t*(b1-b0))
+                            if 0 <= j < nx:
+                                burn_cell(out, filled, stamp, m, j, values[k],
+                                          fid[k], merge)
+                        if m == m1:
+                            break
+                        m += step
+                else:
+                    m0 = <long> floor(b0)
+                    m1 = <long> floor(b1)
+                    step = 1 if m1 >= m0 else -1
+                    lo = b0 if b0 < b1 else b1
+                    hi = b1 if b0 < b1 else b0
+                    m = m0
+                    while True:
+                        if 0 <= m < nx:
+                            c = m + 0.5
+                            c = lo if c < lo else (hi if c > hi else c)
+                            t = (c-b0) / (b1-b0)
+                            i = <long> floor(a0 + t*(a1-a0))
+                            if 0 <= i < ny:
+                                burn_cell(out, filled, stamp, i, m, values[k],
+                                          fid[k], merge)
+                        if m == m1:
+                            break
+                        m += step
+                continue
+
+            # clip the segment to the window (Liang-Barsky)
+            tmin = 0.0
+            tmax = 1.0
+            bounds[0] = -a0
+            bounds[1] = a0 - ny
+            bounds[2] = -b0
+            bounds[3] = b0 - nx
+            for e in range(4):
+                p = (a0-a1) if e == 0 else ((a1-a0) if e == 1 else
+                        ((b0-b1) if e == 2 else (b1-b0)))
+                q = -bounds[e]
+                if p == 0:
+                    if q < 0:
+                        tmin = 2.0
+                else:
+                    r = q / p
+                    if p < 0:
+                        if r > tmin:
+                            tmin = r
+                    elif r < tmax:
+                        tmax = r
+            if tmin > tmax:
+                continue
+
+            # traverse the cells between the clipped end points
+            p = a0 + tmin*(a1-a0)
+            q = b0 + tmin*(b1-b0)
+            i = <long> floor(p)
+            j = <long> floor(q)
+            iend = <long> floor(a0 + tmax*(a1-a0))
+            jend = <long> floor(b0 + tmax*(b1-b0))
+            i = 0 if i < 0 else (ny-1 if i >= ny else i)
+            j = 0 if j < 0 else (nx-1 if j >= nx else j)
+            iend = 0 if iend < 0 else (ny-1 if iend >= ny else iend)
+            jend = 0 if jend < 0 else (nx-1 if jend >= nx else jend)
+
+            di = 1 if a1 > a0 else -1
+            dj = 1 if b1 > b0 else -1
+            if a1 == a0:
+                tnexti = tdi = 2.0
+            else:
+                tdi = 1.0 / fabs(a1-a0)
+                tnexti = ((i + (1 if di > 0 else 0)) - a0) / (a1-a0)
+            if b1 == b0:
+                tnextj = tdj = 2.0
+            else:
+                tdj = 1.0 / fabs(b1-b0)
+                tnextj = ((j + (1 if dj > 0 else 0)) - b0) / (b1-b0)
+
+            while True:
+                burn_cell(out, filled, stamp, i, j, values[k], fid[k], merge)
+                if (i == iend) and (j == jend):
+                    break
+                if tnexti < tnextj:
+                    if tnexti > tmax:
+                        break
+                    i += di
+                    tnexti += tdi
+                else:
+                    if tnextj > tmax:
+                        break
+                    j += dj
+                    tnextj += tdj
+                if (i < 0) or (i >= ny) or (j < 0) or (j >= nx):
+                    break
+    return
+
+# Pairs of square edges (0 top, 1 right, 2 bottom, 3 left) crossed by
+# contours for each marching squares case, with -1 marking no segment.
+# Saddles (cases 5 and 10) are listed for a center below the level, and
+# resolved by the center value while contouring.
+cdef int SQUARE_EDGES[16][4]
+SQUARE_EDGES[:] = [[-1, -1, -1, -1], [3, 0, -1, -1], [0, 1, -1, -1],
+                   [3, 1, -1, -1], [1, 2, -1, -1], [3, 0, 1, 2],
+                   [0, 2, -1, -1], [3, 2, -1, -1], [2, 3, -1, -1],
+                   [0, 2, -1, -1], [0, 1, 2, 3], [1, 2, -1, -1],
+                   [3, 1, -1, -1], [0, 1, -1, -1], [3, 0, -1, -1],
+                   [-1, -1, -1, -1]]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void crossing(double[:,::1] values, Py_ssize_t i, Py_ssize_t j,
+                          int edge, double level, long row0, long col0,
+                          long nx, np.int64_t *eid, double *pi,
+                          double *pj) nogil:
+    # Edges are identified over the whole grid: the horizontal edge from
+    # cell (i, j) to (i, j+1) is 2*(i*nx+j) and the vertical edge from (i, j)
+    # to (i+1, j) is 2*(i*nx+j)+1. Crossings are interpolated from the cell
+    # with the lower index, so that squares sharing an edge agree.
+    cdef Py_ssize_t i0 = i, j0 = j
+    cdef double v0, v1, t
+    cdef bint vertical
+    if edge == 1:
+        j0 = j + 1
+    elif edge == 2:
+        i0 = i + 1
+    vertical = (edge == 1) or (edge == 3)
+    v0 = values[i0, j0]
+    v1 = values[i0+1, j0] if vertical else values[i0, j0+1]
+    t = (level - v0) / (v1 - v0)
+    eid[0] = 2*((i0+row0)*nx + j0+col0) + (1 if vertical else 0)
+    pi[0] = i0 + row0 + (t if vertical else 0.0)
+    pj[0] = j0 + col0 + (0.0 if vertical else t)
+    return
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def marching_squares(double[:,::1] values not None,
+                     double level, long row0, long col0, long nx,
+                     np.int64_t[:,::1] edges not None,
+                     double[:,::1] positions not None):
+    """ marching_squares finds the segments of the contour at *level* through
+    the squares between the centers of cells in *values*, which is a window
+    starting at row *row0* and column *col0* of a grid with *nx* columns.
+    Squares with a NaN corner are skipped.
+
+    For each segment, the ids of the two cell edges crossed by the contour
+    are written to a row of *edges* (an (n, 2) array), and the float row and
+    column of the crossings to a row of *positions* (an (n, 4) array). Edge
+    ids are unique within the grid, so segments are joined where they share
+    an edge. The arrays must have room for two segments per square. The GIL
+    is released while computing.
+
+    Returns the number of segments.
+    """
+    cdef Py_ssize_t i, j, ny, mx, k, nseg = 0
+    cdef int case, e
+    cdef double a, b, c, d, center
+    cdef int *pairs
+
+    ny = values.shape[0]
+    mx = values.shape[1]
+    if (edges.shape[1] != 2) or (positions.shape[1] != 4) or \
+       (edges.shape[0] < 2*(ny-1)*(mx-1)) or \
+       (positions.shape[0] < edges.shape[0]):
+        raise ValueError("output arrays must have room for two segments per square")
+
+    with nogil:
+        for i in range(ny-1):
+            for j in range(mx-1):
+                a = values[i, j]
+                b = values[i, j+1]
+                c = values[i+1, j+1]
+                d = values[i+1, j]
+                if (a != a) or (b != b) or (c != c) or (d != d):
+                    continue
+                case = ((1 if a >= level else 0) | (2 if b >= level else 0) |
+                        (4 if c >= level else 0) | (8 if d >= level else 0))
+                if (case == 0) or (case == 15):
+                    continue
+                pairs = SQUARE_EDGES[case]
+                if (case == 5) or (case == 10):
+                    center = 0.25 * (a + b + c + d)
+                    if center >= level:
+                        pairs = SQUARE_EDGES[15-case]
+                for k in range(0, 4, 2):
+                    if pairs[k] == -1:
+                        break
+                    for e in range(2):
+                        crossing(values, i, j, pairs[k+e], level, row0, col0,
+                                 nx, &edges[nseg, e], &positions[nseg, 2*e],
+                                 &positions[nseg, 2*e+1])
+                    nseg += 1
+    return nseg
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def trace_paths(np.int64_t[:] partner not None,
+                np.int64_t[:] ends not None,
+                np.int64_t[:] starts not None):
+    """ trace_paths joins *n* segments into paths. Segment ends are numbered
+    k and k+n for the first and second end of segment k, and *partner* (of
+    length 2n) holds the end joined to each end, or -1.
+
+    Paths are written to *ends* (of length 2n) as the sequence of ends
+    visited, with path p occupying ``ends[starts[p]:starts[p+1]]``, so
+    *starts* must have length n+1. Open paths come first, and closed paths
+    repeat their first point. The GIL is released while computing.
+
+    Returns the number of paths.
+    """
+    cdef Py_ssize_t n, s, k, m = 0, npaths = 0
+    cdef np.int64_t enter, exit_, p
+    cdef int closed
+    cdef np.uint8_t[:] visited
+
+    n = partner.shape[0] // 2
+    if (ends.shape[0] < 2*n) or (starts.shape[0] < n+1):
+        raise ValueError("ends must have length 2n and starts length n+1")
+    visited = np.zeros(n, dtype=np.uint8)
 
-    left = (c-a)*y + a
-    right = (d-b)*y + b
-    res = (right - left) * x + left
-    return res
+    with nogil:
+        starts[0] = 0
+        for closed in range(2):
+            for s in range(n):
+                if visited[s]:
+                    continue
+                if closed:
+                    enter = s
+                elif partner[s] == -1:
+                    enter = s
+                elif partner[s+n] == -1:
+                    enter = s + n
+                else:
+                    continue
 
+                k = s
+                ends[m] = enter
+                m += 1
+                while True:
+                    visited[k] = 1
+                    exit_ = enter + n if enter < n else enter - n
+                    ends[m] = exit_
+                    m += 1
+                    p = partner[exit_]
+                    if p == -1:
+                        break
+                    k = p if p < n else p - n
+                    if visited[k]:
+                        break
+                    enter = p
+                npaths += 1
+                starts[npaths] = m
+    return npaths
@@ -1,20 +1,38 @@
 """
 Raster grid representations
 """
+import os
 import copy
+import collections
 import math
 import numbers
+import multiprocessing
+import shutil
+import tempfile
+import threading
 import warnings
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from . import _gtiff
+from . import _chunkstore
+from . import _overview
 from . import crfuncs
-from .band import SimpleBand, CompressedBand, BandIndexer
+from .band import (SimpleBand, CompressedBand, MmapBand, BandIndexer,
+                   BandWindow, InterleavedBand, InterleavedComponent, _isdata)
+from . import band as _band
 from .. import errors
 from ..crs import Cartesian
+from ..vector.table import Table
 
 BAND_CLASS_DEFAULT = CompressedBand
 CRS_DEFAULT = Cartesian
 
+# Executors used by `RegularGrid.map_blocks`
+MAP_EXECUTORS = ("thread", "process")
+
+# Statistics computed by `RegularGrid.zonal_stats`
+ZONAL_STATISTICS = ("count", "sum", "mean", "min", "max", "std", "histogram")
+
 class Grid(object):
     """ Grid base class. """
 
@@ -22,9 +40,23 @@ class Grid(object):
     def nodata(self):
         return self._nodata
 
+    def _chunkstats(self, nodata=None):
+        """ Return a list of per-chunk (count, min, max) arrays for each band,
+        or None if any band does not maintain chunk statistics. """
+        bands = getattr(self, "bands", None)
+        if not bands or not all(hasattr(b, "chunkstats") for b in bands):
+            return None
+        if nodata is None:
+            nodata = self.nodata
+        return [band.chunkstats(nodata) for band in bands]
+
     def max(self):
         """ Return the maximum non-nan in self.data. """
-        tmp = self[self.data_mask]
+        stats = self._chunkstats()
+        if stats is not None:
+            tmp = np.concatenate([vmax[count != 0] for count, _, vmax in stats])
+        else:
+            tmp = self[self.data_mask]
         if len(tmp) != 0:
             return tmp.max()
         else:
@@ -32,7 +64,11 @@ class Grid(object):
 
     def min(self):
         """ Return the minimum non-nan in self.data. """
-        tmp = self[self.data_mask]
+        stats = self._chunkstats()
+        if stats is not None:
+            tmp = np.concatenate([vmin[count != 0] for count, vmin, _ in stats])
+        else:
+            tmp = self[self.data_mask]
         if len(tmp) != 0:
             return tmp.min()
         else:
@@ -40,6 +76,11 @@ class Grid(object):
 
     def minmax(self):
         """ Return the minimum and maximum value of data array. """
+        stats = self._chunkstats()
+        if stats is not None:
+            if any(count.any() for count, _, _ in stats):
+                return (self.min(), self.max())
+            return (np.nan, np.nan)
         tmp = self[self.data_mask]
         if len(tmp) != 0:
             return (tmp.min(), tmp.max())
@@ -82,7 +123,7 @@ class RegularGrid(Grid):
     e = f = 0
     """
     def __init__(self, transform, values=None, bands=None, crs=None,
-            nodata_value=None, bandclass=None):
+            nodata_value=None, bandclass=None, bandkwargs=None):
         """ Create a RegularGrid instance.
 
         Parameters
@@ -107,7 +148,11 @@ class RegularGrid(Grid):
             neither is provided, the default is NaN.
         bandclass : class, optional
             indicates the band class used to represent grid data. default
-            BAND_CLASS_DEFAULT
+            BAND_CLASS_DEFAULT. If `InterleavedBand`, all bands are stored
+            together in pixel-interleaved chunks.
+        bandkwargs : dict, optional
+            additional keyword arguments used when creating bands, e.g. the
+            chunk size or compression settings of a CompressedBand
         """
 
         if hasattr(transform, "keys"):
@@ -123,31 +168,56 @@ class RegularGrid(Grid):
                                    " transform iterable or dictionary")
 
         if bands is not None:
-            self._bndcls = type(bands[0])
+            # New bands are made with the class of the band underlying any
+            # window or interleaved component, or the default class for
+            # bands that cannot be created standalone (e.g. file-backed)
+            band = bands[0]
+            if isinstance(band, BandWindow):
+                band = band.band
+            if isinstance(band, InterleavedComponent):
+                band = band.store
+            self._bndcls = type(band)
+            if not issubclass(self._bndcls, (SimpleBand, MmapBand,
+                                             CompressedBand)):
+                self._bndcls = BAND_CLASS_DEFAULT
         elif bandclass is None:
             self._bndcls = BAND_CLASS_DEFAULT
         else:
             self._bndcls = bandclass
 
+        if bandkwargs is None:
+            self._bndkw = {}
+        else:
+            self._bndkw = dict(bandkwargs)
+
         if bands is not None:
             self.bands = bands
         else:
             self.bands = []
 
         if bands is None and (values is not None):
-            if values.ndim == 2:
-                band = self._bndcls(values.shape, values.dtype.type)
+            if issubclass(self._bndcls, InterleavedBand) and values.ndim in (2, 3):
+                nbands = 1 if values.ndim == 2 else values.shape[2]
+                store = self._bndcls(values.shape[:2], values.dtype.type,
+                                     nbands=nbands, **self._bndkw)
+                store[:,:] = values.reshape(values.shape[:2] + (nbands,))
+                self.bands.extend(store.components())
+            elif values.ndim == 2:
+                band = self._bndcls(values.shape, values.dtype.type,
+                                    **self._bndkw)
                 band[:,:] = values
                 self.bands.append(band)
             elif values.ndim == 3:
                 for ibnd in range(values.shape[2]):
-                    band = self._bndcls(values.shape[:2], values.dtype.type)
+                    band = self._bndcls(values.shape[:2], values.dtype.type,
+                                        **self._bndkw)
                     band[:,:] = values[:,:,ibnd]
                     self.bands.append(band)
             else:
                 raise ValueError("`values` must have two or three dimensions")
 
         self._bandindexer = BandIndexer(self.bands)
+        self._overviews = None
 
         if crs is None:
             self.crs = CRS_DEFAULT
@@ -180,8 +250,38 @@ class RegularGrid(Grid):
             raise errors.NonEquivalentGridError(self, other)
 
     def __getitem__(self, key):
+        if self._overviews is not None and isinstance(key, tuple):
+            indexer = self._quicklook(key)
+            if indexer is not None:
+                return indexer
         return self._bandindexer[key]
 
+    def _quicklook(self, key):
+        """ Return the values selected by *key* from a "nearest" overview if
+        *key* is a pair of slices starting from zero with the same step as an
+        overview factor, otherwise None. Nearest overviews hold exactly the
+        cells selected by such slices. """
+        if len(key) != 2 or not all(isinstance(k, slice) for k in key):
+            return None
+        if key[0].step != key[1].step or key[0].step is None:
+            return None
+        factor = key[0].step
+        if not (key[0].start in (None, 0) and key[1].start in (None, 0)):
+            return None
+        if self._overviews["method"] != "nearest" or \
+                factor not in self._overviews["levels"] or \
+                not self._overviews_current():
+            return None
+
+        stops = []
+        for k, n in zip(key, self.size):
+            stop = n if k.stop is None else min(k.stop, n)
+            if stop < 0:
+                return None
+            stops.append(-(-stop // factor))
+        bands = self._overviews["levels"][factor]
+        return BandIndexer(bands)[:stops[0], :stops[1]]
+
     def __setitem__(self, key, value):
         self._bandindexer[key] = value
         return
@@ -342,12 +442,7 @@ class RegularGrid(Grid):
         """
         if nodata is None:
             nodata = self.nodata
-
-        if np.isnan(nodata):
-            isdata = lambda a: ~np.isnan(a)
-        else:
-            def isdata(a):
-                return a != nodata
+        mask = self._data_mask(nodata)
 
         dx, dy = self.transform[2:4]
         sx, sy = self.transform[4:6]
@@ -367,9 +462,9 @@ class RegularGrid(Grid):
 
         jvec = np.arange(nx)
 
-        for i, row in enumerate(self[:,:]):
-            x = (x0 + jvec*dx + i*sx)[isdata(row)]
-            y = (y0 + i*dy + jvec*sy)[isdata(row)]
+        for i in np.nonzero(mask.any(axis=1))[0]:
+            x = (x0 + jvec*dx + i*sx)[mask[i]]
+            y = (y0 + i*dy + jvec*sy)[mask[i]]
 
             if len(x) != 0:
 
@@ -408,11 +503,16 @@ class RegularGrid(Grid):
     @property
     def data_mask(self):
         """ 8-bit mask of valid data cells """
-        if np.isnan(self.nodata):
+        return self._data_mask(self.nodata)
+
+    def _data_mask(self, nodata):
+        if len(self.bands) == 1 and hasattr(self.bands[0], "datamask"):
+            return self.bands[0].datamask(nodata)
+        if np.isnan(nodata):
             isdata = lambda a: ~np.isnan(a)
         else:
             def isdata(a):
-                return a != self.nodata
+                return a != nodata
         return isdata(self[:,:])
 
     def aschunks(self, size=(-1, -1), overlap=(0, 0), copy=True):
@@ -427,8 +527,9 @@ class RegularGrid(Grid):
         overlap : tuple of two integers, optional
             number of pixels of overlap (default (0, 0))
         copy : bool
-            whether to force returned grids to be copies
-            warning: output may be a copy regardless, depending on the band class
+            whether to return grids holding copies of the data (default True).
+            Otherwise, grids are windows of this grid (see `window`), which
+            cost no memory until they are read.
 
         Yields
         ------
@@ -456,12 +557,171 @@ class RegularGrid(Grid):
                  T0[2], T0[3], T0[4], T0[5]]
             if copy:
                 v = self[i0:i0+size[1], j0:j0+size[0]].copy()
+                yield RegularGrid(T, values=v, crs=self.crs,
+                                  nodata_value=self.nodata)
             else:
-                v = self[i0:i0+size[1], j0:j0+size[0]]
-            yield RegularGrid(T, values=v, crs=self.crs, nodata_value=self.nodata)
+                yield self.window(i0, min(i0+size[1], ny),
+                                  j0, min(j0+size[0], nx))
             j0 += size[0]-overlap[0]
 
-    def clip(self, xmin, xmax, ymin, ymax, crs=None):
+    def map_blocks(self, func, overlap=(0, 0), workers=None, executor="thread",
+                   out_dtype=None, blocksize=None, nodata_value=None,
+                   bandclass=None, bandkwargs=None):
+        """ Apply a function to blocks of the grid in parallel and return a
+        grid of the results.
+
+        Blocks are aligned with the chunks of the grid's bands, and each is
+        passed to *func* with a halo of *overlap* cells on every side, padded
+        with nodata beyond the edges of the grid. The halo is trimmed from
+        the result, which is written to new chunked bands. Blocks are read
+        and results written by the calling thread, and only a few blocks per
+        worker are held in memory at once, so grids larger than memory can be
+        processed.
+
+        Parameters
+        ----------
+        func : callable
+            function taking an array of the block's values, shaped (rows,
+            columns) for a grid with one band or (rows, columns, bands)
+            otherwise, and returning an array of results of the same shape,
+            or a 2D array for a single output band. With *executor*
+            "process", *func* must be picklable (e.g. defined at module
+            level).
+        overlap : tuple of ints, optional
+            (rows, columns) of halo on each side of a block (default (0, 0))
+        workers : int, optional
+            number of workers (default the number of CPUs)
+        executor : str, optional
+            "thread" (default) or "process". Threads suit functions that
+            release the GIL, such as most numpy operations on large arrays.
+        out_dtype : numpy dtype, optional
+            dtype of the output bands (default the dtype of the first result)
+        blocksize : tuple of ints, optional
+            (rows, columns) of a block, without halo (default the chunk size
+            of the first band, or (256, 256)). Blocks of a window are aligned
+            with the chunks of the band it views.
+        nodata_value : number, optional
+            nodata value of the output grid (default the grid's nodata
+            value)
+        bandclass : class, optional
+            band class of the output (default BAND_CLASS_DEFAULT)
+        bandkwargs : dict, optional
+            keyword arguments used to create output bands (default chunks of
+            *blocksize* for a CompressedBand)
+
+        Returns
+        -------
+        RegularGrid
+        """
+        if executor not in MAP_EXECUTORS:
+            raise ValueError("executor must be one of {0}".format(MAP_EXECUTORS))
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if blocksize is None:
+            blocksize = getattr(self.bands[0], "_chunksize", (256, 256))
+        if nodata_value is None:
+            nodata_value = self.nodata
+        if bandclass is None:
+            bandclass = BAND_CLASS_DEFAULT
+        if bandkwargs is None:
+            bandkwargs = {}
+            if issubclass(bandclass, CompressedBand):
+                bandkwargs["chunksize"] = tuple(blocksize)
+
+        ny, nx = self.size
+        by, bx = blocksize
+        h, w = overlap
+        nb = len(self.bands)
+
+        # blocks of a window start on the block grid of the parent band, so
+        # that by default each block reads whole chunks
+        y0 = x0 = 0
+        if isinstance(self.bands[0], BandWindow):
+            y0 = -(self.bands[0].yoff % by)
+            x0 = -(self.bands[0].xoff % bx)
+        dtype = np.result_type(*[band.dtype for band in self.bands])
+
+        def read(a0, a1, b0, b1):
+            block = np.empty((a1-a0+2*h, b1-b0+2*w, nb), dtype=dtype)
+            block.fill(self.nodata)
+            r0, r1 = max(a0-h, 0), min(a1+h, ny)
+            c0, c1 = max(b0-w, 0), min(b1+w, nx)
+            for k, band in enumerate(self.bands):
+                block[r0-a0+h:r1-a0+h, c0-b0+w:c1-b0+w, k] = \
+                        np.asarray(band[r0:r1, c0:c1]).reshape(r1-r0, c1-c0)
+            return block[:,:,0] if nb == 1 else block
+
+        bands = []
+        def write(tile, result):
+            a0, a1, b0, b1 = tile
+            result = np.asarray(result)
+            shape = (a1-a0+2*h, b1-b0+2*w)
+            if result.ndim not in (2, 3) or result.shape[:2] != shape:
+                raise errors.GridError("map_blocks function returned shape "
+                                       "{0} for a block of shape "
+                                       "{1}".format(result.shape, shape))
+            if result.ndim == 2:
+                result = result[:,:,np.newaxis]
+            if len(bands) == 0:
+                for _ in range(result.shape[2]):
+                    bands.append(bandclass(self.size, out_dtype or result.dtype,
+                                           initval=nodata_value, **bandkwargs))
+            elif result.shape[2] != len(bands):
+                raise errors.GridError("map_blocks function returned a varying "
+                                       "number of bands")
+            for k, band in enumerate(bands):
+                band[a0:a1, b0:b1] = result[h:h+a1-a0, w:w+b1-b0, k]
+
+        if executor == "thread":
+            pool = ThreadPool(workers)
+        else:
+            pool = multiprocessing.Pool(workers)
+        try:
+            pending = collections.deque()
+            for a0 in range(y0, ny, by):
+                for b0 in range(x0, nx, bx):
+                    tile = (max(a0, 0), min(a0+by, ny), max(b0, 0), min(b0+bx, nx))
+                    pending.append((tile, pool.apply_async(func, (read(*tile),))))
+                    if len(pending) >= 2*workers:
+                        tile, result = pending.popleft()
+                        write(tile, result.get())
+            while len(pending) != 0:
+                tile, result = pending.popleft()
+                write(tile, result.get())
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return RegularGrid(self.transform, bands=bands, crs=self.crs,
+                           nodata_value=nodata_value, bandkwargs=bandkwargs)
+
+    def window(self, i0, i1, j0, j1):
+        """ Return a grid that is a view of rows *i0* to *i1* and columns *j0*
+        to *j1* of this grid. The returned grid holds no data of its own:
+        values are read from this grid when accessed, and assignments to it
+        modify this grid.
+
+        Parameters
+        ----------
+        i0, i1 : int
+            row range
+        j0, j1 : int
+            column range
+        """
+        ny, nx = self.size
+        if not (0 <= i0 <= i1 <= ny and 0 <= j0 <= j1 <= nx):
+            raise errors.GridError("window ({0}:{1}, {2}:{3}) outside of grid "
+                                   "with size {4}".format(i0, i1, j0, j1,
+                                                          self.size))
+        t = self.transform
+        x0 = t[0] + j0*t[2] + i0*t[4]
+        y0 = t[1] + i0*t[3] + j0*t[5]
+        tnew = (x0, y0, t[2], t[3], t[4], t[5])
+        bands = [BandWindow(band, i0, j0, (i1-i0, j1-j0)) for band in self.bands]
+        return RegularGrid(tnew, bands=bands, crs=self.crs,
+                           nodata_value=self.nodata, bandkwargs=self._bndkw)
+
+    def clip(self, xmin, xmax, ymin, ymax, crs=None, copy=True):
         """ Return a clipped version of grid with cell centers constrained to a
         bounding box.
 
@@ -472,6 +732,10 @@ class RegularGrid(Grid):
         ymin : float
         ymax : float
         crs : karta.crs.CRS subclass, optional
+        copy : bool, optional
+            if True (default), the clipped grid holds a copy of the data.
+            Otherwise it is a window that reads from and writes to this grid
+            (see `window`).
         """
         if crs is not None:
             x, y = crs.transform(self.crs, [xmin, xmin, xmax, xmax],
@@ -489,10 +753,14 @@ class RegularGrid(Grid):
         ul = self.get_positions(xmin, ymax)
         ur = self.get_positions(xmax, ymax)
 
-        i0 = int(np.ceil(min(ll[0], lr[0], ul[0], ur[0])))
-        i1 = int(np.floor(max(ll[0], lr[0], ul[0], ur[0]))) + 1
-        j0 = int(np.ceil(min(ll[1], lr[1], ul[1], ur[1])))
-        j1 = int(np.floor(max(ll[1], lr[1], ul[1], ur[1]))) + 1
+        ny, nx = self.size
+        i0 = max(0, int(np.ceil(min(ll[0], lr[0], ul[0], ur[0]))))
+        i1 = min(ny, int(np.floor(max(ll[0], lr[0], ul[0], ur[0]))) + 1)
+        j0 = max(0, int(np.ceil(min(ll[1], lr[1], ul[1], ur[1]))))
+        j1 = min(nx, int(np.floor(max(ll[1], lr[1], ul[1], ur[1]))) + 1)
+
+        if not copy:
+            return self.window(i0, i1, j0, j1)
 
         values = self[i0:i1,j0:j1].copy()
         x0 = t[0] + j0*t[2] + i0*t[4]
@@ -545,62 +813,417 @@ class RegularGrid(Grid):
         i0 = max(0,  int(_round((bbnew[1]-bb[1])/dy)))
         i1 = min(ny, int(_round((bbnew[3]-bb[1])/dy)))
 
-        newbands = []
-        for band in self.bands:
-            newband = self._bndcls((nynew, nxnew), dtype=band.dtype,
-                                   initval=self.nodata)
-            newband[i0new:i1new, j0new:j1new] = band[i0:i1, j0:j1]
-            newbands.append(newband)
+        newbands = self._newbands((nynew, nxnew))
+        for band, newband in zip(self.bands, newbands):
+            # Copy strips of rows, so that a chunked band is never read into
+            # memory at once
+            nstrip = getattr(band, "_chunksize", (max(i1-i0, 1),))[0]
+            for i in range(i0, i1, nstrip):
+                iend = min(i+nstrip, i1)
+                newband[i0new+i-i0:i0new+iend-i0, j0new:j1new] = \
+                        band[i:iend, j0:j1]
 
         gridnew = RegularGrid(Tnew, bands=newbands, crs=self.crs,
-                              nodata_value=self.nodata)
+                              nodata_value=self.nodata,
+                              bandkwargs=self._bndkw)
         return gridnew
 
-    def mask_by_poly(self, polys, inplace=False):
+    def polygon_window(self, polys):
+        """ Return the (row0, row1, col0, col1) window of the grid that
+        contains cells inside polygons. The window is empty if no cells are
+        inside.
+
+        Parameters
+        ----------
+        polys : Polygon, Multipolygon or list of Polygon instances
+        """
+        edges = _ring_edges(_polygon_rings(polys, self.crs), self.transform)
+        return _edges_window(edges, self.size)
+
+    def polygon_mask(self, polys, window=None, coverage=False, supersample=4):
+        """ Return a mask of the cells inside polygons, including holes
+        (`Polygon.subs`). Overlapping polygons are combined.
+
+        Parameters
+        ----------
+        polys : Polygon, Multipolygon or list of Polygon instances
+        window : tuple of ints, optional
+            (row0, row1, col0, col1) window of the grid to rasterize, such as
+            that returned by `polygon_window` (default whole grid)
+        coverage : bool, optional
+            if True, return the fraction of each cell covered by the polygons
+            rather than a boolean mask (default False)
+        supersample : int, optional
+            number of subcells along each side of a cell used to estimate
+            coverage (default 4)
+        """
+        if window is None:
+            window = (0, self.size[0], 0, self.size[1])
+        edges = _ring_edges(_polygon_rings(polys, self.crs), self.transform)
+        edges = _edges_in_rows(edges, window[0], window[1])
+        if coverage:
+            return _coverage(_burn(edges, window, supersample), supersample)
+        return _burn(edges, window) != 0
+
+    def mask_by_poly(self, polys, inplace=False, nthreads=None):
         """ Return a grid with all elements outside the bounds of a polygon
         masked by nodata
 
+        Polygons are rasterized and applied a band chunk at a time, and only
+        chunks that overlap the polygons are read.
+
         Parameters
         ----------
         polys : Polygon, Multipolygon or list of Polygon instances
             region(s) defining clibing boundary
         inplace : bool, optional
             whether or not to perform masking in place (default False)
+        nthreads : int, optional
+            number of threads used to rasterize chunks (default number of
+            CPUs)
         """
-        if getattr(polys, "_geotype", "") == "Polygon":
-            polys = [polys]
+        edges = _ring_edges(_polygon_rings(polys, self.crs), self.transform)
+        r0, r1, c0, c1 = _edges_window(edges, self.size)
+        ny, nx = self.size
+        ty, tx = getattr(self.bands[0], "_chunksize", (256, 256))
 
-        msk = None
-        for poly in polys:
+        if inplace:
+            bands = self.bands
+        else:
+            bands = self._newbands(self.size)
+
+        # Chunks outside the window are left as nodata in a new grid and
+        # overwritten in place
+        tiles = []
+        for a0 in range(0, ny, ty):
+            a1 = min(a0+ty, ny)
+            stripedges = None
+            if a0 < r1 and a1 > r0:
+                stripedges = _edges_in_rows(edges, a0, a1)
+            for b0 in range(0, nx, tx):
+                b1 = min(b0+tx, nx)
+                if stripedges is not None and b0 < c1 and b1 > c0:
+                    tiles.append(((a0, a1, b0, b1), stripedges))
+                elif inplace:
+                    tiles.append(((a0, a1, b0, b1), None))
+
+        def burn(tile):
+            window, tileedges = tile
+            if tileedges is None:
+                return window, None
+            return window, _burn(tileedges, window) != 0
+
+        pool = ThreadPool(nthreads)
+        try:
+            for (a0, a1, b0, b1), msk in pool.imap(burn, tiles):
+                if msk is not None and inplace and msk.all():
+                    continue
+                for src, dst in zip(self.bands, bands):
+                    if msk is None:
+                        values = np.full((a1-a0, b1-b0), self.nodata,
+                                         dtype=dst.dtype)
+                    else:
+                        values = np.asarray(src[a0:a1, b0:b1])
+                        values = np.where(msk, values.reshape(msk.shape),
+                                          self.nodata).astype(dst.dtype)
+                    dst[a0:a1, b0:b1] = values
+        finally:
+            pool.close()
+            pool.join()
 
-            x, y = poly.get_coordinate_lists(self.crs)[:2]
-            if not poly.isclockwise():
-                x = x[::-1]
-                y = y[::-1]
+        if inplace:
+            return self
+        else:
+            return RegularGrid(self.transform, bands=bands, crs=self.crs,
+                               nodata_value=self.nodata,
+                               bandkwargs=self._bndkw)
 
-            ny, nx = self.size
-            _msk = mask_poly(x, y, nx, ny, self.transform)
+    def zonal_stats(self, zones, stats=("mean",), bins=None, nthreads=None):
+        """ Return statistics of the cells of each band within polygonal
+        zones.
 
-            if msk is None:
-                msk = _msk
-            else:
-                msk = (msk | _msk)
+        Zone ids are rasterized into label tiles aligned with the band chunks,
+        and every zone is reduced in a single pass over the bands. Only chunks
+        that overlap a zone are read. Cells inside more than one zone count
+        toward the last of them.
 
-        if inplace:
-            for band in self.bands:
-                data = band[:,:]
-                data[~msk] = self.nodata
-                band[:,:] = data
-            return self
+        Parameters
+        ----------
+        zones : Multipolygon, Polygon, or list of Polygon instances
+            zones, including holes. Each polygon of a Multipolygon is a zone.
+        stats : list of str, optional
+            statistics to compute, from "count", "sum", "mean", "min", "max",
+            "std" (population standard deviation), and "histogram"
+            (default ("mean",))
+        bins : sequence of floats, optional
+            monotonically increasing histogram bin edges, required for
+            "histogram". As in `numpy.histogram`, the last bin includes its
+            right edge.
+        nthreads : int, optional
+            number of threads used to rasterize zones (default number of
+            CPUs)
+
+        Returns
+        -------
+        Table with a row for each zone, containing the fields of the
+        Multipolygon data followed by a field for each statistic. When the
+        grid has more than one band, fields are named ``"<stat>_<band>"``.
+        Zones without valid cells have a count and sum of zero and other
+        statistics of NaN. Histograms are lists of counts.
+        """
+        for stat in stats:
+            if stat not in ZONAL_STATISTICS:
+                raise ValueError("statistics must be in {0}".format(ZONAL_STATISTICS))
+        if "histogram" in stats:
+            if bins is None:
+                raise ValueError("histogram requires bins")
+            bins = np.asarray(bins, dtype=np.float64)
+            if len(bins) < 2 or np.any(np.diff(bins) <= 0):
+                raise ValueError("bins must increase monotonically")
+
+        if getattr(zones, "_geotype", "") == "Polygon":
+            zones = [zones]
+        polygons = [zone for zone in zones]
+        zedges = [_ring_edges(_polygon_rings(poly, self.crs), self.transform)
+                  for poly in polygons]
+        windows = np.array([_edges_window(e, self.size) for e in zedges],
+                           dtype=np.int64).reshape(-1, 4)
+
+        nz = len(polygons) + 1
+        nb = len(self.bands)
+        count = np.zeros((nb, nz), dtype=np.int64)
+        total = np.zeros((nb, nz), dtype=np.float64)
+        mean = np.zeros((nb, nz), dtype=np.float64)
+        m2 = np.zeros((nb, nz), dtype=np.float64)
+        vmin = np.full((nb, nz), np.nan)
+        vmax = np.full((nb, nz), np.nan)
+        if "histogram" in stats:
+            nbins = len(bins) - 1
+            hist = np.zeros((nb, nz*nbins), dtype=np.int64)
+
+        ny, nx = self.size
+        ty, tx = getattr(self.bands[0], "_chunksize", (256, 256))
+        tiles = []
+        for a0 in range(0, ny, ty):
+            a1 = min(a0+ty, ny)
+            instrip = np.flatnonzero((windows[:,0] < a1) & (windows[:,1] > a0))
+            if len(instrip) == 0:
+                continue
+            stripedges = dict((k, _edges_in_rows(zedges[k], a0, a1))
+                              for k in instrip)
+            for b0 in range(0, nx, tx):
+                b1 = min(b0+tx, nx)
+                ks = instrip[(windows[instrip,2] < b1) &
+                             (windows[instrip,3] > b0)]
+                if len(ks) != 0:
+                    tiles.append(((a0, a1, b0, b1),
+                                  [(k, windows[k], stripedges[k]) for k in ks]))
+
+        def label(tile):
+            (a0, a1, b0, b1), candidates = tile
+            labels = np.zeros((a1-a0, b1-b0), dtype=np.int32)
+            for k, (r0, r1, c0, c1), edges in candidates:
+                r0, r1 = max(r0, a0), min(r1, a1)
+                c0, c1 = max(c0, b0), min(c1, b1)
+                if r0 >= r1 or c0 >= c1:
+                    continue
+                inside = _burn(edges, (r0, r1, c0, c1)) != 0
+                labels[r0-a0:r1-a0, c0-b0:c1-b0][inside] = k + 1
+            return tile[0], labels
+
+        pool = ThreadPool(nthreads)
+        try:
+            for (a0, a1, b0, b1), labels in pool.imap(label, tiles):
+                inzone = labels != 0
+                if not inzone.any():
+                    continue
+                for ib, band in enumerate(self.bands):
+                    values = np.asarray(band[a0:a1, b0:b1]).reshape(labels.shape)
+                    sel = inzone & _isdata(values, self.nodata)
+                    lab = labels[sel]
+                    v = values[sel].astype(np.float64)
+                    if len(v) == 0:
+                        continue
+
+                    # combine tile statistics with the running statistics
+                    c = np.bincount(lab, minlength=nz)
+                    s = np.bincount(lab, weights=v, minlength=nz)
+                    has = c != 0
+                    mt = np.zeros(nz)
+                    mt[has] = s[has] / c[has]
+                    d = v - mt[lab]
+                    m2t = np.bincount(lab, weights=d*d, minlength=nz)
+                    n = count[ib] + c
+                    delta = mt - mean[ib]
+                    mean[ib,has] += delta[has] * c[has] / n[has]
+                    m2[ib,has] += m2t[has] + \
+                            delta[has]**2 * count[ib,has] * c[has] / n[has]
+                    count[ib] = n
+                    total[ib] += s
+
+                    if "min" in stats or "max" in stats:
+                        order = np.argsort(lab, kind="mergesort")
+                        l, w = lab[order], v[order]
+                        starts = np.flatnonzero(np.r_[True, l[1:] != l[:-1]])
+                        ks = l[starts]
+                        lo = np.minimum.reduceat(w, starts)
+                        hi = np.maximum.reduceat(w, starts)
+                        vmin[ib,ks] = np.fmin(vmin[ib,ks], lo)
+                        vmax[ib,ks] = np.fmax(vmax[ib,ks], hi)
+
+                    if "histogram" in stats:
+                        ibin = np.searchsorted(bins, v, side="right") - 1
+                        ibin[v == bins[-1]] = nbins - 1
+                        inbins = (ibin >= 0) & (ibin < nbins)
+                        hist[ib] += np.bincount(lab[inbins]*nbins + ibin[inbins],
+                                                minlength=nz*nbins)
+        finally:
+            pool.close()
+            pool.join()
+
+        columns = []
+        fields = []
+        for ib in range(nb):
+            empty = count[ib,1:] == 0
+            with np.errstate(invalid="ignore", divide="ignore"):
+                std = np.sqrt(m2[ib,1:] / count[ib,1:])
+            values = {"count": count[ib,1:],
+                      "sum": total[ib,1:],
+                      "mean": np.where(empty, np.nan, mean[ib,1:]),
+                      "min": vmin[ib,1:],
+                      "max": vmax[ib,1:],
+                      "std": np.where(empty, np.nan, std)}
+            if "histogram" in stats:
+                values["histogram"] = hist[ib].reshape(nz, nbins)[1:]
+            for stat in stats:
+                columns.append(values[stat].tolist())
+                fields.append(stat if nb == 1 else "{0}_{1}".format(stat, ib))
+
+        data = getattr(zones, "data", None)
+        if isinstance(data, Table) and len(data.fields) != 0:
+            rows = [tuple(row) + tuple(stat) for row, stat in
+                    zip(data, zip(*columns))]
+            fields = list(data.fields) + fields
         else:
-            return RegularGrid(self.transform,
-                               values=np.where(msk, self[:,:], self.nodata),
-                               crs=self.crs, nodata_value=self.nodata)
+            rows = list(zip(*columns))
+        return Table(rows, fields=fields)
+
+    def build_overviews(self, levels=4, method="mean"):
+        """ Build reduced-resolution copies of the grid with cells 2, 4, 8, ...
+        times larger, up to ``2**levels``. Each level is built block by block
+        from the previous one by aggregating 2x2 windows of cells.
+
+        Overviews are used by `resample` when the output resolution is at
+        least as coarse as an overview, and when *method* is "nearest", by
+        reads of the form ``grid[::n, ::n]`` where *n* is an overview factor.
+        Overviews are discarded once the grid's bands are written to.
+
+        Parameters
+        ----------
+        levels : int, optional
+            number of levels (default 4)
+        method : str, optional
+            aggregation method: "mean" (default), "nearest", "mode", "min",
+            or "max". Cells equal to the nodata value are ignored.
+        """
+        if method not in _overview.METHODS:
+            raise errors.GridError("overview method must be one of "
+                                   "{0}".format(_overview.METHODS))
+
+        overviews = {}
+        src = self.bands
+        factor = 1
+        for _ in range(levels):
+            ny, nx = src[0].size
+            if ny == 1 and nx == 1:
+                break
+            factor *= 2
+            size = (-(-ny // 2), -(-nx // 2))
+            dst = self._newbands(size)
+            for band, newband in zip(src, dst):
+                _overview.build_level(band, newband, method, self.nodata)
+            overviews[factor] = dst
+            src = dst
+
+        self._overviews = {"method": method,
+                           "levels": overviews,
+                           "versions": self._band_versions()}
+        return
+
+    def _newbands(self, size, dtype=None, initval=None):
+        """ Return new bands of *size* with the class, settings, and dtypes of
+        this grid's bands, initialized to nodata. *dtype* and *initval*
+        override the dtype and initial value. """
+        if initval is None:
+            initval = self.nodata
+        if issubclass(self._bndcls, InterleavedBand):
+            store = self._bndcls(size, dtype or self.bands[0].dtype,
+                                 nbands=len(self.bands), initval=initval,
+                                 **self._bndkw)
+            return store.components()
+
+        return [self._bndcls(size, dtype or band.dtype, initval=initval,
+                             **self._bndkw)
+                for band in self.bands]
+
+    def _band_versions(self):
+        return [getattr(band, "version", None) for band in self.bands]
+
+    def _overviews_current(self):
+        """ Return whether overviews exist and the bands have not been written
+        since they were built. Stale overviews are discarded. """
+        if self._overviews is None:
+            return False
+        if self._overviews["versions"] != self._band_versions():
+            self._overviews = None
+            return False
+        return True
+
+    def overview(self, factor):
+        """ Return an overview built by `build_overviews` as a RegularGrid with
+        cells *factor* times larger.
+
+        Parameters
+        ----------
+        factor : int
+            a power of two
+        """
+        if not self._overviews_current():
+            raise errors.GridError("grid has no current overviews")
+        if factor not in self._overviews["levels"]:
+            raise errors.GridError("no overview with factor {0}".format(factor))
+        t = self._transform
+        tnew = (t[0], t[1], factor*t[2], factor*t[3], factor*t[4], factor*t[5])
+        return RegularGrid(tnew, bands=self._overviews["levels"][factor],
+                           crs=self.crs, nodata_value=self.nodata)
+
+    def _coarsest_overview(self, dx, dy):
+        """ Return the coarsest overview grid with cells no larger than *dx* by
+        *dy*, or None. """
+        if not self._overviews_current():
+            return None
+        t = self._transform
+        factors = [f for f in self._overviews["levels"]
+                   if f*abs(t[2]) <= abs(dx) and f*abs(t[3]) <= abs(dy)]
+        if len(factors) == 0:
+            return None
+        return self.overview(max(factors))
 
     def resample(self, dx, dy, method='nearest'):
         """ Resample array to have spacing `dx`, `dy'. The grid origin remains
         in the same position.
 
+        If overviews have been built with `build_overviews`, nearest
+        resampling samples the coarsest overview with a resolution at least as
+        fine as `dx`, `dy` instead of the full-resolution grid.
+
+        The aggregation methods 'mean', 'sum', 'min', 'max', 'mode', and
+        'count' (of valid cells) instead reduce every cell of the grid into
+        the coarser output cell containing its center, ignoring nodata cells.
+        The output grid has the same lower left corner and covers the whole
+        grid. The grid is read in strips, so memory use is bounded by the
+        strip size and the output.
+
         Parameters
         ----------
         dx : float
@@ -608,19 +1231,28 @@ class RegularGrid(Grid):
         dy : float
             cell dimension 2
         method : str, optional
-            interpolation method, currently 'nearest' and 'linear' supported
+            interpolation method, one of 'nearest' (default), 'linear' (or
+            'bilinear'), 'bicubic', or 'lanczos', or aggregation method, one of
+            'mean', 'sum', 'min', 'max', 'mode', or 'count'
         """
+        if method in _overview.AGGREGATES:
+            return self._aggregate(dx, dy, method)
+
         xmin, xmax, ymin, ymax = self.get_extent()
         if method == 'nearest':
+            src = self._coarsest_overview(dx, dy)
+            if src is None:
+                src = self
             X, Y = np.meshgrid(np.arange(xmin, xmax, dx),
                                np.arange(ymin, ymax, dy))
-            Z = self.sample_nearest(X.ravel(), Y.ravel())
+            Z = src.sample_nearest(X.ravel(), Y.ravel())
             values = Z.reshape(X.shape)
-        elif method == 'linear':
+        elif method in ('linear', 'bilinear', 'bicubic', 'lanczos'):
+            if method == 'linear':
+                method = 'bilinear'
             X, Y = np.meshgrid(np.arange(xmin, xmax, dx),
                                np.arange(ymin, ymax, dy))
-            Z = self.sample_bilinear(X.ravel(), Y.ravel())
-            values = Z.reshape(X.shape)
+            values = self._interpolate(X, Y, method)
         else:
             raise NotImplementedError('method "{0}" unavailable'.format(method))
 
@@ -629,64 +1261,228 @@ class RegularGrid(Grid):
         return RegularGrid(tnew, values=values, crs=self.crs,
                            nodata_value=self.nodata)
 
-    def get_positions(self, x, y):
-        """ Return the float column and row indices for the point nearest
-        geographical coordinates.
+    def _aggregate(self, dx, dy, method):
+        """ Resample by aggregating cells into cells of *dx* by *dy*. See
+        `resample`. """
+        t = self._transform
+        fy = float(dy) / t[3]
+        fx = float(dx) / t[2]
+        if fy < 1 or fx < 1:
+            raise errors.GridError("aggregated cells must be at least as "
+                                   "large as grid cells, with the same sign")
+
+        ny, nx = self.size
+        my = int(np.ceil(ny/fy - 1e-9))
+        mx = int(np.ceil(nx/fx - 1e-9))
+        integral = abs(fy - round(fy)) < 1e-9 and abs(fx - round(fx)) < 1e-9
+
+        # output row and column containing the center of each cell
+        rows = np.minimum(np.floor((np.arange(ny)+0.5)/fy), my-1).astype(np.intp)
+        cols = np.minimum(np.floor((np.arange(nx)+0.5)/fx), mx-1).astype(np.intp)
+
+        if method == "count":
+            dtype = np.int32
+            nodata = get_nodata(dtype)
+        elif method in ("mean", "sum"):
+            dtype = np.float64
+            nodata = self.nodata
+        else:
+            dtype = None
+            nodata = self.nodata
+        bands = self._newbands((my, mx), dtype=dtype, initval=nodata)
+
+        # Read strips of whole output rows about one chunk high
+        chunkrows = getattr(self.bands[0], "_chunksize", (256, 256))[0]
+        step = max(1, int(chunkrows // fy))
+        for a in range(0, my, step):
+            b = min(a+step, my)
+            r0 = int(np.searchsorted(rows, a))
+            r1 = int(np.searchsorted(rows, b))
+            for band, newband in zip(self.bands, bands):
+                block = np.asarray(band[r0:r1, :]).reshape(r1-r0, nx)
+                if method == "mean":
+                    block = block.astype(np.float64)
+                if integral:
+                    values = _overview.aggregate(block, int(round(fy)),
+                                                 int(round(fx)), method,
+                                                 self.nodata)
+                else:
+                    values = _overview.aggregate_indexed(block, rows[r0:r1]-a,
+                                                         cols, (b-a, mx),
+                                                         method, self.nodata)
+                newband[a:b, :] = values
+
+        tnew = (t[0], t[1], dx, dy, fy*t[4], fx*t[5])
+        return RegularGrid(tnew, bands=bands, crs=self.crs, nodata_value=nodata)
+
+    def reproject(self, crs, resolution=None, method="bilinear",
+                  tilesize=(256, 256), meshstep=16, nthreads=None):
+        """ Return a copy of the grid warped to another coordinate system.
+
+        The output grid is north-up and covers the projected outline of the
+        grid. It is computed tile by tile: the source position of each output
+        cell is interpolated from a mesh of control points every *meshstep*
+        cells that are projected exactly, and source values are read only from
+        the chunks that a tile maps to. A pool of *nthreads* worker threads
+        projects and samples each tile, sharing a lock for reads from the
+        grid, and the calling thread writes completed tiles to the output.
 
         Parameters
         ----------
-        x, y : float or vector
-            vertices of points to compute indices for
+        crs : karta.crs.CRS subclass
+            output coordinate system
+        resolution : float or pair of floats, optional
+            output cell dimensions (dx, dy). By default, the output has about
+            as many cells along its diagonal as the grid.
+        method : str, optional
+            'nearest', 'bilinear' (default), 'bicubic', or 'lanczos'
+        tilesize : pair of ints, optional
+            dimensions of the output tiles processed at once
+        meshstep : int, optional
+            spacing of control points in output cells. Smaller steps follow
+            strongly curved projections more closely.
+        nthreads : int, optional
+            number of worker threads (default the number of CPUs)
+
+        Returns
+        -------
+        RegularGrid in *crs*. Interpolated grids have float64 values; cells
+        outside the grid or near nodata cells are nodata.
         """
-        # Calculate this by forming block matrices
-        #       | dx sy          |
-        #       | sx dy          |
-        #   T = |      ....      |
-        #       |          dx sy |
-        #       |          sx dy |
-        #
-        #       | x0 + (dx+dy)/2 |
-        #       | y0 + (dx+dy)/2 |
-        #   S = |    .......     |
-        #       | x0 + (dx+dy)/2 |
-        #       | y0 + (dx+dy)/2 |
-        #
-        # where the grid transform is t = (x0, y0, dx, dy, sy, sx)
-        #
-        # Then the nearest indices J come from solving the system
-        # T J = X - S
-        try:
-            npts = len(x)
-            if npts == 1:
-                x = x[0]
-                y = y[0]
-        except TypeError:
-            npts = 1
-
-        n = min(70, npts)    # number to process at once
+        if method != "nearest" and method not in crfuncs.KERNEL_RADIUS:
+            raise ValueError("method '{0}' not available".format(method))
+        if nthreads is None:
+            nthreads = multiprocessing.cpu_count()
+        meshstep = max(1, int(meshstep))
+
+        # Output extent from the projected outline of the grid
+        ny, nx = self.size
+        edge = np.linspace(0.0, 1.0, 65)
+        bi = np.r_[0*edge, edge, 0*edge+1, edge]*ny - 0.5
+        bj = np.r_[edge, 0*edge+1, edge, 0*edge]*nx - 0.5
         t = self._transform
-        T = (np.diag(np.tile([t[2], t[3]], n)) +
-             np.diag(np.tile([t[4], 0], n)[:-1], 1) +
-             np.diag(np.tile([t[5], 0], n)[:-1], -1))
-        S = np.tile([t[0]+0.5*(t[2]+t[4]), t[1]+0.5*(t[3]+t[5])], n)
+        bx = t[0] + (bj+0.5)*t[2] + (bi+0.5)*t[4]
+        by = t[1] + (bi+0.5)*t[3] + (bj+0.5)*t[5]
+        if crs != self.crs:
+            bx, by = self.crs.transform(crs, bx, by)
+            bx, by = np.asarray(bx), np.asarray(by)
+        finite = np.isfinite(bx) & np.isfinite(by)
+        if not finite.any():
+            raise errors.GridError("grid cannot be projected to {0}".format(crs))
+        xmin, xmax = bx[finite].min(), bx[finite].max()
+        ymin, ymax = by[finite].min(), by[finite].max()
 
-        if npts == 1:
-            ind = np.linalg.solve(T, np.array([x, y]) - S)
+        if resolution is None:
+            res = math.hypot(xmax-xmin, ymax-ymin) / math.hypot(nx, ny)
+            dx, dy = res, res
+        elif isinstance(resolution, numbers.Number):
+            dx, dy = float(resolution), float(resolution)
         else:
-            ind = np.empty(2*npts, dtype=np.float64)
-            i = 0
-            while i != npts:
-                ip = min(i + n, npts)
-                xy = np.zeros(2*n, dtype=np.float64)
-                xy[:2*(ip-i)] = np.vstack([x[i:ip], y[i:ip]]).T.ravel()
-                ind_ = np.linalg.solve(T, xy - S)
-                ind[2*i:2*ip] = ind_[:2*(ip-i)]
-                i = ip
+            dx, dy = (float(a) for a in resolution)
+        mx = max(1, int(math.ceil((xmax-xmin)/dx)))
+        my = max(1, int(math.ceil((ymax-ymin)/dy)))
+        tnew = (xmin, ymin, dx, dy, 0.0, 0.0)
 
-        ny, nx = self.size
-        j = ind[::2]
-        i = ind[1::2]
-        return i, j
+        if method == "nearest":
+            bands = self._newbands((my, mx))
+        else:
+            bands = self._newbands((my, mx), dtype=np.float64)
+        dtype = bands[0].dtype
+
+        # Tiles are projected and sampled by the workers, which read the
+        # source bands one at a time, and written by this thread
+        lock = threading.Lock()
+
+        def project(tile):
+            """ Return the values of the cells of *tile* """
+            r0, r1, c0, c1 = tile
+            mr = np.unique(np.r_[np.arange(r0, r1, meshstep), r1-1])
+            mc = np.unique(np.r_[np.arange(c0, c1, meshstep), c1-1])
+            x, y = np.meshgrid(xmin + (mc+0.5)*dx, ymin + (mr+0.5)*dy)
+            if crs != self.crs:
+                x, y = crs.transform(self.crs, x, y)
+            with np.errstate(invalid="ignore"):
+                mi, mj = self.get_positions(x, y)
+                i = _mesh_interp(_mesh_interp(mi, mr-r0, r1-r0, 0), mc-c0, c1-c0, 1)
+                j = _mesh_interp(_mesh_interp(mj, mr-r0, r1-r0, 0), mc-c0, c1-c0, 1)
+
+            with np.errstate(invalid="ignore"):
+                inside = (i >= -0.5) & (i <= ny-0.5) & \
+                         (j >= -0.5) & (j <= nx-0.5)
+            values = np.empty((len(self.bands),) + i.shape, dtype=dtype)
+            values.fill(self.nodata)
+            if inside.any():
+                if method == "nearest":
+                    with lock:
+                        v = self._bandindexer.getpoints(
+                                np.minimum(np.round(i[inside]), ny-1),
+                                np.minimum(np.round(j[inside]), nx-1))
+                    values[:,inside] = v.reshape(len(i[inside]), -1).T
+                else:
+                    values[:,inside] = self._interpolate_positions(
+                            np.clip(i[inside], 0, ny-1),
+                            np.clip(j[inside], 0, nx-1), method, lock=lock)
+            return tile, values
+
+        tiles = [(r0, min(r0+tilesize[0], my), c0, min(c0+tilesize[1], mx))
+                 for r0 in range(0, my, tilesize[0])
+                 for c0 in range(0, mx, tilesize[1])]
+
+        pool = ThreadPool(nthreads)
+        try:
+            for (r0, r1, c0, c1), values in pool.imap(project, tiles):
+                for k, band in enumerate(bands):
+                    band[r0:r1, c0:c1] = values[k]
+        finally:
+            pool.close()
+            pool.join()
+
+        return RegularGrid(tnew, bands=bands, crs=crs, nodata_value=self.nodata)
+
+    def get_positions(self, x, y, out=None):
+        """ Return the float row and column indices for the point nearest
+        geographical coordinates.
+
+        Parameters
+        ----------
+        x, y : float or vector
+            vertices of points to compute indices for
+        out : tuple of two ndarrays, optional
+            C-contiguous float64 arrays with as many elements as *x* to write
+            the row and column indices into
+
+        Returns
+        -------
+        (i, j) : arrays of row and column positions with the shape of *x*
+            (or of length one if *x* is a scalar)
+
+        Notes
+        -----
+        Positions are computed in a single pass that releases the GIL, so
+        large point sets can be split between threads using *out*.
+        """
+        x = np.atleast_1d(np.ascontiguousarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.ascontiguousarray(y, dtype=np.float64))
+        if x.shape != y.shape:
+            raise ValueError("x and y must have the same shape")
+
+        if out is None:
+            i = np.empty(x.shape, dtype=np.float64)
+            j = np.empty(x.shape, dtype=np.float64)
+        else:
+            i, j = out
+            for a in (i, j):
+                if a.dtype != np.float64 or not a.flags.c_contiguous or \
+                        a.size != x.size:
+                    raise ValueError("output arrays must be C-contiguous "
+                                     "float64 with {0} elements".format(x.size))
+
+        crfuncs.affine_positions(x.reshape(-1), y.reshape(-1),
+                                 i.reshape(-1), j.reshape(-1),
+                                 *_inverse_transform(self._transform))
+        if out is None:
+            return i, j
+        return out
 
     def get_indices(self, x, y):
         """ Return the integer column and row indices for the point nearest
@@ -708,7 +1504,8 @@ class RegularGrid(Grid):
 
         if len(i) != 1:
             i, j = np.round(i).astype(int), np.round(j).astype(int)
-            if min(i) < 0 or max(i) > ny-1 or min(j) < 0 or max(j) > nx-1:
+            if len(i) != 0 and (i.min() < 0 or i.max() > ny-1 or
+                                j.min() < 0 or j.max() > nx-1):
                 raise errors.GridError("Coordinates outside grid region ({0})".format(self.bbox))
         else:
             i, j = int(round(i[0])), int(round(j[0]))
@@ -732,8 +1529,10 @@ class RegularGrid(Grid):
             points outside of Grid bbox
         """
         i, j = self.get_indices(x, y)
-        ny, nx = self.bands[0].size
-        return self[:,:][i, j]
+        if np.ndim(i) == 0:
+            return self._bandindexer.getpoints([i], [j])[0]
+        values = self._bandindexer.getpoints(i.ravel(), j.ravel())
+        return values.reshape(i.shape + values.shape[1:])
 
     def sample_bilinear(self, x, y):
         """ Return the value nearest to coordinates. Bilinear sampling scheme.
@@ -742,34 +1541,95 @@ class RegularGrid(Grid):
         ----------
         x, y : float or vector
             vertices of points to compute indices for
+
+        Raises
+        ------
+        GridError
+            points outside of Grid extent
+        """
+        return self._interpolate(x, y, "bilinear")
+
+    def sample_bicubic(self, x, y):
+        """ Return values at coordinates using cubic convolution.
+
+        Parameters
+        ----------
+        x, y : float or vector
+            vertices of points to compute indices for
+
+        Raises
+        ------
+        GridError
+            points outside of Grid extent
+        """
+        return self._interpolate(x, y, "bicubic")
+
+    def sample_lanczos(self, x, y):
+        """ Return values at coordinates using a three-lobed Lanczos kernel.
+
+        Parameters
+        ----------
+        x, y : float or vector
+            vertices of points to compute indices for
+
+        Raises
+        ------
+        GridError
+            points outside of Grid extent
+        """
+        return self._interpolate(x, y, "lanczos")
+
+    def _interpolate(self, x, y, method):
+        """ Interpolate values at coordinates with a kernel from
+        `crfuncs.interpolate`. Points are grouped by band chunk, and each group
+        is interpolated from a block covering its points and the surrounding
+        cells read by the kernel. Cells with nodata values within the kernel
+        of a point make its value nodata.
         """
         i, j = self.get_positions(x, y)
-        i0 = np.floor(i).astype(int)
-        i1 = np.ceil(i).astype(int)
-        j0 = np.floor(j).astype(int)
-        j1 = np.ceil(j).astype(int)
-
-        # Handle case where interpolation point is exactly on a grid point
-        mska = i0==i1
-        mskb = i0==0
-        i0[mska&~mskb] -= 1
-        i1[mska&mskb] += 1
-
-        mska = j0==j1
-        mskb = j0==0
-        j0[mska&~mskb] -= 1
-        j1[mska&mskb] += 1
+        shape = i.shape
+        i, j = i.ravel(), j.ravel()
 
         ny, nx = self.size
-        if np.any(i1>=ny) or np.any(j1>=nx) or np.any(i0<0) or np.any(j0<0):
+        if len(i) != 0 and (i.min() < 0 or i.max() > ny-1 or
+                            j.min() < 0 or j.max() > nx-1):
             raise errors.GridError("Coordinates outside grid extent({0})"
                     .format(self.get_extent()))
 
-        dx, dy = self._transform[2:4]
-        values = self[:,:]
-        z = (values[i0,j0]*(i1-i)*(j1-j) + values[i1,j0]*(i-i0)*(j1-j) + \
-             values[i0,j1]*(i1-i)*(j-j0) + values[i1,j1]*(i-i0)*(j-j0))
-        return z
+        out = self._interpolate_positions(i, j, method)
+        if len(self.bands) == 1:
+            return out[0].reshape(shape)
+        return out.T.reshape(shape + (len(self.bands),))
+
+    def _interpolate_positions(self, i, j, method, lock=None):
+        """ Interpolate values at the one-dimensional arrays of float row and
+        column positions *i*, *j*, which must lie within the grid, returning
+        an array with a row per band. If *lock* is given, it is held while
+        reading bands, so that several threads may interpolate at once. """
+        if lock is None:
+            lock = threading.Lock()
+        ny, nx = self.size
+        radius = crfuncs.KERNEL_RADIUS[method]
+        i0 = np.floor(i).astype(np.intp)
+        j0 = np.floor(j).astype(np.intp)
+        nodata = float(self.nodata)
+        out = np.empty((len(self.bands), len(i)), dtype=np.float64)
+        for iband, band in enumerate(self.bands):
+            for sel in _group_by_tile(i0, j0, getattr(band, "_chunksize", band.size)):
+                r0 = max(i0[sel].min()+1-radius, 0)
+                r1 = min(i0[sel].max()+radius+1, ny)
+                c0 = max(j0[sel].min()+1-radius, 0)
+                c1 = min(j0[sel].max()+radius+1, nx)
+                with lock:
+                    block = np.asarray(band[r0:r1, c0:c1]).reshape(r1-r0, c1-c0)
+                if isinstance(sel, slice):
+                    result = out[iband]
+                else:
+                    result = np.empty(len(sel), dtype=np.float64)
+                crfuncs.interpolate(np.ascontiguousarray(block, dtype=np.float64),
+                                    i[sel]-r0, j[sel]-c0, result, method, nodata)
+                out[iband, sel] = result
+        return out
 
     def sample(self, *args, **kwargs):
         """ Return the values nearest positions. Positions may be:
@@ -786,7 +1646,8 @@ class RegularGrid(Grid):
             used when coordinate lists are provided, otherwise the coordinate
             system is taken from the crs attribute of the geometry
         method : string, optional
-            may be one of 'nearest', 'bilinear' (default).
+            may be one of 'nearest', 'bilinear' (default), 'bicubic', or
+            'lanczos'.
         """
         crs = kwargs.get("crs", None)
         method = kwargs.get("method", "bilinear")
@@ -815,8 +1676,8 @@ class RegularGrid(Grid):
 
         if method == "nearest":
             return self.sample_nearest(x, y)
-        elif method == "bilinear":
-            return self.sample_bilinear(x, y)
+        elif method in crfuncs.KERNEL_RADIUS:
+            return self._interpolate(x, y, method)
         else:
             raise ValueError("method '{0}' not available".format(method))
 
@@ -866,6 +1727,29 @@ class RegularGrid(Grid):
         """
         return _gtiff.write(fnm, self, compress=compress, **kw)
 
+    def to_chunkstore(self, path, **kw):
+        """ Write data to a chunk store, a directory of compressed chunks
+        that can be reopened with `karta.raster.read_chunkstore` without
+        reading the full grid into memory.
+
+        Parameters
+        ----------
+        path : str
+            output directory
+        chunksize : tuple of ints, optional
+            chunk size for bands that are not CompressedBand instances
+            (default (256, 256)). CompressedBand bands keep their own chunk
+            layout and compression settings.
+        cname : str, optional
+            blosc codec for bands that are not CompressedBand instances
+        clevel : int, optional
+            blosc compression level for bands that are not CompressedBand
+            instances
+        shuffle : int, optional
+            blosc shuffle mode for bands that are not CompressedBand instances
+        """
+        return _chunkstore.write(path, self, **kw)
+
     def to_aai(self, f, reference='corner', nodata_value=-9999):
         """ Save internal data as an ASCII grid. Based on the ESRI standard,
         only isometric grids (i.e. `hdr['dx'] == hdr['dy']` can be saved,
@@ -991,78 +1875,247 @@ class WarpedGrid(Grid):
         """ Resample internal grid to the points defined by *X*, *Y*. """
         raise NotImplementedError
 
-def merge(grids, weights=None):
-    """ Perform a basic grid merge. Currently limited to grids whose sampling
-    is an integer translation from each other.
+def _inverse_transform(transform):
+    """ Return coefficients (i0, ix, iy, j0, jx, jy) such that the float row
+    and column of a point (x, y) in a grid with geotransform *transform* are
+    ``i0 + ix*x + iy*y`` and ``j0 + jx*x + jy*y``.
+    """
+    # The center of cell (i, j) is
+    #
+    #   x = x0 + (dx+sx)/2 + j*dx + i*sx
+    #   y = y0 + (dy+sy)/2 + j*sy + i*dy
+    #
+    # where the grid transform is t = (x0, y0, dx, dy, sx, sy), so the
+    # position of a point follows from inverting the 2x2 linear part.
+    x0, y0, dx, dy, sx, sy = transform
+    det = dx*dy - sx*sy
+    if det == 0:
+        raise errors.GridError("grid transform is singular")
+    xc = x0 + 0.5*(dx+sx)
+    yc = y0 + 0.5*(dy+sy)
+    return ((sy*xc - dx*yc)/det, -sy/det, dx/det,
+            (sx*yc - dy*xc)/det, dy/det, -sx/det)
+
+def _mesh_interp(values, knots, n, axis):
+    """ Linearly interpolate *values* known at the increasing indices *knots*
+    along *axis* to the indices 0...n-1. """
+    if len(knots) == 1:
+        return np.repeat(values, n, axis=axis)
+    pos = np.arange(n)
+    k = np.clip(np.searchsorted(knots, pos, side="right")-1, 0, len(knots)-2)
+    w = (pos - knots[k]) / (knots[k+1] - knots[k]).astype(np.float64)
+    if axis == 0:
+        w = w[:,np.newaxis]
+        return values[k]*(1-w) + values[k+1]*w
+    return values[:,k]*(1-w) + values[:,k+1]*w
+
+def _group_by_tile(i, j, tilesize):
+    """ Yield arrays of the indices of the cells (*i[k]*, *j[k]*) falling in
+    each tile of *tilesize* that contains at least one cell, or a full slice
+    if all cells are in one tile. """
+    if len(i) == 0:
+        return
+    ty, tx = tilesize
+    ti = i // ty
+    tj = j // tx
+    key = ti*(tj.max()+1) + tj
+    if key.min() == key.max():
+        yield slice(None)
+        return
+    if key.max() < 65536:
+        # stable sorts of 16-bit integers use a linear-time radix sort
+        key = key.astype(np.uint16)
+    order = np.argsort(key, kind="mergesort")
+    sortedkey = key[order]
+    starts = np.flatnonzero(np.r_[True, sortedkey[1:] != sortedkey[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    for a, b in zip(starts, ends):
+        yield order[a:b]
+
+MERGE_METHODS = ("mean", "first", "last", "min", "max")
+
+def merge(grids, weights=None, method="mean", resample="bilinear",
+          bandclass=None, bandkwargs=None, nthreads=None):
+    """ Merge grids with the same cell size and skew into a mosaic.
+
+    The output is built tile by tile, with one tile per chunk of the output
+    bands, and only the parts of the input grids overlapping a tile are read.
+    Tiles are computed by a pool of worker threads and written as they are
+    completed, so neither the inputs nor the output need fit in memory.
+
+    Output cells are aligned with the first grid. Grids that are offset from
+    it by whole cells are copied, and grids offset by a fraction of a cell are
+    resampled at the output cell centers.
 
     Parameters
     ----------
-    grids : iterable of Grid objects
+    grids : iterable of RegularGrid objects
         grids to combine
     weights : iterable of floats, optional
         weighting factors for computing grid averages
+    method : str, optional
+        how overlapping values are combined: "mean" (default, weighted by
+        *weights*), "first", "last", "min", or "max". Cells equal to the nodata
+        value of their grid are ignored.
+    resample : str, optional
+        kernel used for grids offset by a fraction of a cell: "nearest",
+        "bilinear" (default), "bicubic", or "lanczos"
+    bandclass : class, optional
+        band class of the output (default BAND_CLASS_DEFAULT)
+    bandkwargs : dict, optional
+        keyword arguments used to create output bands
+    nthreads : int, optional
+        number of worker threads (default the number of CPUs)
     """
-
-    # Check grid class
+    grids = list(grids)
     if not all(isinstance(grid, RegularGrid) for grid in grids):
         raise NotImplementedError("All grids must by type RegularGrid")
+    if method not in MERGE_METHODS:
+        raise ValueError("merge method must be one of {0}".format(MERGE_METHODS))
+    if resample != "nearest" and resample not in crfuncs.KERNEL_RADIUS:
+        raise ValueError("resample method '{0}' not available".format(resample))
 
     T = grids[0].transform
-    # Check grid stretch and skew
+    nbands = len(grids[0].bands)
     for i, grid in enumerate(grids[1:]):
         if grid.transform[2:6] != T[2:6]:
             raise NotImplementedError("grid %d transform stretch and skew "
                     "does not match grid 1" % (i+2,))
+        if len(grid.bands) != nbands:
+            raise errors.GridError("grid %d has a different number of bands "
+                                   "from grid 1" % (i+2,))
 
-    # Check grid offset
-    excmsg = "grid %d not an integer translation from grid 1"
-    for i, grid in enumerate(grids[1:]):
-        if ((grid.transform[0]-T[0]) / float(T[2])) % 1 > 1e-15:
-            raise NotImplementedError(excmsg % (i+2,))
-        if ((grid.transform[1]-T[1]) / float(T[3])) % 1 > 1e-15:
-            raise NotImplementedError(excmsg % (i+2,))
-
-    # Compute weighting coefficients by normalizing *weights*
     if weights is None:
         weights = np.ones(len(grids))
     else:
-        weights = np.asarray(weights, dtype=np.float32)
-
-    normalizedweights = weights * len(weights) / weights.sum()
-
-    # Compute final grid extent
-    xmin, xmax, ymin, ymax = grids[0].get_extent(reference='edge')
-    for grid in grids[1:]:
-        _xmin, _xmax, _ymin, _ymax = grid.get_extent(reference='edge')
-        xmin = min(xmin, _xmin)
-        xmax = max(xmax, _xmax)
-        ymin = min(ymin, _ymin)
-        ymax = max(ymax, _ymax)
-
-    nx = int(round((xmax-xmin) / T[2]))
-    ny = int(round((ymax-ymin) / T[3]))
-
-    # Allocate data array and copy each grid's data
-    typ = grids[0].bands[0].dtype
-    values = np.zeros([ny, nx], dtype=typ)
-    counts = np.zeros([ny, nx], dtype=np.float32)
-    for grid, w in zip(grids, normalizedweights):
-        _xmin, _xmax, _ymin, _ymax = grid.get_extent(reference='edge')
-        offx = int((_xmin-xmin) / T[2])
-        offy = int((_ymin-ymin) / T[3])
-        _ny, _nx = grid.size
-
-        mask = grid.data_mask
-        counts[offy:offy+_ny,offx:offx+_nx][mask] += w
-        values[offy:offy+_ny,offx:offx+_nx][mask] += typ(grid[mask]*w)
-        del mask
-
-    validcountmask = (counts!=0.0)
-    values[validcountmask] = values[validcountmask] / counts[validcountmask]
-    values[~validcountmask] = grids[0].nodata
-    Tmerge = [xmin, ymin] + list(T[2:])
-    return RegularGrid(Tmerge, values=values, crs=grids[0].crs,
-                       nodata_value=grids[0].nodata)
+        weights = np.asarray(weights, dtype=np.float64)
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+
+    # Position of each grid on the lattice of the first grid, and the output
+    # cells that each grid covers
+    offsets = []
+    boxes = []
+    for grid in grids:
+        t = grid.transform
+        x = t[0] + 0.5*(t[2]+t[4])
+        y = t[1] + 0.5*(t[3]+t[5])
+        oi, oj = (a[0] for a in grids[0].get_positions(x, y))
+        ny, nx = grid.size
+        if abs(oi-round(oi)) < 1e-6 and abs(oj-round(oj)) < 1e-6:
+            oi, oj = int(round(oi)), int(round(oj))
+            boxes.append((oi, oi+ny, oj, oj+nx))
+        elif resample == "nearest":
+            boxes.append((int(math.ceil(oi-0.5)), int(math.ceil(oi+ny-0.5)),
+                          int(math.ceil(oj-0.5)), int(math.ceil(oj+nx-0.5))))
+        else:
+            boxes.append((int(math.ceil(oi)), int(math.floor(oi+ny-1))+1,
+                          int(math.ceil(oj)), int(math.floor(oj+nx-1))+1))
+        offsets.append((oi, oj))
+    boxes = np.array(boxes, dtype=np.int64)
+    rmin, cmin = boxes[:,0].min(), boxes[:,2].min()
+    boxes -= [rmin, rmin, cmin, cmin]
+    offsets = [(oi-rmin, oj-cmin) for oi, oj in offsets]
+    ny, nx = int(boxes[:,1].max()), int(boxes[:,3].max())
+
+    dtype = grids[0].bands[0].dtype
+    nodata = grids[0].nodata
+    if bandclass is None:
+        bandclass = BAND_CLASS_DEFAULT
+    bands = [bandclass((ny, nx), dtype, initval=nodata, **(bandkwargs or {}))
+             for _ in range(nbands)]
+    ty, tx = getattr(bands[0], "_chunksize", (256, 256))
+
+    tiles = []
+    for r0 in range(0, ny, ty):
+        for c0 in range(0, nx, tx):
+            r1, c1 = min(r0+ty, ny), min(c0+tx, nx)
+            overlap = np.flatnonzero((boxes[:,0] < r1) & (boxes[:,1] > r0) &
+                                     (boxes[:,2] < c1) & (boxes[:,3] > c0))
+            if len(overlap) != 0:
+                tiles.append((r0, r1, c0, c1, overlap))
+
+    # Input grids are read by one thread at a time
+    locks = [threading.Lock() for _ in grids]
+
+    def mosaic(tile):
+        r0, r1, c0, c1, overlap = tile
+        shape = (nbands, r1-r0, c1-c0)
+        have = np.zeros(shape, dtype=np.bool_)
+        if method == "mean":
+            total = np.zeros(shape, dtype=np.float64)
+            wsum = np.zeros(shape, dtype=np.float64)
+        else:
+            out = np.zeros(shape, dtype=dtype)
+
+        for k in overlap:
+            a0, a1 = max(r0, boxes[k,0]), min(r1, boxes[k,1])
+            b0, b1 = max(c0, boxes[k,2]), min(c1, boxes[k,3])
+            with locks[k]:
+                values = _merge_values(grids[k], offsets[k], a0, a1, b0, b1,
+                                       resample)
+            valid = _isdata(values, grids[k].nodata)
+            region = (slice(None), slice(a0-r0, a1-r0), slice(b0-c0, b1-c0))
+
+            if method == "mean":
+                total[region][valid] += weights[k]*values[valid]
+                wsum[region][valid] += weights[k]
+            else:
+                current = out[region]
+                if method == "first":
+                    update = valid & ~have[region]
+                elif method == "last":
+                    update = valid
+                elif method == "min":
+                    update = valid & (~have[region] | (values < current))
+                else:
+                    update = valid & (~have[region] | (values > current))
+                current[update] = values[update]
+            have[region] |= valid
+
+        if method == "mean":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out = total / wsum
+            if not np.issubdtype(dtype, np.floating):
+                out = np.round(out)
+        out = np.where(have, out, nodata).astype(dtype)
+        return tile, out
+
+    pool = ThreadPool(nthreads)
+    try:
+        for (r0, r1, c0, c1, _), values in pool.imap(mosaic, tiles):
+            for band, v in zip(bands, values):
+                band[r0:r1, c0:c1] = v
+    finally:
+        pool.close()
+        pool.join()
+
+    Tmerge = (T[0] + cmin*T[2] + rmin*T[4], T[1] + rmin*T[3] + cmin*T[5],
+              T[2], T[3], T[4], T[5])
+    return RegularGrid(Tmerge, bands=bands, crs=grids[0].crs,
+                       nodata_value=nodata)
+
+def _merge_values(grid, offset, r0, r1, c0, c1, resample):
+    """ Return the values of *grid* at the output cells [r0:r1, c0:c1] of a
+    merge as an array with a leading band dimension, where *offset* is the
+    output position of the grid's first cell. """
+    oi, oj = offset
+    if isinstance(oi, numbers.Integral):
+        return np.array([np.asarray(band[r0-oi:r1-oi, c0-oj:c1-oj])
+                         .reshape(r1-r0, c1-c0) for band in grid.bands])
+
+    ny, nx = grid.size
+    j, i = np.meshgrid(np.arange(c0, c1)-oj, np.arange(r0, r1)-oi)
+    if resample == "nearest":
+        values = grid._bandindexer.getpoints(
+                np.clip(np.round(i.ravel()), 0, ny-1),
+                np.clip(np.round(j.ravel()), 0, nx-1))
+        values = values.reshape(i.size, -1).T
+    else:
+        values = grid._interpolate_positions(np.clip(i.ravel(), 0, ny-1),
+                                             np.clip(j.ravel(), 0, nx-1),
+                                             resample)
+    return values.reshape((len(grid.bands),) + i.shape)
 
 def get_nodata(T):
     """ Return a default value for NODATA given a type
@@ -1081,7 +2134,7 @@ def get_nodata(T):
     else:
         raise ValueError("No default NODATA value for type {0}".format(T))
 
-def gridpoints(x, y, z, transform, crs):
+def gridpoints(x, y, z, transform, crs, statistics=("mean",), percentiles=()):
     """ Return a grid computed by averaging point data over cells.
 
     Parameters
@@ -1096,39 +2149,305 @@ def gridpoints(x, y, z, transform, crs):
         geotransform: ``[xllcorner, yllcorner, xres, yres, xskew, yskew]``
     crs : karta.crs.CRS subclass
         coordinate reference system object
+    statistics : iterable of str, optional
+        statistics to compute, as for `PointAccumulator` (default the mean)
+    percentiles : iterable of floats, optional
+        percentiles to compute
+
+    Returns
+    -------
+    RegularGrid with one band per statistic, followed by one band per
+    percentile
     """
     ny = int((np.max(y) - transform[1]) // transform[3]) + 1
     nx = int((np.max(x) - transform[0]) // transform[2]) + 1
-    grid = RegularGrid(transform,
-                       values=np.zeros([ny, nx]),
-                       crs=crs,
-                       nodata_value=np.nan,
-                       bandclass=SimpleBand)
-    counts = np.zeros([ny, nx], dtype=np.int16)
+    acc = PointAccumulator(transform, (ny, nx), crs=crs, statistics=statistics,
+                           percentiles=percentiles)
+    acc.add(x, y, z)
+    return acc.to_grid()
+
+class PointAccumulator(object):
+    """ PointAccumulator computes statistics of point values over the cells of
+    a grid from batches of points, so that point clouds larger than memory can
+    be gridded by streaming them from disk. Each point is assigned to the cell
+    nearest to it, and points outside the grid are ignored.
+
+    Statistics are kept as running sums in compiled code, except for medians
+    and percentiles, which need every value. These are written to temporary
+    files (in `band.MMAP_TEMPDIR`, or the system temporary directory) split by
+    strips of grid rows, and each strip is sorted separately by `to_grid`.
 
-    (I, J) = grid.get_indices(x, y)
+    Parameters
+    ----------
+    transform : 6-tuple of floats
+        geotransform: ``[xllcorner, yllcorner, xres, yres, xskew, yskew]``
+    size : tuple of ints
+        grid dimensions (ny, nx)
+    crs : karta.crs.CRS subclass, optional
+        coordinate reference system, default CRS_DEFAULT
+    statistics : iterable of str, optional
+        any of "mean" (default), "sum", "count", "min", "max", "std"
+        (population standard deviation), and "median"
+    percentiles : iterable of floats, optional
+        percentiles between 0 and 100 to compute, interpolated linearly
+        between values as by `numpy.percentile`
+    striprows : int, optional
+        grid rows per temporary file of values kept for percentiles
+
+    Example
+    -------
+    ::
+
+        acc = PointAccumulator(T, (ny, nx), statistics=("mean", "max", "count"))
+        for x, y, z in batches:
+            acc.add(x, y, z)
+        grid = acc.to_grid()
+    """
+    STATISTICS = ("mean", "sum", "count", "min", "max", "std", "median")
+
+    def __init__(self, transform, size, crs=None, statistics=("mean",),
+                 percentiles=(), striprows=256):
+        if isinstance(statistics, str):
+            statistics = (statistics,)
+        for stat in statistics:
+            if stat not in self.STATISTICS:
+                raise ValueError("statistic must be one of {0}".format(self.STATISTICS))
+        percentiles = [float(p) for p in percentiles]
+        if any(not 0 <= p <= 100 for p in percentiles):
+            raise ValueError("percentiles must be between 0 and 100")
+
+        self.statistics = tuple(statistics)
+        self.percentiles = tuple(percentiles)
+        self.size = tuple(size)
+        self.crs = crs
+        self.striprows = striprows
+        self.transform = tuple(float(a) for a in transform)
+        self._coefficients = _inverse_transform(self.transform)
+
+        # allocate only the running statistics that are asked for
+        stats = set(self.statistics)
+        n = self.size[0]*self.size[1]
+        def alloc(needed, dtype=np.float64):
+            return np.zeros(n, dtype=dtype) if needed else None
+        self._count = alloc(stats & {"mean", "count", "min", "max", "std"}, np.int64)
+        self._total = alloc("sum" in stats)
+        self._mean = alloc(stats & {"mean", "std"})
+        self._m2 = alloc("std" in stats)
+        self._min = alloc("min" in stats)
+        self._max = alloc("max" in stats)
+
+        if "median" in self.statistics or len(self.percentiles) != 0:
+            self._spilldir = tempfile.mkdtemp(dir=_band.MMAP_TEMPDIR)
+        else:
+            self._spilldir = None
+        return
 
-    try:
-        err = crfuncs.fillarray_double(grid[:,:],
-                                       I.astype(np.int32),
-                                       J.astype(np.int32), z, grid.nodata)
-        if err != 0:
-            raise RuntimeError("failure in fillarray_double")
-    except ValueError:
-        # Fast version works when *z* is of type double (np.float64).
-        # Python fallback for other types
-        for (i,j,z_) in zip(I, J, z):
-            grid[i,j] += z_
-            counts[i,j] += 1
-
-        m = counts!=0
-        grid[m] /= counts[m]
-        grid[~m] = grid.nodata
+    def __del__(self):
+        self._cleanup()
+
+    def _cleanup(self):
+        spilldir = getattr(self, "_spilldir", None)
+        if spilldir is not None and os.path.isdir(spilldir):
+            shutil.rmtree(spilldir)
+        self._spilldir = None
+
+    def add(self, x, y, z):
+        """ Add a batch of points with coordinates *x*, *y* and values *z* of
+        any numeric dtype. Returns the number of points inside the grid. """
+        x = np.ravel(np.asarray(x, dtype=np.float64))
+        y = np.ravel(np.asarray(y, dtype=np.float64))
+        z = np.ravel(np.ascontiguousarray(z, dtype=np.float64))
+        if not (len(x) == len(y) == len(z)):
+            raise ValueError("x, y, and z must have equal length")
+
+        i = np.empty(len(z), dtype=np.float64)
+        j = np.empty(len(z), dtype=np.float64)
+        crfuncs.affine_positions(x, y, i, j, *self._coefficients)
+        cells = np.empty(len(z), dtype=np.int64)
+        nbinned = crfuncs.bin_points(i, j, z, self.size[0], self.size[1],
+                                     self._count, self._total, self._mean,
+                                     self._m2, self._min, self._max, cells)
+
+        if self._spilldir is not None and nbinned != 0:
+            inside = cells != -1
+            cells = cells[inside]
+            z = z[inside]
+            strips = cells // (self.size[1]*self.striprows)
+            order = np.argsort(strips, kind="mergesort")
+            strips = strips[order]
+            starts = np.flatnonzero(np.r_[True, strips[1:] != strips[:-1]])
+            ends = np.r_[starts[1:], len(strips)]
+            for a, b in zip(starts, ends):
+                records = np.empty(b-a, dtype=[("cell", np.int64), ("z", np.float64)])
+                records["cell"] = cells[order[a:b]]
+                records["z"] = z[order[a:b]]
+                path = os.path.join(self._spilldir, "{0}.bin".format(strips[a]))
+                with open(path, "ab") as f:
+                    records.tofile(f)
+        return nbinned
+
+    def _percentiles(self):
+        """ Return an array of each percentile (and the median) over all
+        cells, computed strip by strip from the spilled values. """
+        qs = list(self.percentiles)
+        if "median" in self.statistics:
+            qs.append(50.0)
+        ny, nx = self.size
+        out = np.empty((len(qs), ny*nx), dtype=np.float64)
+        out.fill(np.nan)
+        for fnm in os.listdir(self._spilldir):
+            records = np.fromfile(os.path.join(self._spilldir, fnm),
+                                  dtype=[("cell", np.int64), ("z", np.float64)])
+            order = np.lexsort((records["z"], records["cell"]))
+            cell = records["cell"][order]
+            z = records["z"][order]
+            starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+            counts = np.diff(np.r_[starts, len(cell)])
+            for k, q in enumerate(qs):
+                pos = q/100.0*(counts-1)
+                lo = np.floor(pos).astype(np.int64)
+                hi = np.minimum(lo+1, counts-1)
+                frac = pos - lo
+                out[k, cell[starts]] = z[starts+lo]*(1-frac) + z[starts+hi]*frac
+        return out
+
+    def to_grid(self):
+        """ Return a RegularGrid with one band per statistic, in the order
+        requested, followed by one band per percentile. Cells without points
+        are NaN, except in counts and sums, where they are zero. """
+        empty = None if self._count is None else (self._count == 0)
+        values = []
+        for stat in self.statistics:
+            if stat == "mean":
+                v = self._mean.copy()
+            elif stat == "sum":
+                v = self._total.copy()
+            elif stat == "count":
+                v = self._count.astype(np.float64)
+            elif stat == "min":
+                v = self._min.copy()
+            elif stat == "max":
+                v = self._max.copy()
+            elif stat == "std":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    v = np.sqrt(self._m2 / self._count)
+            else:
+                continue
+            if empty is not None and stat not in ("count", "sum"):
+                v[empty] = np.nan
+            values.append(v)
+
+        if self._spilldir is not None:
+            pct = self._percentiles()
+            if "median" in self.statistics:
+                values.insert(self.statistics.index("median"), pct[-1])
+            values.extend(pct[:len(self.percentiles)])
+
+        bands = []
+        for v in values:
+            band = BAND_CLASS_DEFAULT(self.size, np.float64)
+            band[:,:] = v.reshape(self.size)
+            bands.append(band)
+        return RegularGrid(self.transform, bands=bands, crs=self.crs,
+                           nodata_value=np.nan)
+
+def _polygon_rings(polys, crs):
+    """ Return a list of (x, y, ishole) tuples for the exterior rings and
+    holes of a Polygon, a Multipolygon, or a list of either, in *crs*. """
+    if getattr(polys, "_geotype", "") in ("Polygon", "Multipolygon"):
+        polys = [polys]
+
+    rings = []
+    for poly in polys:
+        if poly._geotype == "Multipolygon":
+            parts = poly.get_vertices(None if poly.crs == crs else crs)
+            for part in parts:
+                for k, ring in enumerate(part):
+                    ring = np.asarray(ring, dtype=np.float64)
+                    rings.append((ring[:,0], ring[:,1], k != 0))
+        else:
+            for k, p in enumerate([poly] + list(poly.subs)):
+                x, y = p.get_coordinate_lists(crs)[:2]
+                rings.append((np.asarray(x, dtype=np.float64),
+                              np.asarray(y, dtype=np.float64), k != 0))
+    return rings
+
+def _corner_positions(x, y, transform):
+    """ Return the float row and column of points (*x*, *y*) measured from
+    the outer corner of cell (0, 0) of a grid with *transform*. """
+    ta, tb, tc, td, te, tf = transform
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    i = (y-tb - tf/tc*(x-ta)) / (td - tf*te/tc)
+    j = (x-ta - te/td*(y-tb)) / (tc - te*tf/td)
+    return i, j
+
+def _ring_edges(rings, transform):
+    """ Return the edges of *rings* as arrays of start and end corner
+    positions (i0, j0, i1, j1) on a grid with *transform*. Exterior rings and
+    holes are oriented oppositely, so that holes cancel the winding number of
+    the ring that contains them. """
+    edges = [[], [], [], []]
+    for x, y, ishole in rings:
+        if len(x) < 3:
+            continue
+        i, j = _corner_positions(x, y, transform)
+        i_ = np.roll(i, -1)
+        j_ = np.roll(j, -1)
+        area = np.sum((i_-i) * (j_+j))
+        if (area < 0) != ishole:
+            i, j, i_, j_ = i_, j_, i, j
+        for a, v in zip(edges, (i, j, i_, j_)):
+            a.append(v)
+    return tuple(np.ascontiguousarray(np.concatenate(a)) if len(a) != 0
+                 else np.empty(0, dtype=np.float64) for a in edges)
+
+def _edges_in_rows(edges, r0, r1):
+    """ Return the subset of *edges* that may cross rows *r0* to *r1*. """
+    i0, _, i1, _ = edges
+    sel = (np.minimum(i0, i1) < r1+1) & (np.maximum(i0, i1) > r0-1)
+    return tuple(np.ascontiguousarray(a[sel]) for a in edges)
+
+def _edges_window(edges, size):
+    """ Return the (r0, r1, c0, c1) window of a grid of *size* that can
+    contain cells inside *edges*. The window is empty if there are none. """
+    ny, nx = size
+    if len(edges[0]) == 0:
+        return (0, 0, 0, 0)
+    i = np.rint(np.r_[edges[0], edges[2]])
+    j = np.rint(np.r_[edges[1], edges[3]])
+    r0 = int(min(max(i.min(), 0), ny))
+    r1 = int(min(max(i.max(), r0), ny))
+    c0 = int(min(max(j.min()-1, 0), nx))
+    c1 = int(min(max(j.max()+1, c0), nx))
+    if r0 == r1 or c0 == c1:
+        return (0, 0, 0, 0)
+    return (r0, r1, c0, c1)
+
+def _burn(edges, window, supersample=1):
+    """ Return the winding number of *edges* about each cell of *window*
+    (r0, r1, c0, c1), or about each of *supersample* x *supersample*
+    subcells. """
+    r0, r1, c0, c1 = window
+    s = supersample
+    winding = np.empty(((r1-r0)*s, (c1-c0)*s), dtype=np.int32)
+    if s == 1:
+        crfuncs.burn_edges(edges[0], edges[1], edges[2], edges[3],
+                           r0, c0, winding)
+    else:
+        crfuncs.burn_edges(edges[0]*s, edges[1]*s, edges[2]*s, edges[3]*s,
+                           r0*s, c0*s, winding)
+    return winding
 
-    return grid
+def _coverage(winding, supersample):
+    """ Return the fraction of subcells of each cell with nonzero winding. """
+    s = supersample
+    ny, nx = winding.shape[0]//s, winding.shape[1]//s
+    inside = (winding != 0).reshape(ny, s, nx, s)
+    return inside.sum(axis=(1, 3)) / float(s*s)
 
-def mask_poly(xpoly, ypoly, nx, ny, transform):
-    """ Create a grid mask based on a clockwise-oriented polygon.
+def mask_poly(xpoly, ypoly, nx, ny, transform, coverage=False, supersample=4):
+    """ Create a grid mask based on a polygon.
 
     Parameters
     ----------
@@ -1140,57 +2459,252 @@ def mask_poly(xpoly, ypoly, nx, ny, transform):
     transform : list[float]
         affine transformation describing grid layout and origin
         ``T == [x0, y0, dx, dy, sx, sy]``
+    coverage : bool, optional
+        if True, return the fraction of each cell covered by the polygon
+        rather than a boolean mask (default False)
+    supersample : int, optional
+        number of subcells along each side of a cell used to estimate
+        coverage (default 4)
     """
-    mask = np.zeros((ny, nx), dtype=np.int8)
-
-    # find southernmost index (will start and end on this point)
-    v = ypoly[0]
-    i_bot = 0
-    for i in range(1, len(ypoly)):
-        if ypoly[i] < v:
-            v = ypoly[i]
-            i_bot = i
-
-    x0 = xpoly[i_bot]
-    y0 = ypoly[i_bot]
-
-    # compute the grid indices of the starting point
-    ta, tb, tc, td, te, tf = transform
-    i0 = int(round((y0-tb - tf/tc*(x0-ta)) / (td - tf*te/tc)))
-    j0 = int(round((x0-ta - te/td*(y0-tb)) / (tc - te*tf/td)))
-
-    for el in range(1, len(xpoly)+1):
-        idx = (el + i_bot) % len(xpoly)
-        x1 = xpoly[idx]
-        y1 = ypoly[idx]
-
-        # (Unbounded) grid indices of the segment end points
-        i1 = int(round((y1-tb - tf/tc*(x1-ta)) / (td - tf*te/tc)))
-        j1 = int(round((x1-ta - te/td*(y1-tb)) / (tc - te*tf/td)))
-
-        # If segment is horizontal or off-grid, ignore
-        if ((0 <= i0 < ny) and (0 <= i1 < ny)) or (y1 != y0):
-
-            if y1 > y0:     # upward - mark grid cells to the right
-
-                for i in range(i0, i1):
-                    if (0 <= i < ny):
-                        j = int(round((i-i0) * (x1-x0)/(y1-y0) + j0))
-                        if j < nx:
-                            mask[i, max(0, j):] += 1
-
-            else:           # downward - unmark grid cells to the right
-
-                for i in range(i1, i0):
-                    if (0 <= i < ny):
-                        j = int(round((i-i1) * (x1-x0)/(y1-y0) + j1))
-                        if j < nx:
-                            mask[i, max(0, j):] -= 1
-
-        x0 = x1
-        y0 = y1
-        i0 = i1
-        j0 = j1
+    rings = [(np.asarray(xpoly, dtype=np.float64),
+              np.asarray(ypoly, dtype=np.float64), False)]
+    edges = _ring_edges(rings, transform)
+    window = (0, ny, 0, nx)
+    if coverage:
+        return _coverage(_burn(edges, window, supersample), supersample)
+    return _burn(edges, window) != 0
+
+
+def _burn_features(geoms, crs, transform, field, value):
+    """ Return a list of the features in vector geometries *geoms* as
+    ("polygon", value, edges) or ("segments", (i0, j0, i1, j1, fid, values))
+    tuples in corner positions of a grid, in order. Each part of a
+    multipart geometry is a feature. Features are valued by *field* of the
+    geometry's data or properties if given, and otherwise by *value*. """
+    if hasattr(geoms, "_geotype"):
+        geoms = [geoms]
+
+    features = []
+    nfeatures = 0
+    for geom in geoms:
+        geotype = geom._geotype
+        if geotype.startswith("Multi"):
+            npart = len(geom)
+            if field is None:
+                values = [value]*npart
+            else:
+                values = geom.data.getfield(field)
+        else:
+            npart = 1
+            values = [value if field is None else geom.properties[field]]
+        values = np.asarray(values, dtype=np.float64)
+        fids = np.arange(nfeatures, nfeatures+npart, dtype=np.int64)
+        nfeatures += npart
+        geomcrs = None if geom.crs == crs else crs
+
+        if geotype in ("Polygon", "Multipolygon"):
+            polys = [geom] if geotype == "Polygon" else [p for p in geom]
+            for poly, v in zip(polys, values):
+                edges = _ring_edges(_polygon_rings(poly, crs), transform)
+                features.append(("polygon", v, edges))
+            continue
+
+        if geotype == "Point":
+            x, y = geom.get_vertex(crs)[:2]
+            i, j = _corner_positions([x], [y], transform)
+            segments = (i, j, i, j, fids, values)
+        elif geotype == "Multipoint":
+            i, j = _corner_positions(*geom.get_coordinate_lists(crs),
+                                     transform=transform)
+            segments = (i, j, i, j, fids, values)
+        else:
+            if geotype == "Line":
+                lines = [np.column_stack(geom.get_coordinate_lists(crs))]
+            else:
+                lines = geom.get_vertices(geomcrs)
+            parts = [[], [], [], [], [], []]
+            for line, fid, v in zip(lines, fids, values):
+                line = np.asarray(line, dtype=np.float64)
+                i, j = _corner_positions(line[:,0], line[:,1], transform)
+                if len(i) == 1:
+                    i = j = np.r_[i, i]
+                n = len(i) - 1
+                for a, b in zip(parts, (i[:-1], j[:-1], i[1:], j[1:],
+                                        np.full(n, fid, dtype=np.int64),
+                                        np.full(n, v))):
+                    a.append(b)
+            if len(parts[0]) == 0:
+                continue
+            segments = tuple(np.concatenate(a) for a in parts)
+        features.append(("segments", segments))
+    return features
+
+def _feature_window(feature):
+    """ Return the (row0, row1, col0, col1) bounds of a feature from
+    `_burn_features`, which may extend beyond a grid. """
+    if feature[0] == "polygon":
+        i0, j0, i1, j1 = feature[2]
+        i = np.rint(np.r_[i0, i1])
+        j = np.rint(np.r_[j0, j1])
+        if len(i) == 0:
+            return (0, 0, 0, 0)
+        return (i.min(), i.max(), j.min()-1, j.max()+1)
+    i0, j0, i1, j1 = feature[1][:4]
+    return (np.floor(min(i0.min(), i1.min())), np.floor(max(i0.max(), i1.max()))+1,
+            np.floor(min(j0.min(), j1.min())), np.floor(max(j0.max(), j1.max()))+1)
+
+def _feature_in_rows(feature, r0, r1):
+    """ Return the part of a feature from `_burn_features` that may burn
+    rows *r0* to *r1*, or None. """
+    if feature[0] == "polygon":
+        edges = _edges_in_rows(feature[2], r0, r1)
+        return None if len(edges[0]) == 0 else ("polygon", feature[1], edges)
+    i0, j0, i1, j1 = feature[1][:4]
+    sel = (np.minimum(i0, i1) < r1) & (np.maximum(i0, i1) >= r0)
+    if not sel.any():
+        return None
+    return ("segments", tuple(np.ascontiguousarray(a[sel]) for a in feature[1]))
+
+def rasterize(geoms, grid=None, transform=None, size=None, crs=None,
+              field=None, value=1.0, merge="replace", all_touched=False,
+              iband=0, dtype=np.float64, nodata_value=np.nan,
+              bandclass=None, bandkwargs=None, nthreads=None):
+    """ Burn vector geometries into a grid.
+
+    Lines burn the cells they cross, polygons (including holes) burn the
+    cells that `RegularGrid.polygon_mask` selects, and points burn the cell
+    containing them. The grid is burned a band chunk at a time by a pool of
+    worker threads, and only chunks that features overlap are written.
 
-    return mask.astype(np.bool)
+    Parameters
+    ----------
+    geoms : geometry or list of geometries
+        Points, Multipoints, Lines, Multilines, Polygons, and Multipolygons.
+        Each part of a multipart geometry is a feature, and features are
+        burned in order.
+    grid : RegularGrid, optional
+        grid to burn features into. If None, a new grid is created from
+        *transform*, *size*, and *crs*, with cells initialized to
+        *nodata_value*.
+    transform : list of floats, optional
+        transform of a new grid
+    size : tuple of ints, optional
+        (ny, nx) size of a new grid
+    crs : karta.crs.CRS, optional
+        coordinate system of a new grid (default Cartesian)
+    field : str, optional
+        field of the data of multipart geometries, or of the properties of
+        singular geometries, containing the value of each feature. If None,
+        all features burn *value*.
+    value : float, optional
+        value burned by features when *field* is None (default 1.0)
+    merge : str, optional
+        how a value is combined with a value already in a cell: "replace"
+        (default), "add", "max", or "min". Each feature burns a cell once.
+    all_touched : bool, optional
+        if True, lines burn every cell they pass through. Otherwise lines
+        burn one cell per row or column along their major axis (default
+        False).
+    iband : int, optional
+        band of an existing grid to burn (default 0)
+    dtype : numpy dtype, optional
+        dtype of a new grid (default float64)
+    nodata_value : number, optional
+        nodata value of a new grid (default NaN)
+    bandclass : class, optional
+        band class of a new grid (default BAND_CLASS_DEFAULT)
+    bandkwargs : dict, optional
+        keyword arguments used to create the bands of a new grid
+    nthreads : int, optional
+        number of worker threads (default the number of CPUs)
+
+    Returns
+    -------
+    RegularGrid, which is *grid* if it was given
+    """
+    if merge not in crfuncs.BURN_MERGE:
+        raise ValueError("merge must be one of {0}".format(crfuncs.BURN_MERGE))
+    imerge = crfuncs.BURN_MERGE.index(merge)
+
+    if grid is None:
+        if transform is None or size is None:
+            raise errors.GridError("either grid or transform and size are "
+                                   "required")
+        if bandclass is None:
+            bandclass = BAND_CLASS_DEFAULT
+        band = bandclass(tuple(size), dtype, initval=nodata_value,
+                         **(bandkwargs or {}))
+        grid = RegularGrid(transform, bands=[band], crs=crs or CRS_DEFAULT,
+                           nodata_value=nodata_value, bandkwargs=bandkwargs)
+    band = grid.bands[iband]
+    nodata = grid.nodata
+
+    features = _burn_features(geoms, grid.crs, grid.transform, field, value)
+    windows = np.array([_feature_window(f) for f in features],
+                       dtype=np.float64).reshape(-1, 4)
+
+    ny, nx = grid.size
+    ty, tx = getattr(band, "_chunksize", (256, 256))
+    tiles = []
+    for a0 in range(0, ny, ty):
+        a1 = min(a0+ty, ny)
+        instrip = np.flatnonzero((windows[:,0] < a1) & (windows[:,1] >= a0))
+        stripfeatures = [(k, _feature_in_rows(features[k], a0, a1))
+                         for k in instrip]
+        stripfeatures = [(k, f) for k, f in stripfeatures if f is not None]
+        if len(stripfeatures) == 0:
+            continue
+        for b0 in range(0, nx, tx):
+            b1 = min(b0+tx, nx)
+            tilefeatures = [f for k, f in stripfeatures
+                            if windows[k,2] < b1 and windows[k,3] >= b0]
+            if len(tilefeatures) != 0:
+                tiles.append(((a0, a1, b0, b1), tilefeatures))
+
+    def burn(tile):
+        (a0, a1, b0, b1), tilefeatures = tile
+        out = np.zeros((a1-a0, b1-b0), dtype=np.float64)
+        filled = np.zeros((a1-a0, b1-b0), dtype=np.uint8)
+        stamp = np.full((a1-a0, b1-b0), -1, dtype=np.int64)
+        for feature in tilefeatures:
+            if feature[0] == "segments":
+                i0, j0, i1, j1, fid, v = feature[1]
+                crfuncs.burn_segments(i0, j0, i1, j1, fid, v, a0, b0,
+                                      out, filled, stamp, imerge, all_touched)
+                continue
+            inside = _burn(feature[2], (a0, a1, b0, b1)) != 0
+            v = feature[1]
+            if merge == "replace":
+                out[inside] = v
+            else:
+                new = inside & (filled == 0)
+                old = inside & (filled != 0)
+                out[new] = v
+                if merge == "add":
+                    out[old] += v
+                elif merge == "max":
+                    out[old] = np.maximum(out[old], v)
+                else:
+                    out[old] = np.minimum(out[old], v)
+            filled[inside] = 1
+        return tile[0], out, filled != 0
 
+    pool = ThreadPool(nthreads)
+    try:
+        for (a0, a1, b0, b1), out, filled in pool.imap(burn, tiles):
+            if not filled.any():
+                continue
+            current = np.asarray(band[a0:a1, b0:b1]).reshape(out.shape)
+            if merge != "replace":
+                both = filled & _isdata(current, nodata)
+                if merge == "add":
+                    out[both] += current[both]
+                elif merge == "max":
+                    out[both] = np.maximum(out[both], current[both])
+                else:
+                    out[both] = np.minimum(out[both], current[both])
+            band[a0:a1, b0:b1] = np.where(filled, out, current).astype(band.dtype)
+    finally:
+        pool.close()
+        pool.join()
+    return grid
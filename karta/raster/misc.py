@@ -4,6 +4,9 @@
 
 import numpy as np
 from .grid import RegularGrid
+from .band import _isdata
+from . import crfuncs
+from ..vector.geometry import Multiline
 
 def witch_of_agnesi(nx=100, ny=100, a=4.0):
     """ Return a raster field defined by the equation
@@ -216,6 +219,93 @@ def hillshade(grid, azimuth=330.0, elevation=60.0):
 
     return RegularGrid(grid.transform, values=dprod, crs=grid.crs)
 
+def _join_segments(edges, positions):
+    """ Join contour segments that share a cell edge into paths, returning a
+    list of (n, 2) arrays of float row and column positions. """
+    n = len(edges)
+    ids = np.r_[edges[:,0], edges[:,1]]
+    order = np.argsort(ids, kind="mergesort")
+    same = np.flatnonzero(ids[order][1:] == ids[order][:-1])
+    partner = np.full(2*n, -1, dtype=np.int64)
+    partner[order[same]] = order[same+1]
+    partner[order[same+1]] = order[same]
+
+    ends = np.empty(2*n, dtype=np.int64)
+    starts = np.empty(n+1, dtype=np.int64)
+    npaths = crfuncs.trace_paths(partner, ends, starts)
+    ipos = np.r_[positions[:,0], positions[:,2]]
+    jpos = np.r_[positions[:,1], positions[:,3]]
+    return [np.column_stack([ipos[ends[a:b]], jpos[ends[a:b]]])
+            for a, b in zip(starts[:npaths], starts[1:npaths+1])]
+
+def contour(grid, levels, iband=0, chunksize=None):
+    """ Return contour lines of a grid, traced by marching squares through the
+    cell centers.
+
+    The grid is read a chunk at a time with a one-cell halo, and segments
+    are joined across chunks. Squares with a nodata corner are not
+    contoured, so contours end at the edges of missing data. Saddles are
+    resolved by the mean of the square's corners.
+
+    Parameters
+    ----------
+    grid : RegularGrid
+    levels : float or list of floats
+        contour levels
+    iband : int, optional
+        band to contour (default 0)
+    chunksize : tuple of ints, optional
+        (rows, columns) read at a time (default the chunk size of the band,
+        or (256, 256))
+
+    Returns
+    -------
+    Multiline with a "level" data field, in the coordinate system of *grid*
+    """
+    levels = np.atleast_1d(np.asarray(levels, dtype=np.float64))
+    band = grid.bands[iband]
+    ny, nx = grid.size
+    if chunksize is None:
+        chunksize = getattr(band, "_chunksize", (256, 256))
+    ty, tx = chunksize
+
+    segments = [([], []) for _ in levels]
+    for r0 in range(0, ny-1, ty):
+        r1 = min(r0+ty+1, ny)
+        for c0 in range(0, nx-1, tx):
+            c1 = min(c0+tx+1, nx)
+            values = np.asarray(band[r0:r1, c0:c1], dtype=np.float64)
+            values = values.reshape(r1-r0, c1-c0)
+            values[~_isdata(values, grid.nodata)] = np.nan
+            if np.isnan(values).all():
+                continue
+            vmin, vmax = np.nanmin(values), np.nanmax(values)
+            nsq = 2*(r1-r0-1)*(c1-c0-1)
+            e = np.empty((nsq, 2), dtype=np.int64)
+            p = np.empty((nsq, 4), dtype=np.float64)
+            for level, (edges, positions) in zip(levels, segments):
+                if level <= vmin or level > vmax:
+                    continue
+                n = crfuncs.marching_squares(values, level, r0, c0, nx, e, p)
+                if n != 0:
+                    edges.append(e[:n].copy())
+                    positions.append(p[:n].copy())
+
+    x0, y0, dx, dy, sx, sy = grid.transform
+    xc = x0 + 0.5*(dx+sx)
+    yc = y0 + 0.5*(dy+sy)
+    vertices = []
+    lines_levels = []
+    for level, (edges, positions) in zip(levels, segments):
+        if len(edges) == 0:
+            continue
+        for path in _join_segments(np.vstack(edges), np.vstack(positions)):
+            i, j = path[:,0], path[:,1]
+            vertices.append(np.column_stack([xc + j*dx + i*sx,
+                                             yc + j*sy + i*dy]))
+            lines_levels.append(float(level))
+    return Multiline(vertices, data={"level": lines_levels}, crs=grid.crs)
+
 def viewshed(D, i, j, r=-1):
     """ Return the viewshed on *D* at (i,j).
     """
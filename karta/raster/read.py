@@ -4,6 +4,7 @@ from .grid import RegularGrid
 from ..crs import ProjectedCRS, GeographicalCRS
 from . import _gtiff
 from . import _aai
+from . import _chunkstore
 # from . import _dem
 
 def read_aai(fnm):
@@ -38,8 +39,14 @@ def read_gtiff(fnm, in_memory=True, ibands=_gtiff.ALL, **kw):
         band(s) to open (default all)
     bandclass : Band class, optional
         class of band used by returned grid (default karta.band.CompressedBand)
-        if in_memory is True, this parameter is ignored and the returned grid
+        karta.band.MmapBand may be used for rasters larger than memory, and
+        karta.band.InterleavedBand stores all bands in shared chunks.
+        if in_memory is False, this parameter is ignored and the returned grid
         will have bands of type karta.raster._gtiff.GdalFileBand
+    bandkwargs : dict, optional
+        keyword arguments passed to *bandclass*, e.g.
+        ``dict(cname="zstd", clevel=5, chunksize=(512, 512))`` for a
+        CompressedBand
     """
     bands, hdr = _gtiff.read(fnm, in_memory, ibands, **kw)
 
@@ -56,7 +63,27 @@ def read_gtiff(fnm, in_memory=True, ibands=_gtiff.ALL, **kw):
         crs = GeographicalCRS(geodstr, name=hdr["srs"]["name"])
     else:
         crs = ProjectedCRS(hdr["srs"]["proj4"], name=hdr["srs"]["name"])
-    return RegularGrid(t, bands=bands, crs=crs, nodata_value=hdr["nodata"])
+    return RegularGrid(t, bands=bands, crs=crs, nodata_value=hdr["nodata"],
+                       bandkwargs=kw.get("bandkwargs", None))
+
+def read_chunkstore(path, cachesize=None, nthreads=None):
+    """ Open a chunk store written by `RegularGrid.to_chunkstore` and return a
+    RegularGrid instance. Only the header is read when the grid is opened;
+    chunks are read from disk as they are accessed.
+
+    Parameters
+    ----------
+    path : str
+        chunk store directory
+    cachesize : int, optional
+        decompressed chunk cache size of each band, in bytes
+    nthreads : int, optional
+        number of threads used by each band to decompress chunks
+    """
+    bands, hdr = _chunkstore.read(path, cachesize=cachesize, nthreads=nthreads)
+    return RegularGrid(hdr["transform"], bands=bands,
+                       crs=_chunkstore.crs_from_dict(hdr["crs"]),
+                       nodata_value=hdr["nodata"])
 
 # Aliases for backwards compat.
 gtiffread = read_gtiff
@@ -1,8 +1,12 @@
 import unittest
+import copy
+import os
+import shutil
+import tempfile
 import numpy as np
 
-from karta.raster import SimpleBand, CompressedBand
-from karta.raster.band import BandIndexer
+from karta.raster import SimpleBand, CompressedBand, MmapBand
+from karta.raster.band import BandIndexer, BandWindow, InterleavedBand
 
 class GenericBandTests(object):
     """ Tests that all Band classes must pass """
@@ -42,6 +46,41 @@ class GenericBandTests(object):
 
         self.assertEqual(np.sum(band[::2,128:960:3]-d), 0.0)
 
+    def test_getblock_strided_reversed(self):
+        d = np.arange(700*600, dtype=np.float64).reshape(700, 600)
+        band = self.type((700, 600), np.float64, **self.initkwargs)
+        band[:,:] = d
+        for key in [(slice(None, None, 300), slice(None, None, 299)),
+                    (slice(None, None, -1), slice(None, None, -1)),
+                    (slice(650, 3, -7), slice(10, 590, 5)),
+                    (slice(None, None, 4), slice(17, 18)),
+                    (slice(10, 10, 2), slice(None, None, 2))]:
+            self.assertTrue(np.all(band[key] == d[key]))
+        self.assertTrue(np.all(band[::-3] == d[::-3]))
+        return
+
+    def test_setblock_strided_reversed(self):
+        d = np.zeros((700, 600), dtype=np.float64)
+        band = self.type((700, 600), np.float64, **self.initkwargs)
+        band[:,:] = d
+        v = np.arange(100*50, dtype=np.float64).reshape(100, 50)
+        band[699:0:-7, 10:510:10] = v
+        d[699:0:-7, 10:510:10] = v
+        self.assertTrue(np.all(band[:,:] == d))
+        return
+
+
+    def test_getpoints(self):
+        d = np.arange(700*600, dtype=np.float64).reshape(700, 600)
+        band = self.type((700, 600), np.float64, **self.initkwargs)
+        band[:,:] = d
+        np.random.seed(49)
+        rows = np.random.randint(0, 700, 500)
+        cols = np.random.randint(0, 600, 500)
+        values = BandIndexer([band]).getpoints(rows, cols)
+        self.assertTrue(np.all(values == d[rows, cols]))
+        self.assertEqual(len(BandIndexer([band]).getpoints([], [])), 0)
+        return
 
 
 class SimpleBandTests(unittest.TestCase, GenericBandTests):
@@ -51,12 +90,316 @@ class SimpleBandTests(unittest.TestCase, GenericBandTests):
         self.initkwargs = dict()
 
 
+class BandWindowTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        def windowed(size, dtype, **kw):
+            parent = CompressedBand((size[0]+30, size[1]+20), dtype,
+                                    chunksize=(64, 64), initval=-1)
+            return BandWindow(parent, 10, 5, size)
+        self.type = windowed
+        self.initkwargs = dict()
+
+    def test_window_writes_through(self):
+        parent = SimpleBand((20, 30), np.int32, initval=0)
+        window = BandWindow(parent, 5, 10, (10, 10))
+        window[:,:] = np.ones((10, 10), dtype=np.int32)
+        window[-1, ::-3] = 7
+        self.assertEqual(parent.array.sum(), 100 + 4*6)
+        self.assertEqual(parent[14, 19], 7)
+        self.assertEqual(parent[14, 10], 7)
+
+        nested = BandWindow(window, 2, 2, (3, 3))
+        self.assertTrue(nested.band is parent)
+        self.assertEqual((nested.yoff, nested.xoff), (7, 12))
+        self.assertEqual(window[::-1, :].shape, (10, 10))
+        with self.assertRaises(IndexError):
+            BandWindow(parent, 15, 0, (10, 10))
+        return
+
+class MmapBandTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        self.type = MmapBand
+        self.initkwargs = dict()
+
+    def test_scratch_file_removed(self):
+        band = MmapBand((64, 64), np.float32, initval=3.0)
+        fnm = band.filename
+        self.assertTrue(os.path.isfile(fnm))
+        self.assertTrue(np.all(band[:,:] == 3.0))
+        del band
+        self.assertFalse(os.path.isfile(fnm))
+        return
+
+    def test_persistent_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fnm = os.path.join(tmpdir, "band.dat")
+            band = MmapBand((64, 32), np.int16, filename=fnm)
+            band[:,:] = np.arange(64*32, dtype=np.int16).reshape(64, 32)
+            band.flush()
+            del band
+            self.assertTrue(os.path.isfile(fnm))
+
+            band = MmapBand((64, 32), np.int16, filename=fnm, mode="r+")
+            self.assertEqual(band[10, 5], 325)
+            del band
+        finally:
+            shutil.rmtree(tmpdir)
+        return
+
+    def test_deepcopy(self):
+        band = MmapBand((16, 16), np.float64, initval=1.0)
+        band2 = copy.deepcopy(band)
+        band2[:,:] = 2.0
+        self.assertNotEqual(band.filename, band2.filename)
+        self.assertTrue(np.all(band[:,:] == 1.0))
+        return
+
 class CompressedBandTests(unittest.TestCase, GenericBandTests):
 
     def setUp(self):
         self.type = CompressedBand
         self.initkwargs = dict(chunksize=(256, 256))
 
+class CompressedBandUncachedTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        self.type = CompressedBand
+        self.initkwargs = dict(chunksize=(256, 256), cachesize=0)
+
+class CompressedBandCodecTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        self.type = CompressedBand
+        self.initkwargs = dict(chunksize=(128, 256), cname="zlib", clevel=3,
+                               shuffle=2, cachesize=0)
+
+class CompressedBandStorageTests(unittest.TestCase):
+
+    def test_codec_settings(self):
+        d = np.tile(np.arange(256, dtype=np.int16), (256, 1))
+        sizes = {}
+        for cname in ("blosclz", "lz4", "zlib"):
+            for shuffle in (0, 1, 2):
+                band = CompressedBand((256, 256), np.int16, chunksize=(64, 64),
+                                      cname=cname, clevel=5, shuffle=shuffle,
+                                      cachesize=0)
+                band[:,:] = d
+                self.assertTrue(np.all(band[:,:] == d))
+                sizes[(cname, shuffle)] = band.nbytes
+        self.assertTrue(all(v < d.nbytes for v in sizes.values()))
+        self.assertNotEqual(sizes[("blosclz", 0)], sizes[("zlib", 1)])
+        return
+
+    def test_codec_invalid(self):
+        with self.assertRaises(ValueError):
+            CompressedBand((16, 16), np.float64, cname="bzip7")
+        with self.assertRaises(ValueError):
+            CompressedBand((16, 16), np.float64, clevel=12)
+        with self.assertRaises(ValueError):
+            CompressedBand((16, 16), np.float64, shuffle=5)
+        return
+
+    def test_lazy_initval(self):
+        band = CompressedBand((100000, 100000), np.float32, initval=-9999.0)
+        self.assertTrue(np.all(band.chunkstatus == band.CHUNKUNSET))
+        self.assertEqual(band[50000, 123], -9999.0)
+        band[10:20, 10:20] = np.ones((10, 10), dtype=np.float32)
+        block = band[5:25, 5:25]
+        self.assertEqual(np.sum(block == 1.0), 100)
+        self.assertEqual(np.sum(block == -9999.0), 300)
+        return
+
+    def test_uniform_chunks(self):
+        band = CompressedBand((200, 200), np.float64, chunksize=(64, 64),
+                              cachesize=0)
+        values = np.nan*np.ones((200, 200))
+        values[:64, :64] = np.arange(64*64).reshape(64, 64)
+        band[:,:] = values
+        self.assertEqual(band.chunkstatus[0], band.CHUNKSET)
+        self.assertTrue(np.all(band.chunkstatus[1:] == band.CHUNKUNIFORM))
+        result = band[:,:]
+        self.assertTrue(np.all(result[:64,:64] == values[:64,:64]))
+        self.assertTrue(np.all(np.isnan(result[64:,:])))
+        self.assertTrue(np.all(np.isnan(result[:,64:])))
+        return
+
+    def test_duplicate_chunks_shared(self):
+        band = CompressedBand((128, 256), np.int32, chunksize=(64, 64),
+                              cachesize=0)
+        tile = np.arange(64*64, dtype=np.int32).reshape(64, 64)
+        band[:,:] = np.tile(tile, (2, 4))
+        self.assertEqual(len(band._buffers), 1)
+        self.assertTrue(all(d is band._data[0] for d in band._data))
+
+        band[:64, :64] = tile[::-1]
+        self.assertEqual(len(band._buffers), 2)
+        self.assertTrue(np.all(band[64:, 64:128] == tile))
+        self.assertTrue(np.all(band[:64, :64] == tile[::-1]))
+
+        band[:,:] = np.zeros((128, 256), dtype=np.int32)
+        self.assertEqual(len(band._buffers), 0)
+        return
+
+    def test_chunkstats(self):
+        band = CompressedBand((100, 150), np.float64, chunksize=(64, 64),
+                              initval=-1.0)
+        values = np.arange(100*150, dtype=np.float64).reshape(100, 150)
+        values[70:, :] = -1.0
+        values[:10, :10] = np.nan
+        band[:,:] = values
+        count, vmin, vmax = band.chunkstats(-1.0)
+        self.assertEqual(count.shape, (2, 3))
+        self.assertEqual(count[0,0], 64*64)
+        self.assertEqual(count[1,2], (70-64)*(150-128))
+        self.assertEqual(vmax[1,1], values[69,127])
+        self.assertEqual(vmin[0,1], values[0,64])
+
+        count, vmin, vmax = band.chunkstats(np.nan)
+        self.assertEqual(count[0,0], 64*64-100)
+        self.assertEqual(vmin[0,0], 10.0)
+        self.assertEqual(count.sum(), 100*150-100)
+        return
+
+    def test_chunkstats_incremental(self):
+        band = CompressedBand((128, 128), np.int16, chunksize=(64, 64),
+                              cachesize=0)
+        band[:,:] = np.ones((128, 128), dtype=np.int16)
+        band.chunkstats(0)
+        band[70:80, 70:80] = 5*np.ones((10, 10), dtype=np.int16)
+        self.assertTrue(all(st is not None for st in band._stats))
+        count, vmin, vmax = band.chunkstats(0)
+        self.assertEqual(vmax.tolist(), [[1, 1], [1, 5]])
+
+        band = CompressedBand((128, 128), np.int16, chunksize=(64, 64))
+        band.chunkstats(0)
+        band[0, 0] = 7
+        self.assertEqual(band._stats[0], None)
+        self.assertEqual(band.chunkstats(0)[2][0,0], 7)
+        self.assertEqual(band.chunkstats(0)[0][0,0], 1)
+        return
+
+    def test_chunkstats_no_nodata(self):
+        # threaded writes compress chunks directly, updating their statistics
+        band = CompressedBand((128, 128), np.int16, chunksize=(64, 64),
+                              nthreads=2)
+        band[:,:] = np.arange(128*128, dtype=np.int16).reshape(128, 128) % 4096
+        self.assertEqual(band.chunkstats(None)[2].max(), 4095)
+        band[:,:] = 5*np.ones((128, 128), dtype=np.int16)
+        count, vmin, vmax = band.chunkstats(None)
+        self.assertEqual(vmax.max(), 5)
+        self.assertEqual(vmin.min(), 5)
+        self.assertEqual(count.sum(), 128*128)
+        return
+
+    def test_datamask(self):
+        band = CompressedBand((100, 100), np.float32, chunksize=(32, 32),
+                              initval=np.nan)
+        band[40:50, 10:90] = np.ones((10, 80), dtype=np.float32)
+        mask = band.datamask(np.nan)
+        self.assertEqual(mask.sum(), 800)
+        self.assertTrue(mask[40:50, 10:90].all())
+        return
+
+class CompressedBandThreadedTests(unittest.TestCase, GenericBandTests):
+
+    def setUp(self):
+        self.type = CompressedBand
+        self.initkwargs = dict(chunksize=(256, 256), nthreads=4)
+
+class CompressedBandCacheTests(unittest.TestCase):
+
+    def test_cache_hits(self):
+        band = CompressedBand((512, 512), np.float64, chunksize=(256, 256))
+        band[:,:] = np.arange(512*512, dtype=np.float64).reshape(512, 512)
+        band.clear_cache()
+        for i in range(256):
+            band[i,:]
+        self.assertEqual(band.cache.misses, 2)
+        self.assertEqual(band.cache.hits, 2*256-2)
+        return
+
+    def test_getpoints_reads_touched_chunks(self):
+        band = CompressedBand((1024, 1024), np.float64, chunksize=(128, 128))
+        band[:,:] = np.arange(1024*1024, dtype=np.float64).reshape(1024, 1024)
+        band[:128,:128] = 5.0
+        band.clear_cache()
+        rows = np.array([3, 900, 127, 128, 901, 10])
+        cols = np.array([3, 20, 129, 129, 21, 1000])
+        values = band.getpoints(rows, cols)
+        self.assertEqual(list(values[1:]), [900*1024+20.0, 127*1024+129.0,
+                                            128*1024+129.0, 901*1024+21.0,
+                                            10*1024+1000.0])
+        self.assertEqual(values[0], 5.0)
+        # the first chunk is uniform and needs no decompression
+        self.assertEqual(band.cache.misses, 4)
+        self.assertEqual(len(band.cache), 4)
+        return
+
+    def test_cache_budget(self):
+        # room for two 64x64 float64 chunks
+        band = CompressedBand((256, 256), np.float64, chunksize=(64, 64),
+                              cachesize=2*64*64*8)
+        d = np.arange(256*256, dtype=np.float64).reshape(256, 256)
+        band[:,:] = d
+        self.assertEqual(len(band.cache), 2)
+        self.assertTrue(band.cache.nbytes <= band.cache.maxbytes)
+        self.assertTrue(np.all(band[:,:] == d))
+        return
+
+    def test_cache_writeback(self):
+        band = CompressedBand((256, 256), np.float64, chunksize=(64, 64),
+                              cachesize=2*64*64*8)
+        band[:,:] = np.zeros((256, 256))
+        for i in range(0, 256, 8):
+            for j in range(0, 256, 8):
+                band[i,j] = i+j
+        band.clear_cache()
+        self.assertEqual(len(band.cache), 0)
+        self.assertEqual(band[40,200], 240)
+        self.assertEqual(band[41,200], 0)
+        self.assertEqual(np.sum(band[:,:]), np.sum(np.arange(0, 256, 8))*2*32)
+        return
+
+    def test_streamed_read_with_dirty_chunks(self):
+        # reading more than the cache holds bypasses the cache, but must see
+        # chunks modified in the cache
+        band = CompressedBand((256, 256), np.float64, chunksize=(64, 64),
+                              cachesize=4*64*64*8)
+        d = np.arange(256*256, dtype=np.float64).reshape(256, 256)
+        band[:,:] = d
+        band[3,3] = -1.0
+        misses = band.cache.misses
+        result = band[:,:]
+        self.assertEqual(result[3,3], -1.0)
+        self.assertEqual(np.sum(result != d), 1)
+        self.assertEqual(band.cache.misses, misses)
+        return
+
+    def test_decompress_into_output(self):
+        # single column of chunks, so interior chunks are contiguous in the
+        # output
+        band = CompressedBand((256, 64), np.int32, chunksize=(64, 64),
+                              cachesize=0)
+        d = np.arange(256*64, dtype=np.int32).reshape(256, 64)
+        band[:,:] = d
+        self.assertTrue(np.all(band[:,:] == d))
+        self.assertTrue(np.all(band[32:200,:] == d[32:200]))
+        return
+
+    def test_threaded_dirty_chunks(self):
+        band = CompressedBand((256, 256), np.float64, chunksize=(64, 64),
+                              nthreads=3)
+        band[:,:] = np.zeros((256, 256))
+        band[10,10] = 1.0               # modifies a cached chunk
+        band[32:96, 32:96] = 2.0*np.ones((64, 64))
+        result = band[:,:]
+        self.assertEqual(result[10,10], 1.0)
+        self.assertEqual(np.sum(result), 1.0 + 2.0*64*64)
+        return
+
 class BandIndexerTests(unittest.TestCase):
 
     def test_get_masked(self):
@@ -82,6 +425,39 @@ class BandIndexerTests(unittest.TestCase):
         indexer[mask] = -1
         self.assertEqual(np.sum(indexer[:,:]), 32)
 
+    def test_get_masked_chunked(self):
+        values = np.arange(100*100, dtype=np.float64).reshape(100, 100)
+        band = CompressedBand((100, 100), np.float64, chunksize=(16, 16))
+        band[:,:] = values
+        indexer = BandIndexer([band])
+
+        mask = np.zeros([100, 100], dtype=np.bool_)
+        mask[5:40, 10:90:3] = True
+        mask[70, :] = True
+        band.clear_cache()
+        self.assertTrue(np.all(indexer[mask] == values[mask]))
+        # chunk rows 3 and 5, and the empty chunks of others, are skipped
+        self.assertEqual(band.cache.misses, 3*6 + 7)
+        return
+
+    def test_set_masked_chunked(self):
+        values = np.arange(100*100, dtype=np.float64).reshape(100, 100)
+        band = CompressedBand((100, 100), np.float64, chunksize=(16, 16))
+        indexer = BandIndexer([band])
+
+        mask = np.zeros([100, 100], dtype=np.bool_)
+        mask[5:40, 10:90:3] = True
+        mask[70, :] = True
+        indexer[mask] = values[mask]
+        self.assertEqual(np.sum(band.chunkstatus != band.CHUNKUNSET), 3*6 + 7)
+
+        expected = np.where(mask, values, 0.0)
+        self.assertTrue(np.all(band[:,:] == expected))
+
+        indexer[mask] = -1.0
+        self.assertEqual(np.sum(band[:,:] == -1.0), mask.sum())
+        return
+
     def test_get_multibanded(self):
         values = np.ones([16, 16])
         bands = [CompressedBand((16, 16), np.float32),
@@ -117,5 +493,62 @@ class BandIndexerTests(unittest.TestCase):
         self.assertTrue(np.all(bands[2][:,:] == 2.0))
         return
 
+    def test_get_interleaved(self):
+        store = InterleavedBand((100, 120), np.float32, nbands=3,
+                                chunksize=(32, 32))
+        values = np.random.rand(100, 120, 3).astype(np.float32)
+        store[:,:] = values
+        indexer = BandIndexer(store.components())
+        self.assertEqual(indexer.shape, (3, 100, 120))
+        self.assertTrue(np.all(indexer[:,:] == values))
+        self.assertTrue(np.all(indexer[10:50:3,::-7,1:] == values[10:50:3,::-7,1:]))
+        self.assertTrue(np.all(indexer[4:7,2:8,1] == values[4:7,2:8,1]))
+        self.assertEqual(indexer[5,6].shape, (1, 1, 3))
+        self.assertEqual(np.shape(indexer[5,6,1]), ())
+        self.assertEqual(indexer[5,6,1], values[5,6,1])
+        self.assertEqual(indexer[5,5,-1], values[5,5,-1])
+
+        mask = values[:,:,0] > 0.5
+        self.assertTrue(np.all(indexer[mask] == np.dstack([values[:,:,i][mask]
+                                                           for i in range(3)])))
+        rows = list(indexer)
+        self.assertEqual(len(rows), 100)
+        self.assertTrue(np.all(rows[17] == values[17].T))
+        return
+
+    def test_getpoints_interleaved(self):
+        d = np.arange(3*80*90, dtype=np.float64).reshape(80, 90, 3)
+        store = InterleavedBand((80, 90), np.float64, nbands=3,
+                                chunksize=(32, 32))
+        store[:,:] = d
+        rows, cols = np.array([0, 79, 40]), np.array([89, 0, 33])
+        indexer = BandIndexer(store.components())
+        self.assertTrue(np.all(indexer.getpoints(rows, cols) == d[rows, cols]))
+        indexer = BandIndexer(store.components()[1:2])
+        self.assertTrue(np.all(indexer.getpoints(rows, cols) == d[rows, cols, 1]))
+        return
+
+    def test_set_interleaved(self):
+        store = InterleavedBand((40, 40), np.int16, nbands=2, chunksize=(16, 16),
+                                initval=-1)
+        bands = store.components()
+        indexer = BandIndexer(bands)
+        indexer[:,:,0] = np.ones((40, 40))
+        bands[1][5:10, 5:10] = 4
+        self.assertEqual(store[7, 7].tolist(), [1, 4])
+        self.assertEqual(store[0, 0].tolist(), [1, -1])
+
+        mask = np.zeros((40, 40), dtype=bool)
+        mask[20:, 30:] = True
+        bands[1][mask] = 9
+        self.assertEqual(np.sum(store[:,:][:,:,1] == 9), 200)
+        self.assertTrue(np.all(bands[0][:,:] == 1))
+
+        values = np.arange(40*40*2, dtype=np.int16).reshape(40, 40, 2)
+        indexer[:,:] = values
+        self.assertTrue(np.all(store[:,:] == values))
+        self.assertTrue(np.all(bands[1][::2, 3] == values[::2, 3:4, 1]))
+        return
+
 if __name__ == "__main__":
     unittest.main()
@@ -26,5 +26,32 @@ class TestCrfuncs(unittest.TestCase):
         self.assertEqual(arr[22, 32], -999.0)
         self.assertEqual(np.sum(np.abs(Zorig[arr!=-999] - arr[arr!=-999])), 0.0)
 
+    def test_interpolate_kernels(self):
+        I, J = np.meshgrid(np.arange(20.0), np.arange(30.0), indexing="ij")
+        values = np.ascontiguousarray(3.0*I - 2.0*J + 1.0)
+        i = np.array([0.0, 5.25, 10.5, 19.0])
+        j = np.array([0.0, 7.75, 3.5, 29.0])
+        expected = 3.0*i - 2.0*j + 1.0
+        for method in ("bilinear", "bicubic", "lanczos"):
+            out = np.empty(4)
+            crfuncs.interpolate(values, i, j, out, method, -999.0)
+            self.assertTrue(np.allclose(out[[0, 3]], expected[[0, 3]]))
+            if method != "lanczos":
+                self.assertTrue(np.allclose(out, expected))
+
+    def test_interpolate_nodata(self):
+        values = np.ones((10, 10))
+        values[5, 5] = -999.0
+        i = np.array([5.5, 5.0, 2.0, 6.0])
+        j = np.array([5.5, 6.0, 2.0, 8.0])
+        out = np.empty(4)
+        crfuncs.interpolate(values, i, j, out, "bilinear", -999.0)
+        self.assertEqual(list(out), [-999.0, 1.0, 1.0, 1.0])
+        crfuncs.interpolate(values, i, j, out, "bicubic", -999.0)
+        self.assertEqual(list(out[[0, 2, 3]]), [-999.0, 1.0, 1.0])
+        self.assertEqual(out[1], 1.0)
+        with self.assertRaises(ValueError):
+            crfuncs.interpolate(values, i, j, out, "cubic", -999.0)
+
 if __name__ == "__main__":
     unittest.main()
@@ -2,11 +2,21 @@
 
 import unittest
 import os
+import shutil
+import tempfile
 import numpy as np
 from test_helper import TESTDATA
 
 import karta
 
+def _smooth(values):
+    # five-point average, used by map_blocks tests; defined at module level so
+    # that it can be sent to worker processes
+    out = values.copy()
+    out[1:-1,1:-1] = (values[:-2,1:-1] + values[2:,1:-1] + values[1:-1,:-2] +
+                      values[1:-1,2:] + values[1:-1,1:-1]) / 5.0
+    return out
+
 class RegularGridTests(unittest.TestCase):
 
     def setUp(self):
@@ -88,6 +98,48 @@ class RegularGridTests(unittest.TestCase):
         self.assertAlmostEqual(grid_combined[4,5], 2.33333333333)
         return
 
+    def test_merge_methods(self):
+        grid1 = karta.RegularGrid([0, 0, 1, 1, 0, 0], values=np.ones([6, 6]))
+        values2 = 3*np.ones([6, 6])
+        values2[1, 1] = np.nan
+        grid2 = karta.RegularGrid([3, 3, 1, 1, 0, 0], values=values2)
+        # values at (0,0) and (8,8), which lie in one grid, and at (5,5) and
+        # (4,4), where the grids overlap but grid 2 is nodata
+        expected = {"first": (1, 3, 1, 1), "last": (1, 3, 3, 1),
+                    "min": (1, 3, 1, 1), "max": (1, 3, 3, 1),
+                    "mean": (1, 3, 2, 1)}
+        for method in expected:
+            grid = karta.raster.merge([grid1, grid2], method=method,
+                                      bandkwargs=dict(chunksize=(4, 4)),
+                                      nthreads=2)
+            self.assertEqual(grid.size, (9, 9))
+            self.assertEqual((grid[0,0], grid[8,8], grid[5,5], grid[4,4]),
+                             expected[method])
+            self.assertTrue(np.isnan(grid[8,0]))
+            self.assertTrue(np.isnan(grid[0,8]))
+        return
+
+    def test_merge_subpixel(self):
+        def linear(x0, y0, ny, nx):
+            grid = karta.RegularGrid([x0, y0, 1, 1, 0, 0], values=np.zeros([ny, nx]))
+            x, y = grid.center_coords()
+            return karta.RegularGrid([x0, y0, 1, 1, 0, 0], values=2*x - y)
+
+        grid1 = linear(0, 0, 20, 20)
+        grid2 = linear(14.25, 5.5, 20, 20)
+        grid = karta.raster.merge([grid1, grid2], method="last",
+                                  bandkwargs=dict(chunksize=(8, 8)))
+        self.assertEqual(grid.transform, (0.0, 0.0, 1.0, 1.0, 0.0, 0.0))
+        self.assertEqual(grid.size, (25, 34))
+        x, y = grid.center_coords()
+        values = grid[:,:]
+        valid = ~np.isnan(values)
+        self.assertTrue(np.allclose(values[valid], (2*x - y)[valid]))
+        # cells with centres in grid 2 but not in grid 1
+        self.assertTrue(np.all(valid[6:25, 20:33]))
+        self.assertTrue(np.all(~valid[20:25, :14]))
+        return
+
     def test_resample_nearest(self):
         # use linear function so that nearest neighbour and linear interp are
         # exact
@@ -105,6 +157,61 @@ class RegularGridTests(unittest.TestCase):
         self.assertTrue(np.max(np.abs(residue)) < 1e-12)
         return
 
+    def test_build_overviews(self):
+        v = np.arange(36, dtype=np.float64).reshape(6, 6)
+        v[0,0] = np.nan
+        grid = karta.RegularGrid((0, 0, 10, 10, 0, 0), values=v,
+                                 nodata_value=np.nan)
+        grid.build_overviews(levels=2, method="mean")
+        ov = grid.overview(2)
+        self.assertEqual(ov.size, (3, 3))
+        self.assertEqual(ov.transform, (0, 0, 20, 20, 0, 0))
+        self.assertEqual(ov[0,0], (1+6+7)/3.0)
+        self.assertEqual(ov[2,2], (28+29+34+35)/4.0)
+        self.assertEqual(grid.overview(4).size, (2, 2))
+
+        grid.build_overviews(levels=1, method="max")
+        self.assertTrue(np.all(grid.overview(2)[:,:] == v[1::2,1::2]))
+        with self.assertRaises(karta.errors.GridError):
+            grid.overview(4)
+        return
+
+    def test_overview_mode(self):
+        v = np.array([[1, 1, 2, 3],
+                      [2, 5, 3, 3],
+                      [-1, -1, 4, 7],
+                      [-1, 8, 7, 4]], dtype=np.int16)
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=v, nodata_value=-1)
+        grid.build_overviews(levels=1, method="mode")
+        self.assertEqual(grid.overview(2)[:,:].tolist(), [[1, 3], [8, 4]])
+        return
+
+    def test_overviews_invalidated(self):
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(64))
+        grid.build_overviews(levels=3, method="nearest")
+        self.assertTrue(np.all(grid[::4,::4] == peaks(64)[::4,::4]))
+        self.assertTrue(np.all(grid[:30:8,:61:8] == peaks(64)[:30:8,:61:8]))
+        self.assertTrue(np.all(grid.overview(8)[:,:] == peaks(64)[::8,::8]))
+        grid[0,0] = 100.0
+        with self.assertRaises(karta.errors.GridError):
+            grid.overview(8)
+        self.assertEqual(grid[::8,::8][0,0], 100.0)
+        return
+
+    def test_resample_overview(self):
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(128))
+        expected = grid.resample(8.0, 8.0)
+        grid.build_overviews(levels=4, method="nearest")
+        resampled = grid.resample(8.0, 8.0)
+        self.assertEqual(resampled.size, expected.size)
+        self.assertTrue(np.all(resampled[:,:] == expected[:,:]))
+
+        grid.build_overviews(levels=4, method="mean")
+        resampled = grid.resample(8.0, 8.0)
+        self.assertEqual(resampled.size, expected.size)
+        self.assertAlmostEqual(resampled[:,:].mean(), peaks(128).mean(), 1)
+        return
+
     def test_resample_linear(self):
         # use linear function so that nearest neighbour and linear interp are
         # exact
@@ -229,6 +336,19 @@ class RegularGridTests(unittest.TestCase):
         self.assertTrue(np.isnan(minmax[1]))
         return
 
+    def test_minmax_after_update(self):
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(100),
+                                 bandkwargs=dict(chunksize=(32, 32)))
+        self.assertEqual(grid.minmax(), (peaks(100).min(), peaks(100).max()))
+        grid[50:52, 50:52] = 100.0
+        grid[10, 90] = -100.0
+        self.assertEqual(grid.minmax(), (-100.0, 100.0))
+        grid[:,:] = np.nan
+        grid[3, 4] = 1.0
+        self.assertEqual(grid.minmax(), (1.0, 1.0))
+        self.assertEqual(grid.get_data_extent(), (4.5, 4.5, 3.5, 3.5))
+        return
+
     def test_minmax(self):
         minmax = self.rast.minmax()
         self.assertEqual(minmax, (-6.5466445243204294, 8.075173545159231))
@@ -245,6 +365,30 @@ class RegularGridTests(unittest.TestCase):
         self.assertEqual(Y[-1,0], 945)
         return
 
+    def test_clip_window(self):
+        grid = self.rast.copy()
+        clipped = grid.clip(500, 950, 500, 950, copy=False)
+        self.assertEqual(clipped.size, (15, 15))
+        self.assertEqual(clipped.transform, (510, 510, 30, 30, 0, 0))
+        self.assertTrue(np.all(clipped[:,:] == self.rast[17:32,17:32]))
+        clipped[:,:] = -1.0
+        self.assertTrue(np.all(grid[17:32,17:32] == -1.0))
+        self.assertEqual(clipped.clip(600, 700, 600, 700).size, (3, 3))
+        return
+
+    def test_aschunks_windows(self):
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(50))
+        chunks = list(grid.aschunks(size=(20, 20), overlap=(4, 4), copy=False))
+        self.assertEqual(len(chunks), 16)
+        self.assertTrue(all(isinstance(c.bands[0], karta.raster.band.BandWindow)
+                            for c in chunks))
+        self.assertEqual(chunks[5].transform, (16, 16, 1, 1, 0, 0))
+        self.assertTrue(np.all(chunks[5][:,:] == peaks(50)[16:36,16:36]))
+        self.assertEqual(chunks[-1].size, (2, 2))
+        chunks[0][0,0] = 99.0
+        self.assertEqual(grid[0,0], 99.0)
+        return
+
     def test_clip_to_extent(self):
         proto = karta.RegularGrid((500, 500, 30, 30, 0, 0), np.zeros((15,15)))
         clipped = self.rast.clip(*proto.get_extent("edge"))
@@ -361,6 +505,72 @@ class RegularGridTests(unittest.TestCase):
         self.assertEqual(int(np.nansum(masked_grid[:,:])), 47081206720)
         return
 
+    def test_mask_poly_holes(self):
+        hole = karta.Polygon([(3, 3), (3, 7), (7, 7), (7, 3)])
+        poly = karta.Polygon([(1, 1), (9, 1), (9, 9), (1, 9)], subs=[hole])
+        island = karta.Multipolygon([[[(4, 4), (6, 4), (6, 6), (4, 6)]]])
+        grid = karta.RegularGrid([0.0, 10.0, 1.0, -1.0, 0.0, 0.0],
+                                 values=np.arange(100.0).reshape(10, 10),
+                                 bandclass=karta.raster.CompressedBand,
+                                 bandkwargs=dict(chunksize=(4, 4)))
+        self.assertEqual(grid.polygon_window(poly), (1, 9, 0, 10))
+        self.assertEqual(grid.polygon_mask(poly).sum(), 48)
+        self.assertEqual(grid.polygon_mask([poly, island]).sum(), 52)
+
+        masked_grid = grid.mask_by_poly([poly, island])
+        expected = np.where(grid.polygon_mask([poly, island]),
+                            grid[:,:], np.nan)
+        self.assertTrue(np.array_equal(masked_grid[:,:], expected,
+                                       equal_nan=True))
+        grid.mask_by_poly(poly, inplace=True)
+        self.assertEqual(grid.data_mask.sum(), 48)
+        return
+
+    def test_mask_poly_coverage(self):
+        poly = karta.Polygon([(0.5, 0.5), (2.5, 0.5), (2.5, 1.5), (0.5, 1.5)])
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=np.zeros((4, 4)))
+        cov = grid.polygon_mask(poly, coverage=True)
+        self.assertTrue(np.allclose(cov[:2,:3], [[0.25, 0.5, 0.25],
+                                                 [0.25, 0.5, 0.25]]))
+        self.assertAlmostEqual(cov.sum(), 2.0)
+        return
+
+    def test_zonal_stats(self):
+        values = np.arange(100.0).reshape(10, 10)
+        values[2,2] = -1
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=values, nodata_value=-1,
+                                 bandclass=karta.raster.CompressedBand,
+                                 bandkwargs=dict(chunksize=(3, 4)))
+        zones = karta.Multipolygon([[[(1, 1), (5, 1), (5, 5), (1, 5)],
+                                     [(3, 3), (3, 4), (4, 4), (4, 3)]],
+                                    [[(6, 6), (9, 6), (9, 9), (6, 9)]],
+                                    [[(20, 20), (21, 20), (21, 21)]]],
+                                   data={"name": ["a", "b", "c"]})
+        table = grid.zonal_stats(zones, stats=["count", "sum", "mean", "min",
+                                               "max", "std", "histogram"],
+                                 bins=[0, 50, 100])
+        self.assertEqual(table.fields, ("name", "count", "sum", "mean", "min",
+                                        "max", "std", "histogram"))
+        self.assertEqual(len(table), 3)
+
+        for row, (r0, r1, c0, c1) in zip(table, [(1, 5, 1, 5), (6, 9, 6, 9)]):
+            v = values[r0:r1, c0:c1].copy()
+            if row[0] == "a":
+                v[2,2] = -1
+            v = v[v != -1]
+            self.assertEqual(row[1], len(v))
+            self.assertAlmostEqual(row[2], v.sum())
+            self.assertAlmostEqual(row[3], v.mean())
+            self.assertEqual((row[4], row[5]), (v.min(), v.max()))
+            self.assertAlmostEqual(row[6], v.std())
+            self.assertEqual(row[7], np.histogram(v, [0, 50, 100])[0].tolist())
+
+        self.assertEqual(table[2][:3], ("c", 0, 0.0))
+        self.assertTrue(np.isnan(table[2][3]))
+        return
+
     def test_get_positions(self):
         grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
                                  values=np.zeros((3,3)))
@@ -370,6 +580,186 @@ class RegularGridTests(unittest.TestCase):
         self.assertEqual((i,j), (1.0, 1.5))
         return
 
+    def test_get_positions_skewed(self):
+        grid = karta.RegularGrid([100.0, 200.0, 2.0, 3.0, 0.5, -0.25],
+                                 values=np.zeros((40, 30)))
+        I, J = np.meshgrid(np.arange(40.0), np.arange(30.0), indexing="ij")
+        x = 100.0 + 0.5*(2.0+0.5) + J*2.0 + I*0.5
+        y = 200.0 + 0.5*(3.0-0.25) + J*-0.25 + I*3.0
+        i, j = grid.get_positions(x, y)
+        self.assertEqual(i.shape, (40, 30))
+        self.assertTrue(np.allclose(i, I))
+        self.assertTrue(np.allclose(j, J))
+        return
+
+    def test_get_positions_out(self):
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=np.zeros((3,3)))
+        out = (np.empty(2), np.empty(2))
+        i, j = grid.get_positions([1.5, 2.0], [1.5, 2.5], out=out)
+        self.assertTrue(i is out[0] and j is out[1])
+        self.assertEqual(list(i), [1.0, 2.0])
+        self.assertEqual(list(j), [1.0, 1.5])
+        with self.assertRaises(ValueError):
+            grid.get_positions([1.5, 2.0], [1.5, 2.5],
+                               out=(np.empty(3), np.empty(3)))
+        return
+
+    def test_sample_chunked(self):
+        values = peaks(200)
+        simple = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                   values=values, bandclass=karta.raster.SimpleBand)
+        chunked = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                    values=values, bandclass=karta.raster.CompressedBand,
+                                    bandkwargs=dict(chunksize=(32, 32)))
+        np.random.seed(49)
+        x = 1.0 + 198*np.random.rand(300)
+        y = 1.0 + 198*np.random.rand(300)
+        x[:3] = [32.0, 32.5, 64.0]
+        y[:3] = [32.0, 31.5, 10.0]
+        self.assertTrue(np.all(chunked.sample_nearest(x, y) ==
+                               simple.sample_nearest(x, y)))
+        self.assertTrue(np.allclose(chunked.sample_bilinear(x, y),
+                                    simple.sample_bilinear(x, y)))
+        self.assertEqual(chunked.sample_nearest(50.5, 60.5), values[60, 50])
+        return
+
+    def test_sample_multiband(self):
+        values = np.dstack([peaks(50), 2*peaks(50)])
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values)
+        z = grid.sample_nearest(np.array([0.5, 10.5]), np.array([0.5, 20.5]))
+        self.assertTrue(np.all(z == values[[0, 20], [0, 10]]))
+        z = grid.sample_bilinear(np.array([1.0, 10.5]), np.array([1.0, 20.5]))
+        self.assertEqual(z.shape, (2, 2))
+        self.assertTrue(np.allclose(z[:,1], 2*z[:,0]))
+        return
+
+    def test_sample_kernels_chunked(self):
+        values = peaks(200)
+        simple = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                   values=values, bandclass=karta.raster.SimpleBand)
+        chunked = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                    values=values, bandclass=karta.raster.CompressedBand,
+                                    bandkwargs=dict(chunksize=(32, 32)))
+        np.random.seed(49)
+        x = 0.5 + 199*np.random.rand(300)
+        y = 0.5 + 199*np.random.rand(300)
+        for method in ("bicubic", "lanczos"):
+            z = chunked.sample(x, y, method=method)
+            self.assertEqual(z.shape, (300,))
+            self.assertTrue(np.allclose(z, simple.sample(x, y, method=method)))
+            self.assertTrue(np.allclose(chunked.sample([50.5], [60.5], method=method),
+                                        values[60, 50]))
+        z = chunked.sample(x, y, method="bicubic")
+        self.assertTrue(np.max(np.abs(z - simple.sample(x, y))) < 0.05)
+        with self.assertRaises(karta.errors.GridError):
+            chunked.sample([250.0], [10.0], method="lanczos")
+        return
+
+    def test_resample_bicubic(self):
+        I, J = np.meshgrid(np.arange(60.0), np.arange(80.0), indexing="ij")
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=2.0*I + J)
+        newgrid = grid.resample(0.5, 0.5, method="bicubic")
+        x, y = newgrid.center_coords()
+        # edge cells are replicated beyond the grid, so only interior values
+        # are exact
+        self.assertTrue(np.allclose(newgrid[2:-2,2:-2],
+                                    (2.0*(y-0.5) + (x-0.5))[2:-2,2:-2]))
+        return
+
+    def test_resample_aggregate(self):
+        values = np.arange(60*80, dtype=np.float64).reshape(60, 80)
+        values[8:12, 20:24] = -1
+        values[30, 30] = -1
+        grid = karta.RegularGrid([100.0, 200.0, 2.0, 2.0, 0.0, 0.0],
+                                 values=values, nodata_value=-1.0,
+                                 bandkwargs=dict(chunksize=(16, 16)))
+        windows = values.reshape(15, 4, 20, 4).swapaxes(1, 2).reshape(15, 20, 16)
+        masked = np.ma.masked_equal(windows, -1)
+
+        mean = grid.resample(8.0, 8.0, method="mean")
+        self.assertEqual(mean.size, (15, 20))
+        self.assertEqual(mean.transform, (100.0, 200.0, 8.0, 8.0, 0.0, 0.0))
+        self.assertTrue(np.allclose(mean[:,:], masked.mean(axis=-1).filled(-1)))
+        self.assertEqual(mean[2, 5], -1)
+
+        count = grid.resample(8.0, 8.0, method="count")
+        self.assertEqual(count[:,:].dtype, np.int32)
+        self.assertTrue(np.all(count[:,:] == masked.count(axis=-1)))
+
+        for method in ("sum", "min", "max"):
+            expected = getattr(masked, method)(axis=-1).filled(-1)
+            self.assertTrue(np.allclose(grid.resample(8.0, 8.0, method=method)[:,:],
+                                        expected))
+        return
+
+    def test_resample_aggregate_fractional(self):
+        np.random.seed(49)
+        values = np.random.randint(0, 4, (47, 53)).astype(np.int16)
+        values[5:9, 5:9] = -99
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=values, nodata_value=-99,
+                                 bandkwargs=dict(chunksize=(8, 8)))
+        rows = np.floor((np.arange(47)+0.5)/2.5).astype(int)
+        cols = np.floor((np.arange(53)+0.5)/3.5).astype(int)
+        for method in ("mean", "sum", "min", "max", "mode", "count"):
+            newgrid = grid.resample(3.5, 2.5, method=method)
+            self.assertEqual(newgrid.size, (19, 16))
+            result = newgrid[:,:]
+            for i in range(19):
+                for j in range(16):
+                    cell = values[rows == i][:, cols == j].ravel()
+                    cell = cell[cell != -99]
+                    if method == "count":
+                        self.assertEqual(result[i, j], len(cell))
+                    elif len(cell) == 0:
+                        self.assertEqual(result[i, j], newgrid.nodata)
+                    elif method == "mode":
+                        counts = np.bincount(cell)
+                        self.assertEqual(result[i, j], counts.argmax())
+                    else:
+                        self.assertAlmostEqual(result[i, j],
+                                               getattr(np, method)(cell))
+        return
+
+    def test_resample_aggregate_finer(self):
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=np.zeros((10, 10)))
+        with self.assertRaises(karta.errors.GridError):
+            grid.resample(0.5, 2.0, method="mean")
+        return
+
+    def test_reproject(self):
+        d = 0.05
+        grid = karta.RegularGrid([0.0, 40.0, d, d, 0.0, 0.0],
+                                 values=np.zeros((200, 300)),
+                                 crs=karta.crs.LonLatWGS84)
+        lon, lat = grid.center_coords()
+        grid = karta.RegularGrid([0.0, 40.0, d, d, 0.0, 0.0],
+                                 values=lon + 2*lat, crs=karta.crs.LonLatWGS84,
+                                 bandkwargs=dict(chunksize=(64, 64)))
+        newgrid = grid.reproject(karta.crs.WebMercator, tilesize=(50, 50),
+                                 nthreads=2)
+        self.assertEqual(newgrid.crs, karta.crs.WebMercator)
+        self.assertEqual(newgrid.transform[4:], (0.0, 0.0))
+
+        x, y = newgrid.center_coords()
+        lon, lat = karta.crs.WebMercator.transform(karta.crs.LonLatWGS84, x, y)
+        values = newgrid[:,:]
+        interior = (lon > 0.1) & (lon < 14.9) & (lat > 40.1) & (lat < 49.9)
+        outside = (lon < -0.1) | (lon > 15.1) | (lat < 39.9) | (lat > 50.1)
+        self.assertTrue(np.all(np.abs(values - (lon + 2*lat))[interior] < 0.05*d))
+        self.assertTrue(np.all(np.isnan(values[outside])))
+
+        nearest = grid.reproject(karta.crs.WebMercator, resolution=(5000, 4000),
+                                 method="nearest")
+        self.assertEqual(nearest.transform[2:4], (5000.0, 4000.0))
+        v = nearest[:,:]
+        v = v[~np.isnan(v)]
+        self.assertTrue(np.all(np.in1d(v, grid[:,:])))
+        return
+
     def test_get_indices(self):
         ind = self.rast.get_indices(15.0, 15.0)
         self.assertEqual(tuple(ind), (0, 0))
@@ -452,11 +842,337 @@ class RegularGridTests(unittest.TestCase):
         self.assertTrue(np.sum(np.abs(Xg**2+Yg**3-grid[:,:]))/Xg.size < 0.45)
         return
 
+    def test_gridpoints_statistics(self):
+        np.random.seed(49)
+        x = np.random.rand(5000)*10.0
+        y = np.random.rand(5000)*5.0
+        z = np.random.randint(0, 1000, 5000).astype(np.int32)
+        T = [-0.5, -0.5, 1.0, 1.0, 0.0, 0.0]
+        grid = karta.raster.gridpoints(x, y, z, T, karta.crs.Cartesian,
+                                       statistics=("count", "min", "max", "std",
+                                                   "median", "sum"),
+                                       percentiles=(10, 90))
+        self.assertEqual(len(grid.bands), 8)
+        values = grid[:,:]
+        I, J = np.round(y).astype(int), np.round(x).astype(int)
+        for i, j in [(0, 0), (2, 3), (5, 10), (4, 7)]:
+            cell = z[(I == i) & (J == j)]
+            expected = [len(cell), cell.min(), cell.max(), cell.std(),
+                        np.median(cell), cell.sum(),
+                        np.percentile(cell, 10), np.percentile(cell, 90)]
+            self.assertTrue(np.allclose(values[i,j], expected))
+        return
+
+    def test_point_accumulator_batches(self):
+        np.random.seed(49)
+        x = np.random.rand(10000)*8.0
+        y = np.random.rand(10000)*8.0
+        z = x + y + np.random.rand(10000)
+        T = [0.0, 0.0, 1.0, 1.0, 0.0, 0.0]
+        whole = karta.raster.gridpoints(x, y, z, T, karta.crs.Cartesian,
+                                        statistics=("mean", "std", "median"))
+
+        acc = karta.raster.PointAccumulator(T, (6, 6), statistics=("mean", "std", "median"),
+                                            striprows=2)
+        self.assertEqual(acc.add([100.0], [100.0], [1.0]), 0)
+        for k in range(0, 10000, 3000):
+            acc.add(x[k:k+3000], y[k:k+3000], z[k:k+3000])
+        grid = acc.to_grid()
+        self.assertEqual(grid.size, (6, 6))
+        self.assertTrue(np.allclose(grid[:,:], whole[:6,:6]))
+        empty = karta.raster.PointAccumulator(T, (3, 3)).to_grid()
+        self.assertTrue(np.all(np.isnan(empty[:,:])))
+        return
+
+    def test_point_accumulator_allocates_requested(self):
+        T = [0.0, 0.0, 1.0, 1.0, 0.0, 0.0]
+        acc = karta.raster.PointAccumulator(T, (3, 3), statistics=("sum", "max"))
+        self.assertTrue(acc._mean is None and acc._m2 is None and acc._min is None)
+        acc.add([0.0, 0.2, 2.0], [0.0, 0.1, 1.0], [1.0, 4.0, 2.0])
+        values = acc.to_grid()[:,:]
+        self.assertEqual(values[0,0,0], 5.0)
+        self.assertEqual(values[1,2,1], 2.0)
+        self.assertEqual(values[2,2,0], 0.0)
+        self.assertTrue(np.isnan(values[2,2,1]))
+
+        acc = karta.raster.PointAccumulator(T, (3, 3), statistics=("sum",))
+        self.assertTrue(acc._count is None)
+        acc.add([1.0], [1.0], [3.0])
+        self.assertEqual(acc.to_grid()[1,1], 3.0)
+        return
+
+    def test_rasterize(self):
+        T = [0.0, 0.0, 1.0, 1.0, 0.0, 0.0]
+        line = karta.Line([(0.5, 0.5), (9.5, 3.5)])
+        grid = karta.raster.rasterize(line, transform=T, size=(10, 10),
+                                      dtype=np.int32, nodata_value=0,
+                                      bandkwargs=dict(chunksize=(3, 3)))
+        self.assertEqual(grid.bands[0].dtype, np.int32)
+        self.assertEqual(grid[:,:].sum(), 10)
+        self.assertTrue(np.all(grid[:,:].sum(axis=0) == 1))
+        touched = karta.raster.rasterize(line, transform=T, size=(10, 10),
+                                         all_touched=True, dtype=np.int32,
+                                         nodata_value=0)
+        self.assertEqual(touched[:,:].sum(), 13)
+        self.assertTrue(np.all(touched[:,:] >= grid[:,:]))
+
+        # lines sharing a cell add once each
+        lines = karta.Multiline([[(0.5, 0.5), (5.5, 0.5), (5.5, 5.5)],
+                                 [(0.5, 5.5), (5.5, 0.5)]], data={"w": [2, 3]})
+        grid = karta.raster.rasterize(lines, transform=T, size=(7, 7),
+                                      field="w", merge="add",
+                                      bandkwargs=dict(chunksize=(2, 2)))
+        self.assertEqual(grid[0,5], 5)
+        self.assertEqual(grid[5,5], 2)
+        self.assertEqual(np.nansum(grid[:,:]), 2*11 + 3*6)
+
+        poly = karta.Polygon([(0, 0), (4, 0), (4, 4), (0, 4)],
+                             properties={"v": 10})
+        points = karta.Multipoint([(1.5, 1.5), (1.2, 1.7), (3, 3)],
+                                  data={"v": [1, 2, 5]})
+        grid = karta.raster.rasterize([poly, points], transform=T, size=(5, 5),
+                                      field="v", merge="add")
+        self.assertEqual(grid[1,1], 13)
+        self.assertEqual(grid[3,3], 15)
+        self.assertEqual(np.isnan(grid[:,:]).sum(), 9)
+        same = karta.raster.rasterize(points, grid=grid, field="v",
+                                      merge="min")
+        self.assertTrue(same is grid)
+        self.assertEqual(grid[1,1], 1)
+        self.assertEqual(grid[0,0], 10)
+        return
+
+    def test_contour(self):
+        y, x = np.mgrid[0:50, 0:60] + 0.5
+        r = np.hypot(x-30, y-25)
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=r,
+                                 bandkwargs=dict(chunksize=(7, 9)))
+        lines = karta.raster.contour(grid, [5.2, 10.7, 28.0, 40.0])
+        self.assertEqual(lines.d["level"], [5.2, 10.7, 28.0, 28.0])
+        for line, level in zip(lines, lines.d["level"]):
+            v = np.array(line.vertices)
+            self.assertTrue(np.allclose(np.hypot(v[:,0]-30, v[:,1]-25),
+                                        level, atol=0.02))
+        # circles are closed and cross chunk boundaries; the outer contour is
+        # cut by the top and bottom of the grid
+        for line in lines[:2]:
+            self.assertEqual(line.vertices[0], line.vertices[-1])
+        whole = karta.raster.contour(grid, [5.2, 10.7, 28.0],
+                                     chunksize=(100, 100))
+        self.assertEqual([len(line.vertices) for line in whole],
+                         [len(line.vertices) for line in lines])
+
+        r[25,:] = -1
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=r,
+                                 nodata_value=-1)
+        lines = karta.raster.contour(grid, 10.7)
+        self.assertEqual(len(lines), 2)
+        return
+
+    def test_map_blocks(self):
+        np.random.seed(49)
+        values = np.random.rand(100, 130)
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0], values=values,
+                                 bandclass=karta.raster.CompressedBand,
+                                 bandkwargs=dict(chunksize=(16, 32)))
+        padded = np.pad(values, 1, "constant", constant_values=np.nan)
+        expected = _smooth(padded)[1:-1,1:-1]
+        for executor in ("thread", "process"):
+            result = grid.map_blocks(_smooth, overlap=(1, 1), workers=2,
+                                     executor=executor)
+            self.assertEqual(result.size, grid.size)
+            self.assertEqual(result.bands[0]._chunksize, (16, 32))
+            self.assertTrue(np.allclose(result[:,:], expected, equal_nan=True))
+
+        # blocks of a window line up with the chunks of the parent band
+        window = grid.window(5, 85, 10, 120)
+        self.assertEqual(window.bands[0]._chunksize, (16, 32))
+        shapes = []
+        def record(block):
+            shapes.append(block.shape)
+            return 2*block
+        result = window.map_blocks(record, workers=1)
+        self.assertTrue(np.allclose(result[:,:], 2*values[5:85,10:120]))
+        self.assertEqual(shapes[0], (11, 22))
+        self.assertEqual(shapes[1], (11, 32))
+        self.assertEqual(shapes[-1], (5, 24))
+
+        grid = karta.RegularGrid([0.0, 0.0, 1.0, 1.0, 0.0, 0.0],
+                                 values=np.dstack([values, 2*values]))
+        result = grid.map_blocks(lambda block: block.sum(axis=2),
+                                 out_dtype=np.float32, blocksize=(30, 30))
+        self.assertEqual(len(result.bands), 1)
+        self.assertEqual(result.bands[0].dtype, np.float32)
+        self.assertTrue(np.allclose(result[:,:], 3*values))
+
+        with self.assertRaises(karta.errors.GridError):
+            grid.map_blocks(lambda block: block[1:])
+        return
+
     def test_read_aai(self):
         grid = karta.read_aai(os.path.join(TESTDATA,'peaks49.asc'))
         self.assertTrue(np.all(grid[::-1] == self.rast[:,:]))
         return
 
+    def test_mmapband_grid(self):
+        grid = karta.RegularGrid((0.0, 0.0, 30.0, 30.0, 0.0, 0.0),
+                                 values=peaks(n=49),
+                                 bandclass=karta.raster.MmapBand)
+        self.assertTrue(isinstance(grid.bands[0], karta.raster.MmapBand))
+        self.assertTrue(np.all(grid[:,:] == self.rast[:,:]))
+        clipped = grid.clip(500, 950, 500, 950)
+        self.assertEqual(clipped.size, (15, 15))
+        grid2 = grid.copy()
+        grid2[:,:] = 0.0
+        self.assertTrue(np.all(grid[:,:] == self.rast[:,:]))
+        return
+
+    def test_bandkwargs(self):
+        grid = karta.RegularGrid((500, 500, 30, 30, 0, 0), values=peaks(50),
+                                 bandkwargs=dict(chunksize=(16, 16),
+                                                 cname="zlib", clevel=1))
+        self.assertEqual(grid.bands[0]._chunksize, (16, 16))
+        self.assertEqual(grid.bands[0].cname, "zlib")
+        newgrid = grid.resize([380, 320, 380+30*60, 320+30*62])
+        self.assertEqual(newgrid.bands[0].cname, "zlib")
+        self.assertEqual(newgrid.bands[0].clevel, 1)
+        self.assertTrue(np.all(newgrid[6:56,4:54] == grid[:,:]))
+        return
+
+    def test_chunkstore_roundtrip(self):
+        grid = karta.RegularGrid((500, 500, 30, 30, 0, 0), values=peaks(50),
+                                 crs=karta.crs.LonLatWGS84, nodata_value=-1,
+                                 bandkwargs=dict(chunksize=(16, 16),
+                                                 cname="zlib", clevel=1))
+        grid[:16,:16] = 3.0
+        path = tempfile.mkdtemp()
+        try:
+            grid.to_chunkstore(path)
+            newgrid = karta.raster.read_chunkstore(path)
+            self.assertTrue(np.all(newgrid[:,:] == grid[:,:]))
+            self.assertEqual(newgrid.transform, grid.transform)
+            self.assertEqual(newgrid.nodata, -1)
+            self.assertEqual(newgrid.crs.get_proj4(), grid.crs.get_proj4())
+            self.assertEqual(newgrid.bands[0]._chunksize, (16, 16))
+            self.assertEqual(newgrid.bands[0].cname, "zlib")
+            self.assertEqual(newgrid.bands[0].chunkstatus[0],
+                             newgrid.bands[0].CHUNKUNIFORM)
+        finally:
+            shutil.rmtree(path)
+        return
+
+    def test_chunkstore_simpleband(self):
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(50),
+                                 bandclass=karta.raster.SimpleBand)
+        path = tempfile.mkdtemp()
+        try:
+            grid.to_chunkstore(path, chunksize=(20, 20))
+            newgrid = karta.raster.read_chunkstore(path)
+            self.assertEqual(newgrid.bands[0]._chunksize, (20, 20))
+            self.assertTrue(np.all(newgrid[:,:] == grid[:,:]))
+        finally:
+            shutil.rmtree(path)
+        return
+
+    def test_chunkstore_lazy(self):
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(64),
+                                 bandkwargs=dict(chunksize=(16, 16)))
+        path = tempfile.mkdtemp()
+        try:
+            grid.to_chunkstore(path)
+            newgrid = karta.raster.read_chunkstore(path)
+            band = newgrid.bands[0]
+            self.assertEqual(band.nbytes, 0)
+            self.assertEqual(len(band.cache), 0)
+            self.assertTrue(np.all(newgrid[20:30,34:44] == grid[20:30,34:44]))
+            self.assertEqual(len(band.cache), 1)
+
+            # modified grid can be written to a new store but not its own
+            newgrid[0,0] = -5.0
+            with self.assertRaises(karta.errors.GridIOError):
+                newgrid.to_chunkstore(path)
+            path2 = tempfile.mkdtemp()
+            try:
+                newgrid.to_chunkstore(path2)
+                grid2 = karta.raster.read_chunkstore(path2)
+                self.assertEqual(grid2[0,0], -5.0)
+                self.assertTrue(np.all(grid2[1:,:] == grid[1:,:]))
+            finally:
+                shutil.rmtree(path2)
+        finally:
+            shutil.rmtree(path)
+        return
+
+    def test_chunkstore_overwrite_fewer_bands(self):
+        values = np.dstack([peaks(32), 2*peaks(32), 3*peaks(32)])
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=values)
+        path = tempfile.mkdtemp()
+        try:
+            grid.to_chunkstore(path)
+            karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(32)).to_chunkstore(path)
+            self.assertEqual(sorted(n for n in os.listdir(path) if n.startswith("band")),
+                             ["band0"])
+            self.assertEqual(len(karta.raster.read_chunkstore(path).bands), 1)
+        finally:
+            shutil.rmtree(path)
+        return
+
+    def test_chunkstore_corrupt_chunk(self):
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=peaks(32),
+                                 bandkwargs=dict(chunksize=(16, 16)))
+        path = tempfile.mkdtemp()
+        try:
+            grid.to_chunkstore(path)
+            chunkpath = os.path.join(path, "band0", "0")
+            with open(chunkpath, "rb") as f:
+                data = f.read()
+            with open(chunkpath, "wb") as f:
+                f.write(data[:len(data)//2])
+            newgrid = karta.raster.read_chunkstore(path)
+            self.assertTrue(np.all(newgrid[16:,16:] == grid[16:,16:]))
+            with self.assertRaises(karta.errors.GridIOError):
+                newgrid[:16,:16]
+        finally:
+            shutil.rmtree(path)
+        return
+
+    def test_interleaved_grid(self):
+        values = np.dstack([peaks(50), 2*peaks(50), 3*peaks(50)])
+        grid = karta.RegularGrid((500, 500, 30, 30, 0, 0), values=values,
+                                 bandclass=karta.raster.band.InterleavedBand,
+                                 bandkwargs=dict(chunksize=(16, 16)))
+        self.assertEqual(len(grid.bands), 3)
+        self.assertEqual(grid.bands[0].store.nbands, 3)
+        self.assertTrue(np.all(grid[:,:] == values))
+        self.assertTrue(np.all(grid[10:20,5:45,2] == values[10:20,5:45,2]))
+
+        newgrid = grid.resize([380, 320, 380+30*60, 320+30*62])
+        self.assertTrue(newgrid.bands[0].store is newgrid.bands[2].store)
+        self.assertTrue(np.all(newgrid[6:56,4:54] == values))
+        self.assertTrue(np.isnan(newgrid[0,0,1]))
+        return
+
+    def test_interleaved_window_newbands(self):
+        values = np.dstack([peaks(50), 2*peaks(50)])
+        grid = karta.RegularGrid((0, 0, 1, 1, 0, 0), values=values,
+                                 bandclass=karta.raster.band.InterleavedBand,
+                                 bandkwargs=dict(chunksize=(16, 16)))
+        win = grid.window(2, 12, 3, 15)
+
+        resized = win.resize([3, 2, 17, 14])
+        self.assertTrue(resized.bands[0].store is resized.bands[1].store)
+        self.assertTrue(np.all(resized[:10,:12] == values[2:12,3:15]))
+
+        coarse = win.resample(2, 2, method="mean")
+        self.assertEqual(coarse.size, (5, 6))
+        self.assertTrue(np.allclose(coarse[0,0],
+                                    values[2:4,3:5].mean(axis=(0, 1))))
+
+        poly = karta.Polygon([(5, 4), (9, 4), (9, 8), (5, 8)])
+        masked = win.mask_by_poly(poly)
+        self.assertEqual(np.isfinite(masked[:,:,0]).sum(), 16)
+        return
+
     def test_set_nodata(self):
         v = np.arange(64, dtype=np.float64).reshape([8,8])
         v[2:4, 5:7] = -1